@@ -1,4 +1,10 @@
-from flask import Flask, jsonify
+import os
+import threading
+import time
+import weakref
+from functools import wraps
+import click
+from flask import Flask, jsonify, g
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from pymongo import MongoClient
@@ -7,14 +13,91 @@ import redis
 
 from app.config import config
 from app.models.mysql_models import db
+from app.services.metricas_pools import (
+    MetricasPool, QueuePoolInstrumentado, ListenerPoolMongo,
+    BlockingConnectionPoolInstrumentado, instrumentar_driver_neo4j, snapshot_sqlalchemy
+)
+from app.services.json_bson import ProveedorJSONBson
+from app.services.consultas_grafo import (
+    validar_consultas, configurar_acceso, abrir_sesion, metricas_consultas, CONSULTAS
+)
+from app.services.cribado_ventas import POLITICAS as POLITICAS_CRIBADO
 
-# Instancias globales
+# Instancias globales (se crean de forma perezosa en cada proceso)
 mongo_client = None
 mongo_db = None
 redis_client = None
+redis_cribado = None
 neo4j_driver = None
 jwt = JWTManager()
 
+# Configuración de la última app creada, usada por los getters perezosos
+_config = None
+_lock_clientes = threading.Lock()
+_apps = weakref.WeakSet()
+
+# Métricas de saturación de los pools (MySQL se lee de cada engine)
+metricas_mongo = MetricasPool()
+metricas_neo4j = MetricasPool()
+
+# Tiempos de arranque del proceso actual
+metricas_proceso = {
+    'pid': os.getpid(),
+    'creado_por_fork': False,
+    'creacion_app_ms': None,
+    'primera_peticion_ms': None,
+    'inicializacion_backends_ms': {}
+}
+
+
+def _descartar_clientes():
+    """Olvida los clientes de backends para que se creen de nuevo al usarse"""
+    global mongo_client, mongo_db, redis_client, redis_cribado, neo4j_driver, metricas_mongo, metricas_neo4j
+    mongo_client = None
+    mongo_db = None
+    redis_client = None
+    redis_cribado = None
+    neo4j_driver = None
+    metricas_mongo = MetricasPool()
+    metricas_neo4j = MetricasPool()
+    metricas_proceso['inicializacion_backends_ms'] = {}
+
+
+def _reiniciar_tras_fork():
+    """
+    Hook after_in_child de os.fork: el worker no debe reutilizar sockets
+    del proceso padre. Los clientes se recrean en el primer uso y los
+    pools de SQLAlchemy se descartan sin cerrar las conexiones del padre.
+    """
+    global _lock_clientes
+    _lock_clientes = threading.Lock()
+    _descartar_clientes()
+    
+    metricas_proceso.update({
+        'pid': os.getpid(),
+        'creado_por_fork': True,
+        'primera_peticion_ms': None
+    })
+    
+    for app in list(_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def _inicializar(nombre, fabrica):
+    """Crea un cliente midiendo el tiempo de inicialización"""
+    inicio = time.perf_counter()
+    cliente = fabrica()
+    metricas_proceso['inicializacion_backends_ms'][nombre] = round(
+        (time.perf_counter() - inicio) * 1000, 3
+    )
+    return cliente
+
 
 # Manejadores de errores JWT
 @jwt.expired_token_loader
@@ -35,37 +118,45 @@ def missing_token_callback(error):
 def create_app(config_name='development'):
     """Factory para crear la aplicación Flask"""
     
+    inicio_arranque = time.perf_counter()
+    
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    app.json = ProveedorJSONBson(app)
+    
+    # Un error en el registro de consultas Cypher impide arrancar
+    validar_consultas()
+    if app.config['CRIBADO_POLITICA'] not in POLITICAS_CRIBADO:
+        raise ValueError(f"CRIBADO_POLITICA debe ser una de {POLITICAS_CRIBADO}")
+    configurar_acceso(
+        database=app.config['NEO4J_DATABASE'],
+        timeout=app.config['NEO4J_QUERY_TIMEOUT'],
+        max_filas=app.config['NEO4J_MAX_FILAS']
+    )
     
     # Inicializar extensiones
     CORS(app)
     jwt.init_app(app)
     
-    # Inicializar MySQL (SQLAlchemy)
+    # Inicializar MySQL (SQLAlchemy) con pool instrumentado; las réplicas
+    # usan la misma configuración de pool que el primario
+    opciones_engine = {
+        'poolclass': QueuePoolInstrumentado,
+        **app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    }
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_engine
+    app.config['SQLALCHEMY_BINDS'] = {
+        clave: {**opciones_engine, 'url': valor} if isinstance(valor, str) else valor
+        for clave, valor in app.config.get('SQLALCHEMY_BINDS', {}).items()
+    }
     db.init_app(app)
     
-    # Inicializar MongoDB
-    global mongo_client, mongo_db
-    mongo_client = MongoClient(app.config['MONGODB_URI'])
-    mongo_db = mongo_client[app.config['MONGODB_DATABASE']]
-    
-    # Inicializar Redis
-    global redis_client
-    redis_client = redis.Redis(
-        host=app.config['REDIS_HOST'],
-        port=app.config['REDIS_PORT'],
-        password=app.config['REDIS_PASSWORD'],
-        db=app.config['REDIS_DB'],
-        decode_responses=True
-    )
-    
-    # Inicializar Neo4j
-    global neo4j_driver
-    neo4j_driver = GraphDatabase.driver(
-        app.config['NEO4J_URI'],
-        auth=(app.config['NEO4J_USER'], app.config['NEO4J_PASSWORD'])
-    )
+    # MongoDB, Redis y Neo4j se inicializan de forma perezosa en el primer
+    # uso de cada proceso (get_mongo_db, get_redis_client, get_neo4j_driver)
+    global _config
+    _config = app.config
+    _descartar_clientes()
+    _apps.add(app)
     
     # Registrar Blueprints
     from app.routes import auth, inventario, ensayos, interacciones
@@ -75,9 +166,157 @@ def create_app(config_name='development'):
     app.register_blueprint(ensayos.bp)
     app.register_blueprint(interacciones.bp)
     
-    # Crear tablas si no existen
-    with app.app_context():
-        db.create_all()
+    # Crear tablas: comando explícito, no en cada arranque
+    @app.cli.command('init-db')
+    def init_db():
+        """Crear las tablas MySQL (solo en el primario), los índices de MongoDB y migrar efectos adversos"""
+        from app.services.indices_ensayos import asegurar_indices_ensayos
+        from app.services.efectos_adversos import EfectosAdversosService
+        from app.services.cadena_frio import asegurar_colecciones_temperatura
+        
+        db.create_all(bind_key=None)
+        click.echo('Tablas creadas')
+        
+        indices = asegurar_indices_ensayos(get_mongo_db())
+        click.echo(f"Índices de ensayos_clinicos: {', '.join(indices)}")
+        
+        asegurar_colecciones_temperatura(get_mongo_db())
+        click.echo('Colecciones de cadena de frío listas')
+        
+        migrados, pendientes = EfectosAdversosService.migrar_embebidos(get_mongo_db())
+        click.echo(f'Efectos adversos migrados a buckets: {migrados}')
+        if pendientes:
+            click.echo(f"Ensayos con efectos no convertibles: {', '.join(map(str, pendientes))}")
+    
+    @app.cli.command('reconstruir-estadisticas')
+    def reconstruir_estadisticas():
+        """Recalcular el resumen de estadísticas de ensayos (programar con cron)"""
+        from app.services.estadisticas_ensayos import EstadisticasEnsayosService
+        
+        total = EstadisticasEnsayosService.reconstruir(
+            get_redis_client(), get_mongo_db().ensayos_clinicos
+        )
+        click.echo(f'Estadísticas reconstruidas a partir de {total} ensayos')
+    
+    @app.cli.command('consumir-cambios-ensayos')
+    def consumir_cambios_ensayos():
+        """Mantener las estadísticas desde el change stream de ensayos_clinicos"""
+        from app.services.estadisticas_ensayos import EstadisticasEnsayosService
+        
+        EstadisticasEnsayosService.consumir_cambios(
+            get_redis_client(), get_mongo_db().ensayos_clinicos,
+            al_aplicar=lambda cambio: click.echo(
+                f"{cambio['operationType']} {cambio['documentKey']['_id']}"
+            )
+        )
+    
+    @app.cli.command('materializar-interacciones-inferidas')
+    def materializar_interacciones_inferidas():
+        """Recalcular las interacciones por principio activo y categoría (programar con cron)"""
+        from app.services.inferencia_interacciones import InferenciaInteraccionesService
+        
+        resultado = InferenciaInteraccionesService.materializar(get_neo4j_driver(), get_redis_client())
+        for via, escritas in resultado['escritas'].items():
+            click.echo(f'{via}: {escritas} pares de clases')
+        click.echo(f"Obsoletas borradas: {resultado['borradas']}; versión del grafo {resultado['version']}")
+    
+    @app.cli.command('cargar-grafo')
+    @click.argument('directorio', type=click.Path(exists=True, file_okay=False))
+    @click.option('--lote', default=5000, show_default=True, help='Filas por transacción UNWIND')
+    def cargar_grafo(directorio, lote):
+        """Cargar compuestos, principios activos, medicamentos, categorías e interacciones (CSV/NDJSON)"""
+        from app.services.carga_grafo import CargaGrafoService
+        
+        def mostrar(entidad, informe):
+            click.echo(f"{entidad.nombre:<20} {informe['filas']:>9} filas  {informe['escritas']:>9} escritas  "
+                       f"{informe['sin_cambios']:>9} sin cambios  {informe['borradas']:>6} borradas  "
+                       f"{informe['filas_por_segundo'] or 0:>8} filas/s")
+            if informe['sin_extremos']:
+                click.echo(f"  {informe['sin_extremos']} relaciones con nodos inexistentes")
+            for error in informe['errores']:
+                click.echo(f"  línea {error['linea']}: {error['error']}")
+        
+        resultado = CargaGrafoService.cargar(get_neo4j_driver(), get_redis_client(), directorio,
+                                             tamano_lote=lote, al_cargar=mostrar)
+        click.echo(f"Nodos/s: {resultado['nodos_por_segundo']}  Relaciones/s: {resultado['relaciones_por_segundo']}  "
+                   f"Total: {resultado['segundos']} s")
+        if resultado['cambios']:
+            click.echo('Recalcular después: flask materializar-interacciones-inferidas, flask actualizar-sustitutos')
+    
+    @app.cli.command('actualizar-sustitutos')
+    @click.option('--completo', is_flag=True, help='Recalcular todas las listas')
+    def actualizar_sustitutos(completo):
+        """Actualizar el índice de sustitutos terapéuticos (solo los medicamentos cambiados)"""
+        from app.services.sustitucion import SustitucionService
+        
+        resultado = SustitucionService.actualizar(get_neo4j_driver(), get_redis_client(), completo)
+        click.echo(f"{resultado['medicamentos']} medicamentos, {resultado['cambiados']} cambiados, "
+                   f"{resultado['listas_actualizadas']} listas actualizadas, {resultado['borrados']} borrados")
+    
+    @app.cli.command('sincronizar-interacciones')
+    @click.option('--lote', default=500, show_default=True, help='Eventos del outbox por transacción')
+    @click.option('--intervalo', default=1.0, show_default=True, help='Segundos entre sondeos con el outbox vacío')
+    @click.option('--una-vez', is_flag=True, help='Terminar al vaciar el outbox')
+    @click.option('--completo', is_flag=True, help='Encolar antes todas las interacciones existentes')
+    @click.option('--espera-huecos', default=5.0, show_default=True,
+                  help='Segundos que se espera a un id del outbox aún sin confirmar')
+    @click.option('--revision-huecos', default=3600, show_default=True,
+                  help='Segundos que se siguen buscando los ids saltados')
+    def sincronizar_interacciones(lote, intervalo, una_vez, completo, espera_huecos, revision_huecos):
+        """Aplicar en Neo4j los cambios de interacciones_medicamentosas (outbox)"""
+        from app.services.sincronizacion_interacciones import SincronizacionInteraccionesService
+        
+        if completo:
+            click.echo(f'Encoladas {SincronizacionInteraccionesService.encolar_todas()} interacciones')
+        
+        def mostrar(resultado):
+            click.echo(f"hasta {resultado['watermark']}: {resultado['eventos']} eventos, "
+                       f"{resultado['escritas']} escritas, {resultado['borradas']} borradas, "
+                       f"{resultado['sin_mapeo']} sin medicamento_id, {resultado['sin_nodo']} sin nodo, "
+                       f"{resultado['tardios']} tardíos, {resultado['huecos_pendientes']} huecos en revisión  "
+                       f"{resultado['eventos_por_segundo']} eventos/s  lag {resultado['lag_segundos']} s")
+        
+        watermark = SincronizacionInteraccionesService.consumir(
+            get_neo4j_driver(), get_redis_client(), tamano_lote=lote, intervalo=intervalo,
+            una_vez=una_vez, al_aplicar=mostrar, espera_huecos=espera_huecos,
+            revision_huecos=revision_huecos
+        )
+        click.echo(f'Outbox aplicado hasta {watermark}')
+    
+    @app.cli.command('validar-consultas-grafo')
+    def validar_consultas_grafo():
+        """Compilar con EXPLAIN cada consulta del registro contra Neo4j"""
+        fallidas = 0
+        with abrir_sesion(get_neo4j_driver()) as session:
+            for nombre, consulta in CONSULTAS.items():
+                try:
+                    session.run('EXPLAIN ' + consulta.texto,
+                                {p: None for p in consulta.parametros}).consume()
+                    click.echo(f'ok     {nombre}')
+                except Exception as e:
+                    fallidas += 1
+                    click.echo(f'error  {nombre}: {e}')
+        if fallidas:
+            raise SystemExit(1)
+    
+    # Latencia de la primera petición de cada proceso
+    @app.before_request
+    def marcar_primera_peticion():
+        if metricas_proceso['primera_peticion_ms'] is None:
+            g.inicio_primera_peticion = time.perf_counter()
+    
+    @app.after_request
+    def medir_primera_peticion(response):
+        inicio = g.pop('inicio_primera_peticion', None)
+        if inicio is not None and metricas_proceso['primera_peticion_ms'] is None:
+            metricas_proceso['primera_peticion_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+            app.logger.info(
+                'Proceso %s: creación de app %s ms, primera petición %s ms, backends %s',
+                metricas_proceso['pid'], metricas_proceso['creacion_app_ms'],
+                metricas_proceso['primera_peticion_ms'],
+                metricas_proceso['inicializacion_backends_ms']
+            )
+        return response
     
     # Ruta de prueba
     @app.route('/health')
@@ -90,19 +329,145 @@ def create_app(config_name='development'):
             'neo4j': 'connected'
         }
     
+    def metricas_protegidas(vista):
+        """Las rutas /metrics/* son solo para gerentes salvo METRICAS_PUBLICAS"""
+        from app.middleware.auth_middleware import solo_gerente
+        
+        if app.config['METRICAS_PUBLICAS']:
+            return vista
+        
+        @wraps(vista)
+        def con_usuario(usuario):
+            return vista()
+        return solo_gerente(con_usuario)
+    
+    # Métricas de pools de conexiones
+    @app.route('/metrics/pools')
+    @metricas_protegidas
+    def metricas_pools():
+        return {
+            'mysql': snapshot_sqlalchemy(db.engines),
+            'mongodb': {
+                **metricas_mongo.snapshot(),
+                'tamano_max': app.config['MONGODB_POOL_OPTIONS']['maxPoolSize']
+            },
+            'redis': {
+                **(redis_client.connection_pool.metricas.snapshot()
+                   if redis_client is not None else MetricasPool().snapshot()),
+                'tamano_max': app.config['REDIS_MAX_CONNECTIONS']
+            },
+            'neo4j': {
+                **metricas_neo4j.snapshot(),
+                'tamano_max': app.config['NEO4J_MAX_POOL_SIZE']
+            }
+        }
+    
+    # Tiempos por consulta Cypher registrada
+    @app.route('/metrics/consultas-grafo')
+    @metricas_protegidas
+    def metricas_consultas_grafo():
+        return metricas_consultas.snapshot()
+    
+    # Lag y rendimiento de la sincronización MySQL -> Neo4j de interacciones
+    @app.route('/metrics/sincronizacion-interacciones')
+    @metricas_protegidas
+    def metricas_sincronizacion_interacciones():
+        from app.services.sincronizacion_interacciones import SincronizacionInteraccionesService
+        
+        return SincronizacionInteraccionesService.metricas(get_neo4j_driver(), get_redis_client())
+    
+    # Tiempos de arranque del proceso que atiende la petición
+    @app.route('/metrics/proceso')
+    @metricas_protegidas
+    def metricas_del_proceso():
+        return dict(metricas_proceso)
+    
+    metricas_proceso['creacion_app_ms'] = round((time.perf_counter() - inicio_arranque) * 1000, 3)
+    
     return app
 
 
 def get_mongo_db():
-    """Obtener instancia de MongoDB"""
+    """Obtener instancia de MongoDB (se crea en el primer uso del proceso)"""
+    global mongo_client, mongo_db
+    if mongo_db is None:
+        with _lock_clientes:
+            if mongo_db is None:
+                mongo_client = _inicializar('mongodb', lambda: MongoClient(
+                    _config['MONGODB_URI'],
+                    event_listeners=[ListenerPoolMongo(metricas_mongo)],
+                    **_config['MONGODB_POOL_OPTIONS']
+                ))
+                mongo_db = mongo_client[_config['MONGODB_DATABASE']]
     return mongo_db
 
 
 def get_redis_client():
-    """Obtener instancia de Redis"""
+    """Obtener instancia de Redis (se crea en el primer uso del proceso)"""
+    global redis_client
+    if redis_client is None:
+        with _lock_clientes:
+            if redis_client is None:
+                redis_client = _inicializar('redis', lambda: redis.Redis(
+                    connection_pool=BlockingConnectionPoolInstrumentado(
+                        host=_config['REDIS_HOST'],
+                        port=_config['REDIS_PORT'],
+                        password=_config['REDIS_PASSWORD'],
+                        db=_config['REDIS_DB'],
+                        decode_responses=True,
+                        max_connections=_config['REDIS_MAX_CONNECTIONS'],
+                        timeout=_config['REDIS_POOL_TIMEOUT'],
+                        socket_timeout=_config['REDIS_SOCKET_TIMEOUT'],
+                        socket_connect_timeout=_config['REDIS_SOCKET_CONNECT_TIMEOUT'],
+                        health_check_interval=_config['REDIS_HEALTH_CHECK_INTERVAL']
+                    )
+                ))
     return redis_client
 
 
+def get_redis_cribado():
+    """
+    Cliente de Redis del cribado de ventas: pool propio cuyos timeouts
+    (conexión, socket y espera de conexión libre) son CRIBADO_PRESUPUESTO_MS,
+    para que un Redis lento no retenga la venta más que el presupuesto.
+    """
+    global redis_cribado
+    if redis_cribado is None:
+        with _lock_clientes:
+            if redis_cribado is None:
+                presupuesto = _config['CRIBADO_PRESUPUESTO_MS'] / 1000
+                redis_cribado = _inicializar('redis_cribado', lambda: redis.Redis(
+                    connection_pool=BlockingConnectionPoolInstrumentado(
+                        host=_config['REDIS_HOST'],
+                        port=_config['REDIS_PORT'],
+                        password=_config['REDIS_PASSWORD'],
+                        db=_config['REDIS_DB'],
+                        decode_responses=True,
+                        max_connections=_config['REDIS_MAX_CONNECTIONS'],
+                        timeout=presupuesto,
+                        socket_timeout=presupuesto,
+                        socket_connect_timeout=presupuesto,
+                        health_check_interval=_config['REDIS_HEALTH_CHECK_INTERVAL']
+                    )
+                ))
+    return redis_cribado
+
+
 def get_neo4j_driver():
-    """Obtener instancia de Neo4j"""
-    return neo4j_driver
\ No newline at end of file
+    """Obtener instancia de Neo4j (se crea en el primer uso del proceso)"""
+    global neo4j_driver
+    if neo4j_driver is None:
+        with _lock_clientes:
+            if neo4j_driver is None:
+                neo4j_driver = _inicializar('neo4j', lambda: instrumentar_driver_neo4j(
+                    GraphDatabase.driver(
+                        _config['NEO4J_URI'],
+                        auth=(_config['NEO4J_USER'], _config['NEO4J_PASSWORD']),
+                        max_connection_pool_size=_config['NEO4J_MAX_POOL_SIZE'],
+                        connection_acquisition_timeout=_config['NEO4J_ACQUISITION_TIMEOUT'],
+                        max_connection_lifetime=_config['NEO4J_MAX_CONNECTION_LIFETIME'],
+                        connection_timeout=_config['NEO4J_CONNECTION_TIMEOUT']
+                    ),
+                    metricas_neo4j
+                ))
+    return neo4j_driver
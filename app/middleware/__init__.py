@@ -1,5 +1,6 @@
 from app.middleware.auth_middleware import rol_requerido, solo_gerente, gerente_o_farmaceutico, cualquier_usuario_autenticado
 from app.middleware.concurrency import OptimisticLockManager, ConcurrencyException, TransactionRetryManager
+from app.middleware.replicas import lecturas_en_replica
 
 __all__ = [
     'rol_requerido', 
@@ -8,5 +9,6 @@ __all__ = [
     'cualquier_usuario_autenticado',
     'OptimisticLockManager',
     'ConcurrencyException',
-    'TransactionRetryManager'
+    'TransactionRetryManager',
+    'lecturas_en_replica'
 ]
\ No newline at end of file
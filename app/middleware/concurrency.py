@@ -1,5 +1,7 @@
+from datetime import datetime
 from sqlalchemy.exc import SQLAlchemyError
 from app.models.mysql_models import db, Lote, Transaccion
+from app.services.reportes_ventas import ReporteVentasService
 
 
 class ConcurrencyException(Exception):
@@ -7,6 +9,21 @@ class ConcurrencyException(Exception):
     pass
 
 
+class InventarioInsuficienteError(ValueError):
+    """Salida mayor que la cantidad del lote (la ruta ofrece sustitutos)"""
+    
+    def __init__(self, lote, cantidad_solicitada):
+        self.lote_id = lote.id
+        self.producto_id = lote.producto_id
+        self.cantidad_disponible = lote.cantidad_actual
+        self.cantidad_solicitada = cantidad_solicitada
+        super().__init__(
+            f"Inventario insuficiente. "
+            f"Cantidad disponible: {lote.cantidad_actual}, "
+            f"Cantidad solicitada: {cantidad_solicitada}"
+        )
+
+
 class OptimisticLockManager:
     """
     Gestor de control de concurrencia optimista.
@@ -60,28 +77,37 @@ class OptimisticLockManager:
             
             # 4. Validar que no quede negativo
             if nueva_cantidad < 0:
+                error = InventarioInsuficienteError(lote, abs(cantidad_cambio))
                 db.session.rollback()
-                raise ValueError(
-                    f"Inventario insuficiente. "
-                    f"Cantidad disponible: {lote.cantidad_actual}, "
-                    f"Cantidad solicitada: {abs(cantidad_cambio)}"
-                )
+                raise error
             
             # 5. Actualizar cantidad y VERSION
             lote.cantidad_actual = nueva_cantidad
             lote.version += 1  # Incrementar versión
             
             # 6. Registrar la transacción
+            ahora = datetime.utcnow()
             transaccion = Transaccion(
                 lote_id=lote_id,
                 usuario_id=usuario_id,
                 tipo_transaccion=tipo_transaccion,
                 cantidad=abs(cantidad_cambio),
+                fecha_transaccion=ahora,
                 motivo=motivo,
                 referencia=referencia
             )
             
             db.session.add(transaccion)
+            
+            # 7. Acumular la venta en los rollups (misma transacción)
+            if tipo_transaccion == 'salida':
+                ReporteVentasService.registrar_venta(
+                    lote=lote,
+                    usuario_id=usuario_id,
+                    cantidad=abs(cantidad_cambio),
+                    fecha=ahora.date()
+                )
+            
             db.session.commit()
             
             return {
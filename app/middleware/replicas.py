@@ -0,0 +1,69 @@
+from flask import g, request, current_app
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from app import get_redis_client
+
+METODOS_LECTURA = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _clave_escritura(usuario_id):
+    return f"rw_sticky:{usuario_id}"
+
+
+def _usuario_actual():
+    """Identidad del JWT de la petición, o None si no hay token válido"""
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def enrutar_lecturas_a_replica():
+    """
+    before_request: marca la petición para leer de réplica.
+    
+    Solo aplica a métodos de lectura y si el usuario no ha escrito dentro
+    de la ventana READ_YOUR_WRITES_SECONDS (read-your-writes).
+    """
+    g.lectura_en_replica = False
+    
+    if request.method not in METODOS_LECTURA:
+        return
+    
+    if not current_app.config.get('SQLALCHEMY_BINDS'):
+        return
+    
+    usuario_id = _usuario_actual()
+    if usuario_id is not None:
+        try:
+            if get_redis_client().exists(_clave_escritura(usuario_id)):
+                return
+        except Exception:
+            # Sin Redis no podemos garantizar read-your-writes: usar primario
+            return
+    
+    g.lectura_en_replica = True
+
+
+def registrar_escritura(response):
+    """after_request: abre la ventana de lecturas en primario tras una escritura"""
+    if request.method in METODOS_LECTURA or response.status_code >= 400:
+        return response
+    
+    ventana = current_app.config.get('READ_YOUR_WRITES_SECONDS', 0)
+    usuario_id = _usuario_actual()
+    
+    if ventana and usuario_id is not None:
+        try:
+            get_redis_client().setex(_clave_escritura(usuario_id), ventana, 1)
+        except Exception:
+            pass
+    
+    return response
+
+
+def lecturas_en_replica(bp):
+    """Registra el enrutamiento de lecturas a réplicas en un Blueprint"""
+    bp.before_request(enrutar_lecturas_a_replica)
+    bp.after_request(registrar_escritura)
+    return bp
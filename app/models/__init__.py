@@ -1,3 +1,3 @@
-from app.models.mysql_models import db, Usuario, Producto, Lote, Transaccion, Proveedor, InteraccionMedicamentosa
+from app.models.mysql_models import db, Usuario, Producto, Lote, Transaccion, Proveedor, InteraccionMedicamentosa, VentaDiaria, VentaDiariaDetalle
 
-__all__ = ['db', 'Usuario', 'Producto', 'Lote', 'Transaccion', 'Proveedor', 'InteraccionMedicamentosa']
+__all__ = ['db', 'Usuario', 'Producto', 'Lote', 'Transaccion', 'Proveedor', 'InteraccionMedicamentosa', 'VentaDiaria', 'VentaDiariaDetalle']
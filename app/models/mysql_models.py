@@ -2,8 +2,9 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import validates
 import bcrypt
+from app.models.session import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Usuario(db.Model):
@@ -65,6 +66,9 @@ class Proveedor(db.Model):
 class Producto(db.Model):
     """Modelo de Producto/Medicamento"""
     __tablename__ = 'productos'
+    __table_args__ = (
+        db.Index('idx_productos_medicamento', 'medicamento_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     codigo_barras = db.Column(db.String(50), unique=True, nullable=False)
@@ -79,6 +83,8 @@ class Producto(db.Model):
     temperatura_almacenamiento = db.Column(db.Numeric(3, 1))
     requiere_refrigeracion = db.Column(db.Boolean, default=False)
     activo = db.Column(db.Boolean, default=True)
+    # id del nodo Medicamento de Neo4j (interacciones y sustitutos)
+    medicamento_id = db.Column(db.String(50))
     
     # Relaciones
     lotes = db.relationship('Lote', backref='producto', lazy=True)
@@ -94,7 +100,8 @@ class Producto(db.Model):
             'precio_base': float(self.precio_base),
             'temperatura_almacenamiento': float(self.temperatura_almacenamiento) if self.temperatura_almacenamiento else None,
             'requiere_refrigeracion': self.requiere_refrigeracion,
-            'activo': self.activo
+            'activo': self.activo,
+            'medicamento_id': self.medicamento_id
         }
 
 
@@ -199,4 +206,80 @@ class InteraccionMedicamentosa(db.Model):
             'tipo_interaccion': self.tipo_interaccion,
             'descripcion': self.descripcion,
             'recomendaciones': self.recomendaciones
-        }
\ No newline at end of file
+        }
+
+
+class OutboxInteraccion(db.Model):
+    """
+    Cambios de interacciones_medicamentosas pendientes de aplicar en Neo4j.
+    Se escribe en la misma transacción que el cambio (eventos de mapper
+    en sincronizacion_interacciones); el id es el watermark del consumidor.
+    """
+    __tablename__ = 'outbox_interacciones'
+    __table_args__ = (
+        db.Index('idx_outbox_interacciones_fecha', 'fecha'),
+    )
+    
+    id = db.Column(db.BigInteger, primary_key=True)
+    interaccion_id = db.Column(db.Integer, nullable=False)
+    operacion = db.Column(db.Enum('upsert', 'borrar'), nullable=False)
+    producto_a_id = db.Column(db.Integer, nullable=False)
+    producto_b_id = db.Column(db.Integer, nullable=False)
+    severidad = db.Column(db.String(20))
+    descripcion = db.Column(db.Text)
+    recomendaciones = db.Column(db.Text)
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class VentaDiaria(db.Model):
+    """Rollup diario de ventas por producto (mantenido incrementalmente)"""
+    __tablename__ = 'ventas_diarias'
+    __table_args__ = (
+        db.UniqueConstraint('producto_id', 'fecha', name='uq_ventas_diarias_producto_fecha'),
+        db.Index('idx_ventas_diarias_fecha', 'fecha'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'), nullable=False)
+    fecha = db.Column(db.Date, nullable=False)
+    unidades = db.Column(db.Integer, nullable=False, default=0)
+    ingresos = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    num_ventas = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'producto_id': self.producto_id,
+            'fecha': self.fecha.isoformat() if self.fecha else None,
+            'unidades': self.unidades,
+            'ingresos': float(self.ingresos),
+            'num_ventas': self.num_ventas
+        }
+
+
+class VentaDiariaDetalle(db.Model):
+    """Rollup diario de ventas por lote y usuario (mantenido incrementalmente)"""
+    __tablename__ = 'ventas_diarias_detalle'
+    __table_args__ = (
+        db.UniqueConstraint('fecha', 'lote_id', 'usuario_id', name='uq_ventas_detalle_fecha_lote_usuario'),
+        db.Index('idx_ventas_detalle_usuario_fecha', 'usuario_id', 'fecha'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, nullable=False)
+    producto_id = db.Column(db.Integer, db.ForeignKey('productos.id'), nullable=False)
+    lote_id = db.Column(db.Integer, db.ForeignKey('lotes.id'), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    unidades = db.Column(db.Integer, nullable=False, default=0)
+    ingresos = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    num_ventas = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'fecha': self.fecha.isoformat() if self.fecha else None,
+            'producto_id': self.producto_id,
+            'lote_id': self.lote_id,
+            'usuario_id': self.usuario_id,
+            'unidades': self.unidades,
+            'ingresos': float(self.ingresos),
+            'num_ventas': self.num_ventas
+        }
@@ -0,0 +1,43 @@
+import random
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# Prefijo de los binds de SQLALCHEMY_BINDS que apuntan a réplicas de lectura
+PREFIJO_REPLICA = 'replica_'
+
+
+class RoutingSession(Session):
+    """
+    Sesión que envía las lecturas a una réplica cuando la petición actual
+    lo permite (g.lectura_en_replica) y todo lo demás al primario.
+
+    Nunca se elige una réplica para flush, INSERT/UPDATE/DELETE ni
+    SELECT ... FOR UPDATE, así las escrituras siempre llegan al primario.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._usar_replica(clause):
+            replicas = [
+                engine for clave, engine in self._db.engines.items()
+                if clave and clave.startswith(PREFIJO_REPLICA)
+            ]
+            if replicas:
+                return random.choice(replicas)
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _usar_replica(self, clause):
+        if self._flushing or not has_request_context():
+            return False
+
+        if not g.get('lectura_en_replica', False):
+            return False
+
+        if isinstance(clause, UpdateBase):
+            return False
+
+        if getattr(clause, '_for_update_arg', None) is not None:
+            return False
+
+        return True
@@ -1,42 +1,112 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.read_preferences import SecondaryPreferred
 from datetime import datetime
-from app import get_mongo_db
+import redis
+from app import get_mongo_db, get_redis_client
 from app.middleware.auth_middleware import cualquier_usuario_autenticado, gerente_o_farmaceutico
+from app.services.json_bson import OPCIONES_RAW
+from app.services.estadisticas_ensayos import EstadisticasEnsayosService, CAMPOS_ESTADISTICAS
+from app.services.reclutamiento import ReclutamientoService
+from app.services.efectos_adversos import EfectosAdversosService
+from app.services.importacion_ensayos import (
+    preparar_ensayo, parsear_fechas, rechazar_efectos_embebidos, importar_ndjson, exportar_ndjson
+)
+from app.services.consultas_ensayos import (
+    paginar_ensayos, LIMITE_POR_DEFECTO, normalizar_texto,
+    filtro_prefijo_farmaco, filtro_texto_libre, filtro_busqueda_avanzada
+)
 
 bp = Blueprint('ensayos', __name__, url_prefix='/api/ensayos')
 
 
-def serialize_mongo_doc(doc):
-    """Convierte ObjectId a string para JSON"""
-    if doc:
-        doc['_id'] = str(doc['_id'])
-        # Convertir fechas a ISO format
-        for key, value in doc.items():
-            if isinstance(value, datetime):
-                doc[key] = value.isoformat()
-            elif isinstance(value, list):
-                doc[key] = [serialize_mongo_doc(item) if isinstance(item, dict) else item for item in value]
-            elif isinstance(value, dict):
-                doc[key] = serialize_mongo_doc(value)
-    return doc
+def coleccion_ensayos(lectura=False, primario=False):
+    """
+    Colección de ensayos clínicos.
+    
+    Las rutas de solo lectura usan secondaryPreferred con un retraso máximo
+    (MONGODB_MAX_STALENESS_SECONDS); las escrituras van siempre al primario.
+    Las lecturas devuelven RawBSONDocument: los bytes BSON llegan tal cual
+    al proveedor JSON (json_bson) sin decodificarse antes en Python.
+    
+    Con primario=True la lectura no se desvía a secundarios (p. ej. cuando
+    la respuesta lleva la ETag que se enviará luego en If-Match).
+    """
+    collection = get_mongo_db().ensayos_clinicos
+    
+    if lectura and primario:
+        return collection.with_options(codec_options=OPCIONES_RAW)
+    
+    if lectura:
+        return collection.with_options(
+            codec_options=OPCIONES_RAW,
+            read_preference=SecondaryPreferred(
+                max_staleness=current_app.config['MONGODB_MAX_STALENESS_SECONDS']
+            )
+        )
+    
+    return collection
+
+
+def tras_escritura_ensayo(ensayo_id, ensayo):
+    """
+    Aplica una escritura al resumen de estadísticas e invalida la cache de
+    reclutamiento. Un fallo de Redis no invalida la escritura: la siguiente
+    reconstrucción corrige el resumen y la cache expira por TTL.
+    """
+    try:
+        redis_client = get_redis_client()
+        EstadisticasEnsayosService.registrar(redis_client, ensayo_id, ensayo)
+        ReclutamientoService.invalidar(redis_client)
+    except redis.RedisError as e:
+        current_app.logger.warning('No se actualizaron las estadísticas del ensayo %s: %s', ensayo_id, e)
+
+
+def versiones_if_match():
+    """
+    Versiones de documento aceptadas por la cabecera If-Match.
+    
+    La ETag de un ensayo es su metadata.version_documento. Devuelve None si
+    no hay cabecera o es "*" (no se comprueba la versión).
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    
+    try:
+        return [int(etag) for etag in request.if_match.as_set(include_weak=True)]
+    except ValueError:
+        raise ValueError('If-Match debe contener la versión del documento (ETag)')
+
+
+def con_etag(respuesta, ensayo):
+    """Añade la ETag (versión del documento) a una respuesta (response, status)"""
+    version = (ensayo.get('metadata') or {}).get('version_documento')
+    if version is not None:
+        respuesta[0].set_etag(str(version))
+    return respuesta
 
 
 @bp.route('/', methods=['GET'])
 @cualquier_usuario_autenticado
 def listar_ensayos(usuario):
     """
-    Listar todos los ensayos clínicos.
+    Listar ensayos clínicos (paginado).
     
     Query params:
     - fase: Filtrar por fase (1, 2, 3)
     - estado: Filtrar por estado (en_curso, reclutamiento, completado)
-    - farmaco: Buscar por nombre de fármaco
+    - farmaco: Buscar por prefijo del nombre de fármaco (sin distinguir
+      mayúsculas ni acentos)
+    - q: Texto libre sobre farmaco, principio_activo y objetivo_principal
+    - fields: resumen (default) | completo
+    - limite: Tamaño de página (default 50, máximo 200)
+    - cursor: Cursor devuelto en siguiente_cursor de la página anterior
+    - incluir_archivados: true para incluir ensayos archivados
     """
     try:
-        mongo_db = get_mongo_db()
-        collection = mongo_db.ensayos_clinicos
+        collection = coleccion_ensayos(lectura=True)
         
         # Construir filtro
         filtro = {}
@@ -48,19 +118,29 @@ def listar_ensayos(usuario):
             filtro['estado'] = request.args.get('estado')
         
         if request.args.get('farmaco'):
-            filtro['farmaco'] = {'$regex': request.args.get('farmaco'), '$options': 'i'}
-        
-        # Ejecutar consulta
-        ensayos = list(collection.find(filtro))
-        
-        # Serializar resultados
-        ensayos_serializados = [serialize_mongo_doc(e) for e in ensayos]
+            filtro.update(filtro_prefijo_farmaco(request.args.get('farmaco')))
+        
+        if request.args.get('q'):
+            filtro.update(filtro_texto_libre(request.args.get('q')))
+        
+        # Ejecutar consulta paginada
+        ensayos, siguiente_cursor = paginar_ensayos(
+            collection,
+            filtro,
+            fields=request.args.get('fields', 'resumen'),
+            cursor=request.args.get('cursor'),
+            limite=request.args.get('limite', LIMITE_POR_DEFECTO),
+            incluir_archivados=request.args.get('incluir_archivados') == 'true'
+        )
         
         return jsonify({
-            'total': len(ensayos_serializados),
-            'ensayos': ensayos_serializados
+            'total': len(ensayos),
+            'ensayos': ensayos,
+            'siguiente_cursor': siguiente_cursor
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -70,15 +150,16 @@ def listar_ensayos(usuario):
 def obtener_ensayo(usuario, ensayo_id):
     """Obtener un ensayo clínico por ID"""
     try:
-        mongo_db = get_mongo_db()
-        collection = mongo_db.ensayos_clinicos
+        # Desde el primario: un secundario retrasado daría una ETag antigua
+        # y el siguiente PUT con If-Match respondería 412 sin motivo
+        collection = coleccion_ensayos(lectura=True, primario=True)
         
         ensayo = collection.find_one({'_id': ObjectId(ensayo_id)})
         
         if not ensayo:
             return jsonify({'error': 'Ensayo no encontrado'}), 404
         
-        return jsonify(serialize_mongo_doc(ensayo)), 200
+        return con_etag((jsonify(ensayo), 200), ensayo)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -106,41 +187,108 @@ def crear_ensayo(usuario):
     }
     """
     try:
-        data = request.get_json()
-        
-        # Validaciones básicas
-        campos_requeridos = ['codigo_ensayo', 'farmaco', 'fase', 'estado']
-        if not all(k in data for k in campos_requeridos):
-            return jsonify({'error': 'Faltan campos requeridos'}), 400
-        
-        # Agregar metadata
-        data['metadata'] = {
-            'creado_por': usuario.username,
-            'fecha_creacion': datetime.utcnow(),
-            'ultima_modificacion': datetime.utcnow(),
-            'version_documento': 1
-        }
-        
-        # Convertir fechas string a datetime
-        if 'fecha_inicio' in data:
-            data['fecha_inicio'] = datetime.fromisoformat(data['fecha_inicio'].replace('Z', '+00:00'))
-        if 'fecha_fin_estimada' in data:
-            data['fecha_fin_estimada'] = datetime.fromisoformat(data['fecha_fin_estimada'].replace('Z', '+00:00'))
+        # Validaciones, campos derivados, metadata y fechas
+        data = preparar_ensayo(request.get_json(), usuario.username)
         
         # Insertar en MongoDB
         mongo_db = get_mongo_db()
         collection = mongo_db.ensayos_clinicos
         
-        resultado = collection.insert_one(data)
-        
-        # Recuperar el documento insertado
-        ensayo_creado = collection.find_one({'_id': resultado.inserted_id})
+        # insert_one añade el _id al propio dict: se devuelve tal cual
+        collection.insert_one(data)
+        tras_escritura_ensayo(data['_id'], data)
         
-        return jsonify({
+        return con_etag((jsonify({
             'mensaje': 'Ensayo clínico creado exitosamente',
-            'ensayo': serialize_mongo_doc(ensayo_creado)
-        }), 201
+            'ensayo': data
+        }), 201), data)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/importar', methods=['POST'])
+@gerente_o_farmaceutico
+def importar_ensayos(usuario):
+    """
+    Importación masiva de ensayos en NDJSON (un ensayo por línea, mismo
+    formato que POST /api/ensayos/).
+    
+    El cuerpo se procesa línea a línea y se inserta por lotes; los
+    documentos erróneos no detienen la importación.
+    
+    Query params:
+    - lote: Documentos por insert_many (default 1000, máximo 5000)
+    
+    Returns:
+        lineas, insertados, total_errores y errores [{linea, codigo_ensayo, error}]
+    """
+    try:
+        lote = max(1, min(int(request.args.get('lote', 1000)), 5000))
+        redis_client = get_redis_client()
+        
+        def al_insertar(ensayos):
+            try:
+                EstadisticasEnsayosService.registrar_lote(redis_client, ensayos)
+            except redis.RedisError as e:
+                current_app.logger.warning('No se actualizaron las estadísticas de la importación: %s', e)
+        
+        resultado = importar_ndjson(
+            get_mongo_db().ensayos_clinicos,
+            request.stream,
+            usuario.username,
+            lote=lote,
+            al_insertar=al_insertar
+        )
+        
+        if resultado['insertados']:
+            try:
+                ReclutamientoService.invalidar(redis_client)
+            except redis.RedisError as e:
+                current_app.logger.warning('No se invalidó la cache de reclutamiento: %s', e)
+        
+        codigo = 201 if resultado['insertados'] else 400
+        return jsonify(resultado), codigo
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/exportar', methods=['GET'])
+@cualquier_usuario_autenticado
+def exportar_ensayos(usuario):
+    """
+    Exportar ensayos en NDJSON (streaming desde el cursor, orden de _id).
+    
+    Query params:
+    - fase, estado: Filtros
+    - incluir_archivados: true para incluir ensayos archivados
+    """
+    try:
+        filtro = {}
+        if request.args.get('fase'):
+            filtro['fase'] = int(request.args.get('fase'))
+        if request.args.get('estado'):
+            filtro['estado'] = request.args.get('estado')
         
+        lineas = exportar_ndjson(
+            coleccion_ensayos(lectura=True),
+            filtro,
+            incluir_archivados=request.args.get('incluir_archivados') == 'true'
+        )
+        
+        return Response(
+            lineas,
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=ensayos.ndjson'}
+        )
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -152,9 +300,31 @@ def actualizar_ensayo(usuario, ensayo_id):
     Actualizar un ensayo clínico existente.
     
     Body: Campos a actualizar
+    
+    Headers:
+    - If-Match: ETag (version_documento) que el usuario vio. Si otro
+      usuario modificó el ensayo entretanto se responde 412 sin escribir.
     """
     try:
         data = request.get_json()
+        if not isinstance(data, dict) or not data:
+            return jsonify({'error': 'Se requiere un objeto con los campos a actualizar'}), 400
+        
+        # metadata la gestiona el servidor; un campo suyo en el body además
+        # chocaría con el $set/$inc de abajo
+        reservados = [c for c in data if c.split('.')[0] in ('metadata', 'version_documento')]
+        if reservados:
+            return jsonify({'error': f"Campos no modificables: {', '.join(reservados)}"}), 400
+        
+        versiones = versiones_if_match()
+        rechazar_efectos_embebidos(data)
+        parsear_fechas(data)
+        
+        # Mantener el flag del índice parcial de listados
+        if 'estado' in data:
+            data['archivado'] = data['estado'] == 'archivado'
+        if 'farmaco' in data:
+            data['farmaco_search'] = normalizar_texto(data['farmaco'])
         
         # Actualizar metadata
         data['metadata.ultima_modificacion'] = datetime.utcnow()
@@ -163,23 +333,37 @@ def actualizar_ensayo(usuario, ensayo_id):
         mongo_db = get_mongo_db()
         collection = mongo_db.ensayos_clinicos
         
-        # Actualizar documento
-        resultado = collection.update_one(
-            {'_id': ObjectId(ensayo_id)},
-            {'$set': data, '$inc': {'metadata.version_documento': 1}}
+        # La versión forma parte del filtro: comprobar y escribir es una
+        # sola operación atómica en el servidor
+        filtro = {'_id': ObjectId(ensayo_id)}
+        if versiones is not None:
+            filtro['metadata.version_documento'] = {'$in': versiones}
+        
+        ensayo_actualizado = collection.find_one_and_update(
+            filtro,
+            {'$set': data, '$inc': {'metadata.version_documento': 1}},
+            return_document=ReturnDocument.AFTER
         )
         
-        if resultado.matched_count == 0:
+        if ensayo_actualizado is None:
+            if versiones is not None and collection.count_documents({'_id': filtro['_id']}, limit=1):
+                return jsonify({
+                    'error': 'Conflicto de concurrencia',
+                    'mensaje': 'El ensayo fue modificado por otro usuario. '
+                               'Recargue los datos e intente nuevamente.',
+                    'tipo': 'concurrency_conflict'
+                }), 412
             return jsonify({'error': 'Ensayo no encontrado'}), 404
         
-        # Recuperar documento actualizado
-        ensayo_actualizado = collection.find_one({'_id': ObjectId(ensayo_id)})
+        tras_escritura_ensayo(ensayo_actualizado['_id'], ensayo_actualizado)
         
-        return jsonify({
+        return con_etag((jsonify({
             'mensaje': 'Ensayo actualizado exitosamente',
-            'ensayo': serialize_mongo_doc(ensayo_actualizado)
-        }), 200
+            'ensayo': ensayo_actualizado
+        }), 200), ensayo_actualizado)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -193,61 +377,124 @@ def eliminar_ensayo(usuario, ensayo_id):
         collection = mongo_db.ensayos_clinicos
         
         # En lugar de eliminar, marcar como archivado
-        resultado = collection.update_one(
+        ensayo = collection.find_one_and_update(
             {'_id': ObjectId(ensayo_id)},
             {'$set': {
                 'estado': 'archivado',
+                'archivado': True,
                 'metadata.archivado_por': usuario.username,
                 'metadata.fecha_archivado': datetime.utcnow()
-            }}
+            }, '$inc': {'metadata.version_documento': 1}},
+            projection=CAMPOS_ESTADISTICAS,
+            return_document=ReturnDocument.AFTER
         )
         
-        if resultado.matched_count == 0:
+        if ensayo is None:
             return jsonify({'error': 'Ensayo no encontrado'}), 404
         
+        tras_escritura_ensayo(ensayo['_id'], ensayo)
+        
         return jsonify({'mensaje': 'Ensayo archivado exitosamente'}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def parsear_mes(valor):
+    """Mes YYYY-MM de un query param (None si no viene)"""
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m')
+    except ValueError:
+        raise ValueError(f'Mes inválido: {valor}. Formato YYYY-MM')
+
+
 @bp.route('/<ensayo_id>/efectos-secundarios', methods=['POST'])
 @gerente_o_farmaceutico
 def agregar_efecto_secundario(usuario, ensayo_id):
     """
     Agregar un efecto secundario a un ensayo.
     
+    Se guarda en la colección efectos_adversos (buckets por ensayo y mes),
+    no dentro del documento del ensayo.
+    
     Body:
     {
         "tipo": "string",
-        "frecuencia": "string",
-        "severidad": "string",
-        "duracion_promedio": "string"
+        "frecuencia": number | "15%",
+        "severidad": "leve|moderada|grave" | 1-3,
+        "duracion_promedio": number | "3 días"
     }
     """
     try:
         data = request.get_json()
         
-        mongo_db = get_mongo_db()
-        collection = mongo_db.ensayos_clinicos
-        
-        resultado = collection.update_one(
-            {'_id': ObjectId(ensayo_id)},
-            {
-                '$push': {
-                    'resultados_intermedios.efectos_secundarios_frecuentes': data
-                },
-                '$set': {
-                    'metadata.ultima_modificacion': datetime.utcnow()
-                }
-            }
+        evento = EfectosAdversosService.registrar(
+            get_mongo_db(), ensayo_id, data, usuario=usuario.username
         )
         
-        if resultado.matched_count == 0:
+        if evento is None:
             return jsonify({'error': 'Ensayo no encontrado'}), 404
         
-        return jsonify({'mensaje': 'Efecto secundario agregado'}), 200
+        return jsonify({'mensaje': 'Efecto secundario agregado', 'efecto': evento}), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/<ensayo_id>/efectos-secundarios', methods=['GET'])
+@cualquier_usuario_autenticado
+def listar_efectos_secundarios(usuario, ensayo_id):
+    """
+    Efectos secundarios de un ensayo (más recientes primero).
+    
+    Query params:
+    - desde, hasta: Meses YYYY-MM
+    """
+    try:
+        efectos = EfectosAdversosService.listar(
+            get_mongo_db(), ensayo_id,
+            desde=parsear_mes(request.args.get('desde')),
+            hasta=parsear_mes(request.args.get('hasta'))
+        )
+        
+        return jsonify({'total': len(efectos), 'efectos': efectos}), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/efectos-adversos/ranking', methods=['GET'])
+@cualquier_usuario_autenticado
+def ranking_efectos_adversos(usuario):
+    """
+    Ranking de efectos adversos por compuesto entre todos los ensayos.
+    
+    Query params:
+    - principio_activo: Limitar a un compuesto
+    - desde, hasta: Meses YYYY-MM
+    - orden: eventos (default) | frecuencia | severidad | graves
+    - limite: Efectos por compuesto (default 20, máximo 100)
+    """
+    try:
+        ranking = EfectosAdversosService.ranking(
+            get_mongo_db(),
+            principio_activo=request.args.get('principio_activo'),
+            desde=parsear_mes(request.args.get('desde')),
+            hasta=parsear_mes(request.args.get('hasta')),
+            orden=request.args.get('orden', 'eventos'),
+            limite=max(1, min(int(request.args.get('limite', 20)), 100))
+        )
+        
+        return jsonify({'compuestos': ranking}), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -264,39 +511,37 @@ def busqueda_avanzada(usuario):
         "estado": ["en_curso", "reclutamiento"],
         "edad_minima": int,
         "edad_maxima": int,
-        "condiciones": ["hipertension", "diabetes"]
+        "condiciones": ["hipertension", "diabetes"],
+        "fields": "resumen|completo",
+        "limite": int,
+        "cursor": "string",
+        "incluir_archivados": bool
     }
     """
     try:
         criterios = request.get_json()
         
-        mongo_db = get_mongo_db()
-        collection = mongo_db.ensayos_clinicos
-        
-        # Construir query compleja
-        query = {}
+        collection = coleccion_ensayos(lectura=True)
         
-        if 'fase' in criterios:
-            query['fase'] = {'$in': criterios['fase']}
+        query = filtro_busqueda_avanzada(criterios)
         
-        if 'estado' in criterios:
-            query['estado'] = {'$in': criterios['estado']}
-        
-        if 'edad_minima' in criterios:
-            query['criterios_inclusion.edad_minima'] = {'$lte': criterios['edad_minima']}
-        
-        if 'condiciones' in criterios:
-            query['criterios_inclusion.condiciones_medicas'] = {
-                '$in': criterios['condiciones']
-            }
-        
-        resultados = list(collection.find(query))
+        resultados, siguiente_cursor = paginar_ensayos(
+            collection,
+            query,
+            fields=criterios.get('fields', 'resumen'),
+            cursor=criterios.get('cursor'),
+            limite=criterios.get('limite', LIMITE_POR_DEFECTO),
+            incluir_archivados=bool(criterios.get('incluir_archivados', False))
+        )
         
         return jsonify({
             'total': len(resultados),
-            'ensayos': [serialize_mongo_doc(e) for e in resultados]
+            'ensayos': resultados,
+            'siguiente_cursor': siguiente_cursor
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -304,31 +549,116 @@ def busqueda_avanzada(usuario):
 @bp.route('/estadisticas', methods=['GET'])
 @cualquier_usuario_autenticado
 def estadisticas_ensayos(usuario):
-    """Estadísticas generales de ensayos clínicos"""
+    """
+    Estadísticas generales de ensayos clínicos.
+    
+    Se sirven del resumen incremental en Redis (EstadisticasEnsayosService),
+    no de una agregación sobre la colección.
+    """
     try:
-        mongo_db = get_mongo_db()
-        collection = mongo_db.ensayos_clinicos
+        estadisticas = EstadisticasEnsayosService.obtener(
+            get_redis_client(), get_mongo_db().ensayos_clinicos
+        )
+        
+        return jsonify(estadisticas), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Rutas de reclutamiento -> dimensión de ReclutamientoService
+DIMENSIONES_RECLUTAMIENTO = {
+    'ensayos': 'ensayo',
+    'ciudades': 'ciudad',
+    'investigadores': 'investigador'
+}
+
+
+@bp.route('/reclutamiento/<agrupacion>', methods=['GET'])
+@cualquier_usuario_autenticado
+def avance_reclutamiento(usuario, agrupacion):
+    """
+    Avance de reclutamiento (pacientes reclutados frente a meta) por
+    ensayo, ciudad o investigador principal.
+    
+    agrupacion: ensayos | ciudades | investigadores
+    
+    Query params:
+    - estado, fase: Filtros sobre el ensayo
+    - ciudad, investigador: Filtros sobre los centros
+    - orden: asc (default, menos avanzados primero) | desc
+    - limite: Máximo de filas (default 100, máximo 1000)
+    - incluir_archivados: true para incluir ensayos archivados
+    """
+    try:
+        if agrupacion not in DIMENSIONES_RECLUTAMIENTO:
+            return jsonify({
+                'error': f"Agrupación inválida. Debe ser: {', '.join(DIMENSIONES_RECLUTAMIENTO)}"
+            }), 404
+        
+        fase = request.args.get('fase')
+        
+        resultado = ReclutamientoService.obtener(
+            coleccion_ensayos(lectura=True),
+            DIMENSIONES_RECLUTAMIENTO[agrupacion],
+            redis_client=get_redis_client(),
+            estado=request.args.get('estado'),
+            fase=int(fase) if fase else None,
+            ciudad=request.args.get('ciudad'),
+            investigador=request.args.get('investigador'),
+            incluir_archivados=request.args.get('incluir_archivados') == 'true',
+            orden=request.args.get('orden', 'asc'),
+            limite=max(1, min(int(request.args.get('limite', 100)), 1000))
+        )
+        
+        return jsonify(resultado), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/<ensayo_id>/centros/reclutamiento', methods=['POST'])
+@gerente_o_farmaceutico
+def registrar_inclusiones(usuario, ensayo_id):
+    """
+    Registrar pacientes incluidos en un centro (incremento atómico).
+    
+    Body:
+    {
+        "centro": "string (nombre del centro)",
+        "pacientes": int (default 1)
+    }
+    """
+    try:
+        data = request.get_json()
         
-        # Agregación con pipeline
-        pipeline = [
-            {
-                '$group': {
-                    '_id': '$estado',
-                    'total': {'$sum': 1},
-                    'fase_promedio': {'$avg': '$fase'}
-                }
-            }
-        ]
+        ensayo = ReclutamientoService.registrar_inclusiones(
+            get_mongo_db().ensayos_clinicos,
+            ensayo_id,
+            data.get('centro'),
+            data.get('pacientes', 1),
+            usuario.username
+        )
         
-        estadisticas = list(collection.aggregate(pipeline))
+        if ensayo is None:
+            return jsonify({'error': 'Ensayo o centro no encontrado'}), 404
         
-        # Total general
-        total_ensayos = collection.count_documents({})
+        tras_escritura_ensayo(ensayo['_id'], ensayo)
+        
+        centro = next(
+            c for c in ensayo['centros_participantes'] if c.get('nombre') == data['centro']
+        )
         
         return jsonify({
-            'total_ensayos': total_ensayos,
-            'por_estado': estadisticas
+            'mensaje': 'Inclusiones registradas',
+            'centro': data['centro'],
+            'pacientes_reclutados': centro.get('pacientes_reclutados'),
+            'version_documento': ensayo['metadata']['version_documento']
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
@@ -1,18 +1,27 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import jwt_required
-from app import get_neo4j_driver
-from app.middleware.auth_middleware import cualquier_usuario_autenticado
+from app import get_neo4j_driver, get_redis_client
+from app.middleware.auth_middleware import cualquier_usuario_autenticado, gerente_o_farmaceutico
+from app.models.mysql_models import db, Producto, InteraccionMedicamentosa
+from app.services.grafo_interacciones import GrafoInteraccionesService, resumir_interacciones
+from app.services.consultas_grafo import ejecutar_consulta
+from app.services.estadisticas_grafo import EstadisticasGrafoService
+# Registra la captura de cambios de InteraccionMedicamentosa en el outbox
+import app.services.sincronizacion_interacciones  # noqa: F401
 
 bp = Blueprint('interacciones', __name__, url_prefix='/api/interacciones')
 
 
-def ejecutar_query_neo4j(query, parametros=None):
-    """Ejecuta una consulta en Neo4j y retorna los resultados"""
-    driver = get_neo4j_driver()
-    
-    with driver.session() as session:
-        resultado = session.run(query, parametros or {})
-        return [record.data() for record in resultado]
+def bookmarks_peticion():
+    """Bookmarks de Neo4j enviados por el cliente (X-Neo4j-Bookmarks, separados por comas)"""
+    cabecera = request.headers.get('X-Neo4j-Bookmarks', '')
+    return [b.strip() for b in cabecera.split(',') if b.strip()] or None
+
+
+def consultar(nombre, parametros=None):
+    """Consulta registrada con las lecturas causalmente posteriores a los bookmarks recibidos"""
+    return ejecutar_consulta(get_neo4j_driver(), nombre, parametros, bookmarks=bookmarks_peticion())
 
 
 @bp.route('/medicamentos', methods=['GET'])
@@ -20,17 +29,11 @@ def ejecutar_query_neo4j(query, parametros=None):
 def listar_medicamentos(usuario):
     """Listar todos los medicamentos del grafo"""
     try:
-        query = """
-        MATCH (m:Medicamento)
-        RETURN m.id as id, m.nombre as nombre, m.nombre_comercial as nombre_comercial,
-               m.dosis as dosis, m.laboratorio as laboratorio
-        ORDER BY m.nombre
-        """
-        
-        medicamentos = ejecutar_query_neo4j(query)
+        medicamentos = consultar('listar_medicamentos')
         
         return jsonify({
             'total': len(medicamentos),
+            'truncado': medicamentos.truncada,
             'medicamentos': medicamentos
         }), 200
         
@@ -43,18 +46,7 @@ def listar_medicamentos(usuario):
 def obtener_medicamento_detalle(usuario, medicamento_id):
     """Obtener detalles completos de un medicamento con sus relaciones"""
     try:
-        query = """
-        MATCH (m:Medicamento {id: $medicamento_id})
-        OPTIONAL MATCH (pa:PrincipioActivo)-[:COMPONE]->(m)
-        OPTIONAL MATCH (c:Compuesto)-[:SE_TRANSFORMA_EN]->(pa)
-        OPTIONAL MATCH (m)-[:PERTENECE_A]->(cat:Categoria)
-        RETURN m, 
-               collect(DISTINCT pa) as principios_activos,
-               collect(DISTINCT c) as compuestos,
-               collect(DISTINCT cat.nombre) as categorias
-        """
-        
-        resultados = ejecutar_query_neo4j(query, {'medicamento_id': medicamento_id})
+        resultados = consultar('detalle_medicamento', {'medicamento_id': medicamento_id})
         
         if not resultados:
             return jsonify({'error': 'Medicamento no encontrado'}), 404
@@ -75,36 +67,14 @@ def obtener_interacciones_medicamento(usuario, medicamento_id):
     - severidad: Filtrar por severidad (leve, moderada, grave)
     """
     try:
-        # Construir filtro de severidad
-        filtro_severidad = ""
-        if request.args.get('severidad'):
-            filtro_severidad = f"AND r.severidad = '{request.args.get('severidad')}'"
-        
-        query = f"""
-        MATCH (m1:Medicamento {{id: $medicamento_id}})-[r:INTERACCIONA_CON]-(m2:Medicamento)
-        WHERE 1=1 {filtro_severidad}
-        RETURN m1.nombre as medicamento_origen,
-               m2.id as medicamento_interaccion_id,
-               m2.nombre as medicamento_interaccion,
-               m2.nombre_comercial as nombre_comercial,
-               r.tipo as tipo_interaccion,
-               r.severidad as severidad,
-               r.descripcion as descripcion,
-               r.recomendaciones as recomendaciones,
-               r.nivel_evidencia as nivel_evidencia
-        ORDER BY 
-            CASE r.severidad 
-                WHEN 'grave' THEN 1
-                WHEN 'moderada' THEN 2
-                WHEN 'leve' THEN 3
-                ELSE 4
-            END
-        """
-        
-        interacciones = ejecutar_query_neo4j(query, {'medicamento_id': medicamento_id})
+        interacciones = consultar('interacciones_medicamento', {
+            'medicamento_id': medicamento_id,
+            'severidad': request.args.get('severidad') or None
+        })
         
         return jsonify({
             'total': len(interacciones),
+            'truncado': interacciones.truncada,
             'interacciones': interacciones
         }), 200
         
@@ -129,44 +99,103 @@ def verificar_interacciones_multiples(usuario):
         if 'medicamentos' not in data or len(data['medicamentos']) < 2:
             return jsonify({'error': 'Se requieren al menos 2 medicamentos'}), 400
         
-        query = """
-        MATCH (m1:Medicamento)-[r:INTERACCIONA_CON]-(m2:Medicamento)
-        WHERE m1.id IN $medicamentos AND m2.id IN $medicamentos
-        RETURN DISTINCT
-            m1.id as medicamento_a_id,
-            m1.nombre as medicamento_a,
-            m2.id as medicamento_b_id,
-            m2.nombre as medicamento_b,
-            r.severidad as severidad,
-            r.descripcion as descripcion,
-            r.recomendaciones as recomendaciones
-        ORDER BY 
-            CASE r.severidad 
-                WHEN 'grave' THEN 1
-                WHEN 'moderada' THEN 2
-                WHEN 'leve' THEN 3
-            END
-        """
-        
-        interacciones = ejecutar_query_neo4j(query, {'medicamentos': data['medicamentos']})
-        
-        # Clasificar por severidad
-        interacciones_graves = [i for i in interacciones if i['severidad'] == 'grave']
-        interacciones_moderadas = [i for i in interacciones if i['severidad'] == 'moderada']
-        interacciones_leves = [i for i in interacciones if i['severidad'] == 'leve']
+        interacciones, origen = GrafoInteraccionesService.verificar(
+            data['medicamentos'],
+            redis_client=get_redis_client(),
+            driver=get_neo4j_driver(),
+            intervalo=current_app.config['INTERACCIONES_INTERVALO_VERSION'],
+            en_memoria=current_app.config['INTERACCIONES_EN_MEMORIA']
+        )
         
-        return jsonify({
-            'total_interacciones': len(interacciones),
-            'tiene_interacciones_graves': len(interacciones_graves) > 0,
-            'resumen': {
-                'graves': len(interacciones_graves),
-                'moderadas': len(interacciones_moderadas),
-                'leves': len(interacciones_leves)
-            },
-            'interacciones_graves': interacciones_graves,
-            'interacciones_moderadas': interacciones_moderadas,
-            'interacciones_leves': interacciones_leves
-        }), 200
+        return jsonify(resumir_interacciones(interacciones)), 200, {'X-Origen-Interacciones': origen}
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+MAXIMO_LISTAS_POR_LOTE = 20000
+# Listas por llamada a verificar_lote (una consulta UNWIND si no hay instantánea)
+TAMANO_TRAMO_LOTE = 500
+
+
+@bp.route('/verificar-interacciones/lote', methods=['POST'])
+@cualquier_usuario_autenticado
+def verificar_interacciones_lote(usuario):
+    """
+    Verificar interacciones de muchas prescripciones en una petición.
+    
+    Body:
+    {
+        "listas": [
+            {"id": "paciente-1", "medicamentos": ["MED001", "MED002"]},
+            ["MED003", "MED004", "MED005"]
+        ]
+    }
+    
+    Respuesta NDJSON en streaming, una línea por lista y en el mismo orden:
+    id (o posición), origen y el mismo resumen que verificar-interacciones.
+    Las listas con menos de 2 medicamentos, y las de un tramo cuya
+    verificación falla, devuelven una línea con error.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        listas = data.get('listas')
+        
+        if not isinstance(listas, list) or not listas:
+            return jsonify({'error': 'Se requiere una lista "listas" no vacía'}), 400
+        if len(listas) > MAXIMO_LISTAS_POR_LOTE:
+            return jsonify({'error': f'Máximo {MAXIMO_LISTAS_POR_LOTE} listas por petición'}), 400
+        
+        identificadores, medicamentos = [], []
+        for posicion, lista in enumerate(listas):
+            if isinstance(lista, dict):
+                identificadores.append(lista.get('id', posicion))
+                medicamentos.append(lista.get('medicamentos'))
+            else:
+                identificadores.append(posicion)
+                medicamentos.append(lista)
+        
+        validas = [i for i, m in enumerate(medicamentos)
+                   if isinstance(m, list) and len(m) >= 2 and all(isinstance(x, str) for x in m)]
+        
+        redis_client, driver = get_redis_client(), get_neo4j_driver()
+        intervalo = current_app.config['INTERACCIONES_INTERVALO_VERSION']
+        en_memoria = current_app.config['INTERACCIONES_EN_MEMORIA']
+        
+        def invalidas(desde, hasta):
+            for posicion in range(desde, hasta):
+                yield json.dumps({'id': identificadores[posicion],
+                                  'error': 'Se requieren al menos 2 medicamentos'}) + '\n'
+        
+        def lineas():
+            # La cabecera 200 ya se ha enviado: un tramo que falla se informa
+            # con una línea de error por lista y se sigue con el siguiente
+            siguiente = 0
+            for inicio in range(0, len(validas), TAMANO_TRAMO_LOTE):
+                tramo = validas[inicio:inicio + TAMANO_TRAMO_LOTE]
+                emitidas = 0
+                try:
+                    for posicion_tramo, interacciones, origen in GrafoInteraccionesService.verificar_lote(
+                        [medicamentos[i] for i in tramo], redis_client, driver,
+                        intervalo=intervalo, en_memoria=en_memoria, tamano_lote=len(tramo)
+                    ):
+                        posicion = tramo[posicion_tramo]
+                        yield from invalidas(siguiente, posicion)
+                        yield json.dumps({'id': identificadores[posicion], 'origen': origen,
+                                          **resumir_interacciones(interacciones)}, ensure_ascii=False) + '\n'
+                        siguiente = posicion + 1
+                        emitidas = posicion_tramo + 1
+                except Exception as e:
+                    current_app.logger.error('Falló la verificación de %s listas del lote: %s',
+                                             len(tramo) - emitidas, e)
+                    for posicion in tramo[emitidas:]:
+                        yield from invalidas(siguiente, posicion)
+                        yield json.dumps({'id': identificadores[posicion],
+                                          'error': f'No se pudo verificar: {e}'}, ensure_ascii=False) + '\n'
+                        siguiente = posicion + 1
+            yield from invalidas(siguiente, len(listas))
+        
+        return Response(stream_with_context(lineas()), mimetype='application/x-ndjson')
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -177,21 +206,11 @@ def verificar_interacciones_multiples(usuario):
 def listar_principios_activos(usuario):
     """Listar todos los principios activos"""
     try:
-        query = """
-        MATCH (pa:PrincipioActivo)
-        OPTIONAL MATCH (pa)-[:COMPONE]->(m:Medicamento)
-        RETURN pa.id as id,
-               pa.nombre as nombre,
-               pa.mecanismo_accion as mecanismo_accion,
-               pa.indicaciones as indicaciones,
-               count(m) as cantidad_medicamentos
-        ORDER BY pa.nombre
-        """
-        
-        principios = ejecutar_query_neo4j(query)
+        principios = consultar('listar_principios_activos')
         
         return jsonify({
             'total': len(principios),
+            'truncado': principios.truncada,
             'principios_activos': principios
         }), 200
         
@@ -206,21 +225,7 @@ def obtener_cadena_compuesto(usuario, compuesto_id):
     Obtener la cadena completa: Compuesto -> Principio Activo -> Medicamentos
     """
     try:
-        query = """
-        MATCH path = (c:Compuesto {id: $compuesto_id})-[:SE_TRANSFORMA_EN]->(pa:PrincipioActivo)-[:COMPONE]->(m:Medicamento)
-        RETURN c.nombre as compuesto,
-               c.formula_quimica as formula,
-               pa.nombre as principio_activo,
-               pa.mecanismo_accion as mecanismo,
-               collect({
-                   id: m.id,
-                   nombre: m.nombre,
-                   nombre_comercial: m.nombre_comercial,
-                   laboratorio: m.laboratorio
-               }) as medicamentos
-        """
-        
-        resultados = ejecutar_query_neo4j(query, {'compuesto_id': compuesto_id})
+        resultados = consultar('cadena_compuesto', {'compuesto_id': compuesto_id})
         
         if not resultados:
             return jsonify({'error': 'Compuesto no encontrado'}), 404
@@ -239,26 +244,14 @@ def obtener_ruta_completa_medicamento(usuario, medicamento_id):
     Útil para trazabilidad.
     """
     try:
-        query = """
-        MATCH path = (c:Compuesto)-[:SE_TRANSFORMA_EN]->(pa:PrincipioActivo)-[:COMPONE]->(m:Medicamento {id: $medicamento_id})
-        RETURN c.nombre as compuesto,
-               c.nombre_quimico as compuesto_quimico,
-               c.formula_quimica as formula,
-               pa.nombre as principio_activo,
-               pa.mecanismo_accion as mecanismo_accion,
-               m.nombre as medicamento,
-               m.nombre_comercial as nombre_comercial,
-               m.dosis as dosis,
-               m.forma_farmaceutica as forma_farmaceutica
-        """
-        
-        resultados = ejecutar_query_neo4j(query, {'medicamento_id': medicamento_id})
+        resultados = consultar('ruta_completa_medicamento', {'medicamento_id': medicamento_id})
         
         if not resultados:
             return jsonify({'error': 'No se encontró la ruta completa para este medicamento'}), 404
         
         return jsonify({
             'medicamento_id': medicamento_id,
+            'truncado': resultados.truncada,
             'ruta': resultados
         }), 200
         
@@ -269,29 +262,15 @@ def obtener_ruta_completa_medicamento(usuario, medicamento_id):
 @bp.route('/estadisticas/grafo', methods=['GET'])
 @cualquier_usuario_autenticado
 def estadisticas_grafo(usuario):
-    """Obtener estadísticas generales del grafo"""
+    """
+    Obtener estadísticas generales del grafo: nodos por etiqueta (un nodo
+    cuenta en cada una de sus etiquetas) y relaciones por tipo, desde el
+    count store de Neo4j y cacheadas en Redis por versión del grafo.
+    """
     try:
-        query = """
-        MATCH (n)
-        WITH labels(n) as tipo, count(*) as cantidad
-        RETURN tipo[0] as tipo_nodo, cantidad
-        ORDER BY cantidad DESC
-        """
-        
-        estadisticas_nodos = ejecutar_query_neo4j(query)
-        
-        query_relaciones = """
-        MATCH ()-[r]->()
-        RETURN type(r) as tipo_relacion, count(*) as cantidad
-        ORDER BY cantidad DESC
-        """
-        
-        estadisticas_relaciones = ejecutar_query_neo4j(query_relaciones)
-        
-        return jsonify({
-            'nodos': estadisticas_nodos,
-            'relaciones': estadisticas_relaciones
-        }), 200
+        return jsonify(EstadisticasGrafoService.obtener(
+            get_neo4j_driver(), get_redis_client(), bookmarks=bookmarks_peticion()
+        )), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -312,24 +291,116 @@ def buscar_por_categoria(usuario):
         if not categoria:
             return jsonify({'error': 'Parámetro categoria requerido'}), 400
         
-        query = """
-        MATCH (m:Medicamento)-[:PERTENECE_A]->(c:Categoria)
-        WHERE c.nombre = $categoria
-        RETURN m.id as id,
-               m.nombre as nombre,
-               m.nombre_comercial as nombre_comercial,
-               m.dosis as dosis,
-               m.laboratorio as laboratorio
-        ORDER BY m.nombre
-        """
-        
-        medicamentos = ejecutar_query_neo4j(query, {'categoria': categoria})
+        medicamentos = consultar('medicamentos_por_categoria', {'categoria': categoria})
         
         return jsonify({
             'categoria': categoria,
             'total': len(medicamentos),
+            'truncado': medicamentos.truncada,
             'medicamentos': medicamentos
         }), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+# ============================================
+# INTERACCIONES REGISTRADAS EN MYSQL
+# (se sincronizan con el grafo: flask sincronizar-interacciones)
+# ============================================
+
+SEVERIDADES_MYSQL = ('leve', 'moderada', 'grave')
+
+
+def _aplicar_datos_interaccion(interaccion, data):
+    for campo in ('producto_a_id', 'producto_b_id'):
+        if campo in data:
+            if db.session.get(Producto, data[campo]) is None:
+                raise ValueError(f'Producto {data[campo]} no encontrado')
+            setattr(interaccion, campo.replace('producto', 'medicamento'), data[campo])
+    if 'severidad' in data:
+        if data['severidad'] not in SEVERIDADES_MYSQL:
+            raise ValueError(f"severidad inválida. Debe ser: {', '.join(SEVERIDADES_MYSQL)}")
+        interaccion.tipo_interaccion = data['severidad']
+    for campo in ('descripcion', 'recomendaciones'):
+        if campo in data:
+            setattr(interaccion, campo, data[campo])
+    if interaccion.medicamento_a_id == interaccion.medicamento_b_id:
+        raise ValueError('Una interacción requiere dos productos distintos')
+
+
+@bp.route('/registradas', methods=['POST'])
+@gerente_o_farmaceutico
+def crear_interaccion_registrada(usuario):
+    """
+    Registrar una interacción entre dos productos.
+    
+    Body:
+    {
+        "producto_a_id": int,
+        "producto_b_id": int,
+        "severidad": "leve|moderada|grave",
+        "descripcion": "string",
+        "recomendaciones": "string"
+    }
+    """
+    try:
+        data = request.get_json()
+        
+        if not all(k in data for k in ('producto_a_id', 'producto_b_id', 'severidad')):
+            return jsonify({'error': 'Faltan campos requeridos (producto_a_id, producto_b_id, severidad)'}), 400
+        
+        interaccion = InteraccionMedicamentosa()
+        _aplicar_datos_interaccion(interaccion, data)
+        db.session.add(interaccion)
+        db.session.commit()
+        
+        return jsonify(interaccion.to_dict()), 201
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/registradas/<int:id>', methods=['PUT'])
+@gerente_o_farmaceutico
+def actualizar_interaccion_registrada(usuario, id):
+    """Modificar una interacción registrada (mismos campos que al crearla)"""
+    try:
+        interaccion = db.session.get(InteraccionMedicamentosa, id)
+        if interaccion is None:
+            return jsonify({'error': 'Interacción no encontrada'}), 404
+        
+        _aplicar_datos_interaccion(interaccion, request.get_json() or {})
+        db.session.commit()
+        
+        return jsonify(interaccion.to_dict()), 200
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/registradas/<int:id>', methods=['DELETE'])
+@gerente_o_farmaceutico
+def eliminar_interaccion_registrada(usuario, id):
+    """Eliminar una interacción registrada"""
+    try:
+        interaccion = db.session.get(InteraccionMedicamentosa, id)
+        if interaccion is None:
+            return jsonify({'error': 'Interacción no encontrada'}), 404
+        
+        db.session.delete(interaccion)
+        db.session.commit()
+        
+        return jsonify({'mensaje': 'Interacción eliminada'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
@@ -1,13 +1,23 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import or_
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from app.models.mysql_models import db, Producto, Lote, Transaccion, Usuario
 from app.middleware.auth_middleware import gerente_o_farmaceutico, cualquier_usuario_autenticado, solo_gerente
-from app.middleware.concurrency import OptimisticLockManager, ConcurrencyException
+from app.middleware.concurrency import OptimisticLockManager, ConcurrencyException, InventarioInsuficienteError
+from app.middleware.replicas import lecturas_en_replica
+from app.services.reportes_ventas import ReporteVentasService
+from app.services.reabastecimiento import ReabastecimientoService
+from app.services.cadena_frio import CadenaFrioService
+from app.services.sustitucion import SustitucionService
+from app.services.cribado_ventas import CribadoVentasService
+from app import get_redis_client, get_redis_cribado, get_mongo_db, get_neo4j_driver
 
 bp = Blueprint('inventario', __name__, url_prefix='/api/inventario')
 
+# Las rutas GET leen de réplicas MySQL (si hay configuradas)
+lecturas_en_replica(bp)
+
 
 # ============================================
 # PRODUCTOS
@@ -76,7 +86,8 @@ def crear_producto(usuario):
         "tipo_medicamento": "generico|patentado|controlado",
         "precio_base": float,
         "temperatura_almacenamiento": float,
-        "requiere_refrigeracion": boolean
+        "requiere_refrigeracion": boolean,
+        "medicamento_id": "string"  // id del Medicamento en Neo4j (opcional)
     }
     """
     try:
@@ -100,7 +111,8 @@ def crear_producto(usuario):
             tipo_medicamento=data['tipo_medicamento'],
             precio_base=data['precio_base'],
             temperatura_almacenamiento=data.get('temperatura_almacenamiento'),
-            requiere_refrigeracion=data.get('requiere_refrigeracion', False)
+            requiere_refrigeracion=data.get('requiere_refrigeracion', False),
+            medicamento_id=data.get('medicamento_id')
         )
         
         db.session.add(producto)
@@ -116,6 +128,35 @@ def crear_producto(usuario):
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/productos/<int:id>/sustitutos', methods=['GET'])
+@cualquier_usuario_autenticado
+def sustitutos_producto(usuario, id):
+    """
+    Sustitutos terapéuticos con stock de un producto.
+    Query params: medicamentos (ids del grafo separados por comas, medicación
+    actual del paciente), limite (default 5)
+    """
+    try:
+        medicamentos = [m.strip() for m in request.args.get('medicamentos', '').split(',') if m.strip()]
+        limite = request.args.get('limite', 5, type=int)
+        
+        resultado = SustitucionService.sugerir(
+            id,
+            get_redis_client(),
+            get_neo4j_driver(),
+            medicamentos_paciente=medicamentos,
+            limite=limite,
+            intervalo=current_app.config['INTERACCIONES_INTERVALO_VERSION'],
+            en_memoria=current_app.config['INTERACCIONES_EN_MEMORIA']
+        )
+        return jsonify(resultado), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ============================================
 # LOTES
 # ============================================
@@ -230,6 +271,43 @@ def crear_lote(usuario):
 # TRANSACCIONES CON CONTROL DE CONCURRENCIA
 # ============================================
 
+def _cribar(lote_ids, data, otros_lotes=()):
+    """CribadoVentasService.cribar con la configuración de la app"""
+    config = current_app.config
+    return CribadoVentasService.cribar(
+        lote_ids,
+        get_redis_client(),
+        get_neo4j_driver(),
+        otros_lotes=otros_lotes,
+        medicamentos_paciente=data.get('medicamentos_paciente') or (),
+        sesion=data.get('sesion_dispensacion'),
+        presupuesto_ms=config['CRIBADO_PRESUPUESTO_MS'],
+        severidad_bloqueo=config['CRIBADO_SEVERIDAD_BLOQUEO'],
+        intervalo=config['INTERACCIONES_INTERVALO_VERSION'],
+        ttl_mapeo=config['CRIBADO_TTL_MAPEO'],
+        redis_sesion=get_redis_cribado() if data.get('sesion_dispensacion') else None
+    )
+
+
+def _rechazo_por_cribado(cribado, data):
+    """Respuesta de error si el cribado impide la venta, o None"""
+    if cribado['estado'] == 'no_disponible':
+        if current_app.config['CRIBADO_POLITICA'] == 'cerrada':
+            return jsonify({
+                'error': 'Cribado de interacciones no disponible',
+                'tipo': 'cribado_no_disponible',
+                'cribado': cribado
+            }), 503
+        current_app.logger.warning('Venta sin cribado de interacciones (%s)', cribado['motivo'])
+    elif cribado['bloquear'] and not data.get('confirmar_interacciones'):
+        return jsonify({
+            'error': 'Interacciones con la sesión de dispensación',
+            'tipo': 'interaccion_detectada',
+            'cribado': cribado
+        }), 409
+    return None
+
+
 @bp.route('/transacciones/venta', methods=['POST'])
 @gerente_o_farmaceutico
 def registrar_venta(usuario):
@@ -241,10 +319,22 @@ def registrar_venta(usuario):
         "lote_id": int,
         "cantidad": int,
         "referencia": "string",
-        "version": int  // Versión del lote que el usuario vio
+        "version": int,  // Versión del lote que el usuario vio
+        "medicamentos_paciente": ["MED001", ...],  // Opcional: sustitutos y cribado
+        "cribar": bool,  // Opcional: por defecto CRIBADO_VENTAS
+        "sesion_dispensacion": "string",  // Opcional: ventas anteriores de la sesión
+        "lotes_carrito": [int, ...],  // Opcional: resto del carrito sin vender
+        "confirmar_interacciones": bool  // Vender pese a interacciones bloqueantes
     }
     
     IMPORTANTE: El campo 'version' es crítico para evitar conflictos.
+    Si el lote no tiene cantidad suficiente, el 400 incluye sustitutos
+    con stock del mismo principio activo o categoría.
+    
+    Con cribado, el medicamento del lote se comprueba contra la sesión,
+    el carrito y la medicación del paciente antes de vender: 409 si hay
+    interacciones desde CRIBADO_SEVERIDAD_BLOQUEO sin confirmar, y 503 si
+    no se puede cribar con CRIBADO_POLITICA=cerrada.
     """
     try:
         data = request.get_json()
@@ -256,6 +346,13 @@ def registrar_venta(usuario):
         if data['cantidad'] <= 0:
             return jsonify({'error': 'La cantidad debe ser mayor a 0'}), 400
         
+        cribado = None
+        if data.get('cribar', current_app.config['CRIBADO_VENTAS']):
+            cribado = _cribar([data['lote_id']], data, data.get('lotes_carrito') or ())
+            rechazo = _rechazo_por_cribado(cribado, data)
+            if rechazo is not None:
+                return rechazo
+        
         # Ejecutar venta con control de concurrencia
         resultado = OptimisticLockManager.vender_producto(
             lote_id=data['lote_id'],
@@ -265,6 +362,13 @@ def registrar_venta(usuario):
             version_esperada=data['version']
         )
         
+        if cribado is not None:
+            CribadoVentasService.registrar_en_sesion(
+                data.get('sesion_dispensacion'), cribado['medicamentos'], get_redis_client(),
+                ttl=current_app.config['CRIBADO_TTL_SESION']
+            )
+            resultado['cribado'] = cribado
+        
         return jsonify(resultado), 200
         
     except ConcurrencyException as e:
@@ -273,12 +377,58 @@ def registrar_venta(usuario):
             'mensaje': str(e),
             'tipo': 'concurrency_conflict'
         }), 409
+    except InventarioInsuficienteError as e:
+        sustitucion = SustitucionService.sugerir_sin_fallar(
+            e.producto_id,
+            get_redis_client(),
+            get_neo4j_driver(),
+            medicamentos_paciente=data.get('medicamentos_paciente') or (),
+            intervalo=current_app.config['INTERACCIONES_INTERVALO_VERSION'],
+            en_memoria=current_app.config['INTERACCIONES_EN_MEMORIA']
+        )
+        return jsonify({
+            'error': str(e),
+            'tipo': 'inventario_insuficiente',
+            'cantidad_disponible': e.cantidad_disponible,
+            'sustitutos': sustitucion['sustitutos'] if sustitucion else None,
+            'descartados_por_interaccion': sustitucion['descartados_por_interaccion'] if sustitucion else None
+        }), 400
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Error inesperado: {str(e)}'}), 500
 
 
+@bp.route('/transacciones/cribado', methods=['POST'])
+@gerente_o_farmaceutico
+def cribar_carrito(usuario):
+    """
+    Cribar un carrito completo antes de venderlo (todos los pares del
+    carrito y cada lote contra la sesión y la medicación del paciente).
+    
+    Body:
+    {
+        "lote_ids": [int, ...],
+        "sesion_dispensacion": "string",  // Opcional
+        "medicamentos_paciente": ["MED001", ...]  // Opcional
+    }
+    """
+    try:
+        data = request.get_json() or {}
+        lote_ids = data.get('lote_ids')
+        if not lote_ids or not isinstance(lote_ids, list):
+            return jsonify({'error': 'lote_ids debe ser una lista no vacía'}), 400
+        
+        cribado = _cribar(lote_ids, data)
+        cribado['politica'] = current_app.config['CRIBADO_POLITICA']
+        return jsonify(cribado), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('/transacciones/entrada', methods=['POST'])
 @gerente_o_farmaceutico
 def registrar_entrada(usuario):
@@ -384,4 +534,298 @@ def reporte_proximos_vencer(usuario):
         return jsonify([l.to_dict() for l in lotes_vencer]), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+# ============================================
+# REPORTES DE VENTAS (ROLLUPS DIARIOS)
+# ============================================
+
+def _rango_fechas(prefijo='', dias_por_defecto=30):
+    """Lee desde/hasta (YYYY-MM-DD) de los query params; por defecto los últimos N días"""
+    hasta = request.args.get(f'{prefijo}hasta')
+    desde = request.args.get(f'{prefijo}desde')
+    
+    hasta = datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else date.today()
+    desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else hasta - timedelta(days=dias_por_defecto)
+    
+    if desde > hasta:
+        raise ValueError('La fecha desde no puede ser posterior a hasta')
+    
+    return desde, hasta
+
+
+@bp.route('/reportes/ventas/top-productos', methods=['GET'])
+@gerente_o_farmaceutico
+def reporte_ventas_top_productos(usuario):
+    """
+    Top-N productos más vendidos.
+    Query params: desde, hasta (YYYY-MM-DD), limite (default 10), orden (ingresos|unidades)
+    """
+    try:
+        desde, hasta = _rango_fechas()
+        limite = min(int(request.args.get('limite', 10)), 100)
+        orden = request.args.get('orden', 'ingresos')
+        
+        if orden not in ('ingresos', 'unidades'):
+            return jsonify({'error': 'Orden inválido. Debe ser: ingresos o unidades'}), 400
+        
+        productos = ReporteVentasService.top_productos(desde, hasta, limite, orden)
+        
+        return jsonify({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'orden': orden,
+            'productos': productos
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/reportes/ventas/comparar', methods=['GET'])
+@gerente_o_farmaceutico
+def reporte_ventas_comparar(usuario):
+    """
+    Comparar ventas entre dos periodos.
+    Query params: a_desde, a_hasta, b_desde, b_hasta (YYYY-MM-DD), limite
+    Por defecto compara los últimos 30 días con los 30 anteriores.
+    """
+    try:
+        periodo_b = _rango_fechas('b_')
+        if request.args.get('a_desde') or request.args.get('a_hasta'):
+            periodo_a = _rango_fechas('a_')
+        else:
+            duracion = periodo_b[1] - periodo_b[0]
+            fin_a = periodo_b[0] - timedelta(days=1)
+            periodo_a = (fin_a - duracion, fin_a)
+        
+        limite = min(int(request.args.get('limite', 20)), 200)
+        
+        return jsonify(ReporteVentasService.comparar_periodos(periodo_a, periodo_b, limite)), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/reportes/ventas/serie', methods=['GET'])
+@gerente_o_farmaceutico
+def reporte_ventas_serie(usuario):
+    """
+    Serie de ingresos y unidades vendidas.
+    Query params: desde, hasta (YYYY-MM-DD), producto_id, granularidad (dia|mes)
+    """
+    try:
+        desde, hasta = _rango_fechas()
+        granularidad = request.args.get('granularidad', 'dia')
+        producto_id = request.args.get('producto_id', type=int)
+        
+        if granularidad not in ('dia', 'mes'):
+            return jsonify({'error': 'Granularidad inválida. Debe ser: dia o mes'}), 400
+        
+        serie = ReporteVentasService.serie_ingresos(desde, hasta, producto_id, granularidad)
+        
+        return jsonify({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'producto_id': producto_id,
+            'granularidad': granularidad,
+            'serie': serie
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/reportes/ventas/desglose', methods=['GET'])
+@gerente_o_farmaceutico
+def reporte_ventas_desglose(usuario):
+    """
+    Ventas agregadas por lote o por usuario.
+    Query params: desde, hasta (YYYY-MM-DD), dimension (lote|usuario), limite
+    """
+    try:
+        desde, hasta = _rango_fechas()
+        dimension = request.args.get('dimension', 'lote')
+        limite = min(int(request.args.get('limite', 50)), 500)
+        
+        if dimension not in ('lote', 'usuario'):
+            return jsonify({'error': 'Dimensión inválida. Debe ser: lote o usuario'}), 400
+        
+        return jsonify({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'dimension': dimension,
+            'resultados': ReporteVentasService.desglose(desde, hasta, dimension, limite)
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/reportes/ventas/reconstruir', methods=['POST'])
+@solo_gerente
+def reconstruir_rollups_ventas(usuario):
+    """Reconstruir los rollups de ventas desde el ledger (carga inicial o reparación)"""
+    try:
+        filas = ReporteVentasService.reconstruir()
+        
+        return jsonify({
+            'mensaje': 'Rollups de ventas reconstruidos',
+            'filas': filas
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/reportes/reabastecimiento', methods=['GET'])
+@gerente_o_farmaceutico
+def reporte_reabastecimiento(usuario):
+    """
+    Puntos de reorden y días de cobertura para todo el catálogo.
+    
+    Query params:
+    - metodo: media_movil | suavizado (default media_movil)
+    - ventana: días para media móvil y desviación (default 28)
+    - alpha: factor de suavizado exponencial (default 0.3)
+    - dias_historia: días de ventas analizados (default 90)
+    - dias_entrega: tiempo de reposición del proveedor (default 7)
+    - dias_revision: días hasta el siguiente pedido (default 7)
+    - nivel_servicio: 0.5 - 0.999 (default 0.95)
+    - todos: true para incluir productos sin alerta
+    - limite: máximo de productos devueltos (default 500)
+    """
+    try:
+        metodo = request.args.get('metodo', 'media_movil')
+        if metodo not in ('media_movil', 'suavizado'):
+            return jsonify({'error': 'Método inválido. Debe ser: media_movil o suavizado'}), 400
+        
+        alpha = float(request.args.get('alpha', 0.3))
+        nivel_servicio = float(request.args.get('nivel_servicio', 0.95))
+        if not 0 < alpha <= 1:
+            return jsonify({'error': 'alpha debe estar entre 0 y 1'}), 400
+        if not 0.5 <= nivel_servicio < 1:
+            return jsonify({'error': 'nivel_servicio debe estar entre 0.5 y 0.999'}), 400
+        
+        reporte = ReabastecimientoService.generar_reporte(
+            redis_client=get_redis_client(),
+            solo_alertas=request.args.get('todos') != 'true',
+            limite=min(int(request.args.get('limite', 500)), 5000),
+            dias_historia=min(max(int(request.args.get('dias_historia', 90)), 7), 365),
+            metodo=metodo,
+            ventana=int(request.args.get('ventana', 28)),
+            alpha=alpha,
+            dias_entrega=int(request.args.get('dias_entrega', 7)),
+            dias_revision=int(request.args.get('dias_revision', 7)),
+            nivel_servicio=nivel_servicio
+        )
+        
+        return jsonify(reporte), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# ============================================
+# CADENA DE FRÍO
+# ============================================
+
+def _rango_instantes(dias_por_defecto):
+    """desde/hasta de _rango_fechas como datetime, con hasta incluido entero"""
+    desde, hasta = _rango_fechas(dias_por_defecto=dias_por_defecto)
+    return datetime.combine(desde, datetime.min.time()), \
+        datetime.combine(hasta + timedelta(days=1), datetime.min.time())
+
+
+@bp.route('/cadena-frio/lecturas', methods=['POST'])
+@gerente_o_farmaceutico
+def ingerir_lecturas_temperatura(usuario):
+    """
+    Ingesta por lotes de lecturas de los sensores de temperatura.
+    
+    Body: {"lotes": [{"ubicacion_almacen", "sensor", "lecturas": [[ts, temperatura], ...]}]}
+    ts en ISO 8601 o epoch (segundos); también se acepta un único lote sin envolver.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        lotes = data.get('lotes') if 'lotes' in data else [data]
+        
+        if not lotes:
+            return jsonify({'error': 'No se recibieron lecturas'}), 400
+        
+        resultado = CadenaFrioService.ingerir(get_mongo_db(), lotes)
+        
+        codigo = 201 if resultado['lecturas'] or not resultado['rechazadas'] else 400
+        return jsonify(resultado), codigo
+        
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/cadena-frio/serie', methods=['GET'])
+@gerente_o_farmaceutico
+def serie_temperatura(usuario):
+    """
+    Serie de temperatura precalculada de una ubicación.
+    Query params: ubicacion, desde, hasta (YYYY-MM-DD), granularidad (5min|1h)
+    """
+    try:
+        ubicacion = request.args.get('ubicacion')
+        if not ubicacion:
+            return jsonify({'error': 'ubicacion es requerido'}), 400
+        
+        desde, hasta = _rango_instantes(dias_por_defecto=1)
+        granularidad = request.args.get('granularidad', '1h')
+        
+        return jsonify({
+            'ubicacion': ubicacion,
+            'granularidad': granularidad,
+            'serie': CadenaFrioService.serie(get_mongo_db(), ubicacion, desde, hasta, granularidad)
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/cadena-frio/excursiones', methods=['GET'])
+@gerente_o_farmaceutico
+def excursiones_temperatura(usuario):
+    """
+    Lotes con stock cuya ubicación salió del rango de temperatura del producto.
+    Query params: desde, hasta (YYYY-MM-DD, default últimos 7 días), ubicacion, minimo_minutos
+    """
+    try:
+        desde, hasta = _rango_instantes(dias_por_defecto=7)
+        
+        lotes = CadenaFrioService.detectar_excursiones(
+            get_mongo_db(), desde, hasta,
+            ubicacion=request.args.get('ubicacion'),
+            minimo_minutos=int(request.args.get('minimo_minutos', 0))
+        )
+        
+        return jsonify({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'total': len(lotes),
+            'lotes': lotes
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
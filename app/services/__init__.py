@@ -0,0 +1,29 @@
+from app.services.reportes_ventas import ReporteVentasService
+from app.services.reabastecimiento import ReabastecimientoService
+from app.services.estadisticas_ensayos import EstadisticasEnsayosService
+from app.services.reclutamiento import ReclutamientoService
+from app.services.efectos_adversos import EfectosAdversosService
+from app.services.cadena_frio import CadenaFrioService
+from app.services.grafo_interacciones import GrafoInteraccionesService
+from app.services.estadisticas_grafo import EstadisticasGrafoService
+from app.services.inferencia_interacciones import InferenciaInteraccionesService
+from app.services.sustitucion import SustitucionService
+from app.services.carga_grafo import CargaGrafoService
+from app.services.sincronizacion_interacciones import SincronizacionInteraccionesService
+from app.services.cribado_ventas import CribadoVentasService
+
+__all__ = [
+    'ReporteVentasService',
+    'ReabastecimientoService',
+    'EstadisticasEnsayosService',
+    'ReclutamientoService',
+    'EfectosAdversosService',
+    'CadenaFrioService',
+    'GrafoInteraccionesService',
+    'EstadisticasGrafoService',
+    'InferenciaInteraccionesService',
+    'SustitucionService',
+    'CargaGrafoService',
+    'SincronizacionInteraccionesService',
+    'CribadoVentasService'
+]
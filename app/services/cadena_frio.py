@@ -0,0 +1,283 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ASCENDING, IndexModel
+from pymongo.errors import BulkWriteError, CollectionInvalid
+from sqlalchemy import select
+from app.models.mysql_models import db, Producto, Lote
+
+COLECCION_LECTURAS = 'lecturas_temperatura'
+COLECCION_ROLLUPS = 'temperatura_rollups'
+
+# Granularidades precalculadas (segundos por bucket)
+GRANULARIDADES = {'5min': 300, '1h': 3600}
+
+# Límite inferior para productos refrigerados: temperatura_almacenamiento
+# de Producto es el máximo admitido (p. ej. 8.0 para 2-8 °C)
+TEMPERATURA_MINIMA_REFRIGERADOS = 2.0
+
+TEMPERATURA_VALIDA = (-90.0, 90.0)
+MAXIMO_LECTURAS_POR_PETICION = 50000
+
+INDICES_ROLLUPS = [
+    IndexModel([('ubicacion', ASCENDING), ('granularidad', ASCENDING), ('inicio', ASCENDING)],
+               name='ubicacion_granularidad_inicio', unique=True),
+]
+
+
+def asegurar_colecciones_temperatura(mongo_db):
+    """Crea la colección time-series de lecturas y los índices de rollups"""
+    try:
+        mongo_db.create_collection(
+            COLECCION_LECTURAS,
+            timeseries={'timeField': 'ts', 'metaField': 'meta', 'granularity': 'minutes'},
+            expireAfterSeconds=int(timedelta(days=400).total_seconds())
+        )
+    except CollectionInvalid:
+        pass  # Ya existe
+    mongo_db[COLECCION_ROLLUPS].create_indexes(INDICES_ROLLUPS)
+
+
+def _instante(valor):
+    """ISO 8601 o epoch en segundos -> datetime UTC sin zona"""
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return datetime.utcfromtimestamp(valor)
+    if isinstance(valor, str):
+        instante = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        if instante.tzinfo is not None:
+            instante = (instante - instante.utcoffset()).replace(tzinfo=None)
+        return instante
+    raise ValueError(f'Instante inválido: {valor!r}')
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _inicio_bucket(instante, segundos):
+    """Inicio del bucket de `segundos` que contiene al instante (UTC sin zona)"""
+    transcurridos = int((instante - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=transcurridos - transcurridos % segundos)
+
+
+def normalizar_lote_lecturas(lote):
+    """
+    Lecturas de un sensor en una ubicación.
+
+    Formato:
+    {
+        "ubicacion_almacen": "Cámara Frío 1",
+        "sensor": "cf1-a",
+        "lecturas": [["2024-06-01T10:00:00Z", 4.2], {"ts": 1717236060, "temperatura": 4.3}, ...]
+    }
+
+    Returns:
+        tuple: (meta, [(instante, temperatura)])
+    """
+    ubicacion = lote.get('ubicacion_almacen')
+    if not ubicacion:
+        raise ValueError('ubicacion_almacen es requerido')
+
+    meta = {'ubicacion': ubicacion, 'sensor': lote.get('sensor') or 'principal'}
+    lecturas = []
+    for lectura in lote.get('lecturas') or []:
+        if isinstance(lectura, dict):
+            instante, temperatura = lectura.get('ts'), lectura.get('temperatura')
+        else:
+            instante, temperatura = lectura
+        if isinstance(temperatura, bool) or not isinstance(temperatura, (int, float)):
+            raise ValueError(f'Temperatura inválida: {temperatura!r}')
+        if not TEMPERATURA_VALIDA[0] <= temperatura <= TEMPERATURA_VALIDA[1]:
+            raise ValueError(f'Temperatura fuera del rango del sensor: {temperatura}')
+        lecturas.append((_instante(instante), float(temperatura)))
+
+    return meta, lecturas
+
+
+class CadenaFrioService:
+    """
+    Lecturas de temperatura de las ubicaciones de almacén (colección
+    time-series de MongoDB), rollups precalculados y detección de
+    excursiones de los lotes almacenados en cada ubicación.
+    """
+
+    @staticmethod
+    def ingerir(mongo_db, lotes, tamano_escritura=5000):
+        """
+        Escribe lotes de lecturas con insert_many no ordenados y actualiza
+        los rollups (min, max, suma, n) de cada bucket afectado con un
+        único bulk_write.
+
+        Los rollups se calculan solo con las lecturas que el servidor
+        aceptó: si parte de un insert_many falla, el resto se inserta y
+        cuenta, y las rechazadas se informan aparte.
+
+        Los rollups se acumulan con $inc/$min/$max: reenviar el mismo lote
+        cuenta las lecturas dos veces en la media (no en min/max).
+
+        Returns:
+            dict: lecturas insertadas, rechazadas y buckets de rollup actualizados
+
+        Raises:
+            ValueError: Más de MAXIMO_LECTURAS_POR_PETICION lecturas o una lectura inválida
+        """
+        # Antes de normalizar: una petición enorme no llega a construirse
+        total = sum(len(lote.get('lecturas') or []) for lote in lotes)
+        if total > MAXIMO_LECTURAS_POR_PETICION:
+            raise ValueError(f'Máximo {MAXIMO_LECTURAS_POR_PETICION} lecturas por petición')
+
+        documentos = []
+        for lote in lotes:
+            meta, lecturas = normalizar_lote_lecturas(lote)
+            documentos.extend({'ts': instante, 'meta': meta, 'temperatura': temperatura}
+                              for instante, temperatura in lecturas)
+
+        insertados = []
+        errores = []
+        coleccion = mongo_db[COLECCION_LECTURAS]
+        for inicio in range(0, len(documentos), tamano_escritura):
+            tramo = documentos[inicio:inicio + tamano_escritura]
+            try:
+                coleccion.insert_many(tramo, ordered=False)
+                insertados.extend(tramo)
+            except BulkWriteError as e:
+                fallidos = {error['index'] for error in e.details.get('writeErrors', [])}
+                insertados.extend(d for i, d in enumerate(tramo) if i not in fallidos)
+                errores.extend(
+                    {'ts': tramo[error['index']]['ts'], 'error': error.get('errmsg')}
+                    for error in e.details.get('writeErrors', [])
+                )
+
+        buckets = defaultdict(lambda: {'n': 0, 'suma': 0.0, 'min': None, 'max': None})
+        for documento in insertados:
+            instante, temperatura = documento['ts'], documento['temperatura']
+            for granularidad, segundos in GRANULARIDADES.items():
+                bucket = buckets[(documento['meta']['ubicacion'], granularidad, _inicio_bucket(instante, segundos))]
+                bucket['n'] += 1
+                bucket['suma'] += temperatura
+                bucket['min'] = temperatura if bucket['min'] is None else min(bucket['min'], temperatura)
+                bucket['max'] = temperatura if bucket['max'] is None else max(bucket['max'], temperatura)
+
+        if buckets:
+            mongo_db[COLECCION_ROLLUPS].bulk_write([
+                UpdateOne(
+                    {'ubicacion': ubicacion, 'granularidad': granularidad, 'inicio': inicio},
+                    {
+                        '$inc': {'n': datos['n'], 'suma': datos['suma']},
+                        '$min': {'min': datos['min']},
+                        '$max': {'max': datos['max']}
+                    },
+                    upsert=True
+                )
+                for (ubicacion, granularidad, inicio), datos in buckets.items()
+            ], ordered=False)
+
+        return {
+            'lecturas': len(insertados),
+            'rechazadas': len(errores),
+            'errores': errores[:100],
+            'buckets_actualizados': len(buckets)
+        }
+
+    @staticmethod
+    def serie(mongo_db, ubicacion, desde, hasta, granularidad='1h'):
+        """Serie precalculada (inicio, min, max, media, n) de una ubicación"""
+        if granularidad not in GRANULARIDADES:
+            raise ValueError(f"granularidad inválida. Debe ser: {', '.join(GRANULARIDADES)}")
+
+        buckets = mongo_db[COLECCION_ROLLUPS].find(
+            {'ubicacion': ubicacion, 'granularidad': granularidad,
+             'inicio': {'$gte': desde, '$lt': hasta}},
+            {'_id': 0, 'inicio': 1, 'min': 1, 'max': 1, 'suma': 1, 'n': 1}
+        ).sort('inicio', ASCENDING)
+
+        return [
+            {'inicio': b['inicio'], 'min': b['min'], 'max': b['max'],
+             'media': round(b['suma'] / b['n'], 2), 'n': b['n']}
+            for b in buckets
+        ]
+
+    @staticmethod
+    def rango_objetivo(producto):
+        """(mínimo, máximo) admitidos para un producto; None si no hay límite"""
+        maximo = float(producto.temperatura_almacenamiento) \
+            if producto.temperatura_almacenamiento is not None else None
+        minimo = TEMPERATURA_MINIMA_REFRIGERADOS if producto.requiere_refrigeracion else None
+        return minimo, maximo
+
+    @staticmethod
+    def detectar_excursiones(mongo_db, desde, hasta, ubicacion=None, minimo_minutos=0):
+        """
+        Lotes con stock cuya ubicación estuvo fuera del rango objetivo del
+        producto entre desde y hasta.
+
+        Recorre los rollups de 5 minutos (no las lecturas crudas) y une los
+        buckets consecutivos fuera de rango en excursiones. La asignación
+        lote-ubicación es la actual (Lote.ubicacion_almacen).
+
+        Returns:
+            list: Lotes afectados con sus excursiones, peor primero
+        """
+        consulta = (
+            select(Lote, Producto)
+            .join(Producto, Lote.producto_id == Producto.id)
+            .where(Lote.cantidad_actual > 0, Lote.ubicacion_almacen.isnot(None))
+        )
+        if ubicacion:
+            consulta = consulta.where(Lote.ubicacion_almacen == ubicacion)
+
+        lotes_por_ubicacion = defaultdict(list)
+        for lote, producto in db.session.execute(consulta).all():
+            minimo, maximo = CadenaFrioService.rango_objetivo(producto)
+            if minimo is not None or maximo is not None:
+                lotes_por_ubicacion[lote.ubicacion_almacen].append((lote, producto, minimo, maximo))
+
+        if not lotes_por_ubicacion:
+            return []
+
+        segundos = GRANULARIDADES['5min']
+        buckets = defaultdict(list)
+        for b in mongo_db[COLECCION_ROLLUPS].find(
+            {'ubicacion': {'$in': list(lotes_por_ubicacion)}, 'granularidad': '5min',
+             'inicio': {'$gte': desde, '$lt': hasta}},
+            {'_id': 0, 'ubicacion': 1, 'inicio': 1, 'min': 1, 'max': 1}
+        ).sort([('ubicacion', ASCENDING), ('inicio', ASCENDING)]):
+            buckets[b['ubicacion']].append(b)
+
+        afectados = []
+        for ubicacion_lote, lotes in lotes_por_ubicacion.items():
+            serie = buckets.get(ubicacion_lote, [])
+            for lote, producto, minimo, maximo in lotes:
+                excursiones = []
+                actual = None
+                for b in serie:
+                    fuera = (maximo is not None and b['max'] > maximo) or \
+                            (minimo is not None and b['min'] < minimo)
+                    contiguo = actual is not None and b['inicio'] == actual['fin']
+                    if fuera and contiguo:
+                        actual['fin'] = b['inicio'] + timedelta(seconds=segundos)
+                        actual['temperatura_max'] = max(actual['temperatura_max'], b['max'])
+                        actual['temperatura_min'] = min(actual['temperatura_min'], b['min'])
+                    elif fuera:
+                        actual = {'inicio': b['inicio'], 'fin': b['inicio'] + timedelta(seconds=segundos),
+                                  'temperatura_max': b['max'], 'temperatura_min': b['min']}
+                        excursiones.append(actual)
+                    else:
+                        actual = None
+
+                for excursion in excursiones:
+                    excursion['minutos'] = int((excursion['fin'] - excursion['inicio']).total_seconds() // 60)
+                excursiones = [e for e in excursiones if e['minutos'] >= minimo_minutos]
+
+                if excursiones:
+                    afectados.append({
+                        'lote_id': lote.id,
+                        'numero_lote': lote.numero_lote,
+                        'producto_id': producto.id,
+                        'producto': producto.nombre,
+                        'ubicacion_almacen': ubicacion_lote,
+                        'cantidad_actual': lote.cantidad_actual,
+                        'rango_objetivo': {'min': minimo, 'max': maximo},
+                        'minutos_fuera_de_rango': sum(e['minutos'] for e in excursiones),
+                        'excursiones': excursiones
+                    })
+
+        return sorted(afectados, key=lambda a: -a['minutos_fuera_de_rango'])
@@ -0,0 +1,326 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from app.services.consultas_grafo import ConsultaCypher, abrir_sesion, ejecutar_consulta, validar_consultas
+from app.services.grafo_interacciones import GrafoInteraccionesService
+
+logger = logging.getLogger(__name__)
+
+# Errores por archivo devueltos en el informe (el total se cuenta aparte)
+MAXIMO_ERRORES_DETALLADOS = 100
+
+OPERACIONES = ('upsert', 'borrar')
+
+
+class EntidadCarga:
+    """
+    Archivo de carga (<nombre>.csv o <nombre>.ndjson) y las consultas
+    UNWIND que lo escriben.
+
+    Nodos: columna clave + propiedades. Relaciones: columnas de los dos
+    extremos (etiqueta, propiedad clave) + propiedades. Una columna
+    _operacion=borrar elimina el nodo o la relación de esa fila.
+    """
+
+    __slots__ = ('nombre', 'etiqueta', 'clave', 'tipo', 'origen', 'destino', 'upsert', 'borrar')
+
+    def __init__(self, nombre, etiqueta=None, clave=None, tipo=None, origen=None, destino=None):
+        """
+        Args:
+            etiqueta, clave: Nodos, p. ej. ('Medicamento', 'id')
+            tipo, origen, destino: Relaciones; origen y destino son
+                (etiqueta, propiedad clave, columna del archivo)
+        """
+        self.nombre = nombre
+        self.etiqueta = etiqueta
+        self.clave = clave
+        self.tipo = tipo
+        self.origen = origen
+        self.destino = destino
+
+        if self.es_relacion:
+            (etiqueta_a, clave_a, _), (etiqueta_b, clave_b, _) = origen, destino
+            extremos = f"""
+                MATCH (a:{etiqueta_a} {{{clave_a}: f.origen}})
+                MATCH (b:{etiqueta_b} {{{clave_b}: f.destino}})"""
+            self.upsert = ConsultaCypher(f'cargar_{nombre}', f"""
+                UNWIND $filas AS f{extremos}
+                MERGE (a)-[r:{tipo}]->(b)
+                WITH r, f, coalesce(r.hash_carga = f.hash, false) AS igual
+                FOREACH (_ IN CASE WHEN igual THEN [] ELSE [1] END |
+                    SET r += f.propiedades, r.hash_carga = f.hash)
+                RETURN count(*) AS encontradas, sum(CASE WHEN igual THEN 0 ELSE 1 END) AS escritas
+            """, parametros=['filas'], escritura=True, timeout=120)
+            self.borrar = ConsultaCypher(f'borrar_{nombre}', f"""
+                UNWIND $filas AS f
+                MATCH (a:{etiqueta_a} {{{clave_a}: f.origen}})-[r:{tipo}]->(b:{etiqueta_b} {{{clave_b}: f.destino}})
+                DELETE r
+                RETURN count(*) AS borradas
+            """, parametros=['filas'], escritura=True, timeout=120)
+        else:
+            self.upsert = ConsultaCypher(f'cargar_{nombre}', f"""
+                UNWIND $filas AS f
+                MERGE (n:{etiqueta} {{{clave}: f.clave}})
+                WITH n, f, coalesce(n.hash_carga = f.hash, false) AS igual
+                FOREACH (_ IN CASE WHEN igual THEN [] ELSE [1] END |
+                    SET n += f.propiedades, n.hash_carga = f.hash)
+                RETURN count(*) AS encontradas, sum(CASE WHEN igual THEN 0 ELSE 1 END) AS escritas
+            """, parametros=['filas'], escritura=True, timeout=120)
+            self.borrar = ConsultaCypher(f'borrar_{nombre}', f"""
+                UNWIND $filas AS f
+                MATCH (n:{etiqueta} {{{clave}: f.clave}})
+                DETACH DELETE n
+                RETURN count(*) AS borradas
+            """, parametros=['filas'], escritura=True, timeout=120)
+
+    @property
+    def es_relacion(self):
+        return self.tipo is not None
+
+    @property
+    def columnas_clave(self):
+        return (self.origen[2], self.destino[2]) if self.es_relacion else (self.clave,)
+
+
+# En orden de carga: los nodos antes que las relaciones que los unen
+ENTIDADES = [
+    EntidadCarga('compuestos', etiqueta='Compuesto', clave='id'),
+    EntidadCarga('principios_activos', etiqueta='PrincipioActivo', clave='id'),
+    EntidadCarga('medicamentos', etiqueta='Medicamento', clave='id'),
+    EntidadCarga('categorias', etiqueta='Categoria', clave='nombre'),
+    EntidadCarga('transformaciones', tipo='SE_TRANSFORMA_EN',
+                 origen=('Compuesto', 'id', 'compuesto_id'),
+                 destino=('PrincipioActivo', 'id', 'principio_activo_id')),
+    EntidadCarga('composiciones', tipo='COMPONE',
+                 origen=('PrincipioActivo', 'id', 'principio_activo_id'),
+                 destino=('Medicamento', 'id', 'medicamento_id')),
+    EntidadCarga('pertenencias', tipo='PERTENECE_A',
+                 origen=('Medicamento', 'id', 'medicamento_id'),
+                 destino=('Categoria', 'nombre', 'categoria')),
+    EntidadCarga('interacciones', tipo='INTERACCIONA_CON',
+                 origen=('Medicamento', 'id', 'medicamento_a_id'),
+                 destino=('Medicamento', 'id', 'medicamento_b_id')),
+]
+
+validar_consultas([c for entidad in ENTIDADES for c in (entidad.upsert, entidad.borrar)])
+
+# Antes de cargar: los MERGE por clave usan el índice de la restricción
+ESQUEMA = [
+    'CREATE CONSTRAINT compuesto_id IF NOT EXISTS FOR (c:Compuesto) REQUIRE c.id IS UNIQUE',
+    'CREATE CONSTRAINT medicamento_id IF NOT EXISTS FOR (m:Medicamento) REQUIRE m.id IS UNIQUE',
+    'CREATE CONSTRAINT principio_activo_id IF NOT EXISTS FOR (pa:PrincipioActivo) REQUIRE pa.id IS UNIQUE',
+    'CREATE CONSTRAINT categoria_nombre IF NOT EXISTS FOR (cat:Categoria) REQUIRE cat.nombre IS UNIQUE',
+    'CREATE INDEX medicamento_nombre IF NOT EXISTS FOR (m:Medicamento) ON (m.nombre)',
+    'CREATE INDEX principio_activo_nombre IF NOT EXISTS FOR (pa:PrincipioActivo) ON (pa.nombre)',
+]
+
+
+def _valor_csv(texto):
+    """Celda CSV: JSON si lo es (números, booleanos, listas), si no texto"""
+    try:
+        return json.loads(texto)
+    except ValueError:
+        return texto
+
+
+def leer_filas(ruta):
+    """
+    Filas de un archivo .csv (cabecera en la primera línea) o .ndjson, sin
+    cargarlo entero en memoria.
+
+    Yields:
+        tuple: (número de línea, dict en CSV o texto de la línea en NDJSON)
+    """
+    with open(ruta, encoding='utf-8-sig', newline='') as archivo:
+        if ruta.endswith('.csv'):
+            lector = csv.DictReader(archivo)
+            for fila in lector:
+                yield lector.line_num, fila
+            return
+        for numero, linea in enumerate(archivo, start=1):
+            if linea.strip():
+                yield numero, linea
+
+
+def preparar_fila(entidad, fila, desde_csv=False):
+    """
+    Fila del archivo -> (operación, fila de $filas).
+
+    Las celdas CSV vacías se omiten y el resto se interpreta como JSON
+    salvo las columnas clave, que siempre son texto.
+
+    Raises:
+        ValueError: JSON inválido, fila sin clave, operación desconocida o
+                    propiedad anidada
+    """
+    if isinstance(fila, str):
+        fila = json.loads(fila)
+    if not isinstance(fila, dict):
+        raise ValueError('La fila debe ser un objeto JSON')
+    fila = dict(fila)
+    operacion = fila.pop('_operacion', None) or 'upsert'
+    if operacion not in OPERACIONES:
+        raise ValueError(f"_operacion inválida: {operacion!r}. Debe ser: {', '.join(OPERACIONES)}")
+
+    claves = []
+    for columna in entidad.columnas_clave:
+        valor = fila.pop(columna, None)
+        if valor in (None, ''):
+            raise ValueError(f'{columna} es requerido')
+        claves.append(valor)
+
+    propiedades = {}
+    for nombre, valor in fila.items():
+        if desde_csv:
+            if valor in (None, ''):
+                continue
+            valor = _valor_csv(valor)
+        if isinstance(valor, dict) or (isinstance(valor, list) and any(isinstance(v, (dict, list)) for v in valor)):
+            raise ValueError(f'{nombre}: Neo4j no admite propiedades anidadas')
+        if valor is not None:
+            propiedades[nombre] = valor
+
+    resultado = {'origen': claves[0], 'destino': claves[1]} if entidad.es_relacion else {'clave': claves[0]}
+    if operacion == 'upsert':
+        resultado['propiedades'] = propiedades
+        resultado['hash'] = hashlib.sha1(
+            json.dumps(propiedades, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+    return operacion, resultado
+
+
+def buscar_archivo(directorio, entidad):
+    for extension in ('.ndjson', '.csv'):
+        ruta = os.path.join(directorio, entidad.nombre + extension)
+        if os.path.exists(ruta):
+            return ruta
+    return None
+
+
+class CargaGrafoService:
+    """
+    Carga del catálogo del grafo desde archivos CSV / NDJSON con MERGE en
+    lotes UNWIND, una transacción de escritura por lote.
+
+    Cada nodo y relación guarda el hash de sus propiedades (hash_carga):
+    recargar el catálogo completo o un archivo con solo los cambios
+    (carga delta) reescribe únicamente las filas nuevas o modificadas.
+    """
+
+    @staticmethod
+    def crear_esquema(driver):
+        """Restricciones e índices (idempotente); espera a que estén en línea"""
+        with abrir_sesion(driver, escritura=True) as session:
+            for sentencia in ESQUEMA:
+                session.run(sentencia).consume()
+            session.run('CALL db.awaitIndexes(300)').consume()
+
+    @staticmethod
+    def cargar_entidad(driver, entidad, ruta, tamano_lote=5000):
+        """
+        Un archivo en lotes de tamano_lote filas.
+
+        Las filas se escriben en el orden del archivo: al cambiar de
+        operación (upsert / borrar) se envía antes el lote pendiente de la
+        otra, así un "borrar X" seguido de un "upsert X" deja X en el grafo.
+
+        Returns:
+            dict: filas, escritas, sin_cambios, borradas, sin_extremos
+                  (relaciones con algún nodo inexistente), errores,
+                  segundos y filas_por_segundo
+        """
+        inicio = time.perf_counter()
+        informe = {'archivo': ruta, 'filas': 0, 'escritas': 0, 'sin_cambios': 0, 'borradas': 0,
+                   'sin_extremos': 0, 'total_errores': 0, 'errores': []}
+        lotes = {'upsert': [], 'borrar': []}
+
+        def escribir(operacion):
+            filas = lotes[operacion]
+            if not filas:
+                return
+            if operacion == 'upsert':
+                resultado = ejecutar_consulta(driver, entidad.upsert, {'filas': filas})[0]
+                escritas = resultado['escritas'] or 0
+                informe['escritas'] += escritas
+                informe['sin_cambios'] += resultado['encontradas'] - escritas
+                informe['sin_extremos'] += len(filas) - resultado['encontradas']
+            else:
+                informe['borradas'] += ejecutar_consulta(driver, entidad.borrar, {'filas': filas})[0]['borradas']
+            lotes[operacion] = []
+
+        desde_csv = ruta.endswith('.csv')
+        for numero, fila in leer_filas(ruta):
+            informe['filas'] += 1
+            try:
+                # json.JSONDecodeError también es ValueError
+                operacion, preparada = preparar_fila(entidad, fila, desde_csv)
+            except ValueError as e:
+                informe['total_errores'] += 1
+                if len(informe['errores']) < MAXIMO_ERRORES_DETALLADOS:
+                    informe['errores'].append({'linea': numero, 'error': str(e)})
+                continue
+            escribir('borrar' if operacion == 'upsert' else 'upsert')
+            lotes[operacion].append(preparada)
+            if len(lotes[operacion]) >= tamano_lote:
+                escribir(operacion)
+
+        escribir('upsert')
+        escribir('borrar')
+        duracion = time.perf_counter() - inicio
+        informe['segundos'] = round(duracion, 3)
+        informe['filas_por_segundo'] = round(informe['filas'] / duracion) if duracion else None
+        return informe
+
+    @staticmethod
+    def cargar(driver, redis_client, directorio, tamano_lote=5000, al_cargar=None):
+        """
+        Carga los archivos presentes en el directorio, en el orden de
+        ENTIDADES, tras crear el esquema. Si algo cambió incrementa la
+        versión del grafo (instantáneas y estadísticas de los workers).
+
+        Args:
+            al_cargar: Callback con (entidad, informe) de cada archivo
+
+        Returns:
+            dict: Informe por archivo y rendimiento en nodos/s y relaciones/s
+        """
+        if not os.path.isdir(directorio):
+            raise ValueError(f'No existe el directorio {directorio}')
+        encontradas = [(e, buscar_archivo(directorio, e)) for e in ENTIDADES]
+        encontradas = [(e, ruta) for e, ruta in encontradas if ruta]
+        if not encontradas:
+            raise ValueError(f"Sin archivos de carga en {directorio} "
+                             f"({', '.join(e.nombre for e in ENTIDADES)}; .csv o .ndjson)")
+
+        inicio = time.perf_counter()
+        CargaGrafoService.crear_esquema(driver)
+
+        informes = {}
+        totales = {'nodos': {'filas': 0, 'segundos': 0.0}, 'relaciones': {'filas': 0, 'segundos': 0.0}}
+        for entidad, ruta in encontradas:
+            inicio_archivo = time.perf_counter()
+            informe = CargaGrafoService.cargar_entidad(driver, entidad, ruta, tamano_lote)
+            informes[entidad.nombre] = informe
+            total = totales['relaciones' if entidad.es_relacion else 'nodos']
+            total['filas'] += informe['filas']
+            total['segundos'] += time.perf_counter() - inicio_archivo
+            logger.info('Carga %s: %s', entidad.nombre, informe)
+            if al_cargar is not None:
+                al_cargar(entidad, informe)
+
+        cambios = sum(i['escritas'] + i['borradas'] for i in informes.values())
+        version = GrafoInteraccionesService.incrementar_version(redis_client) if cambios else None
+
+        return {
+            'archivos': informes,
+            'nodos_por_segundo': round(totales['nodos']['filas'] / totales['nodos']['segundos'])
+            if totales['nodos']['segundos'] else None,
+            'relaciones_por_segundo': round(totales['relaciones']['filas'] / totales['relaciones']['segundos'])
+            if totales['relaciones']['segundos'] else None,
+            'cambios': cambios,
+            'version': version,
+            'segundos': round(time.perf_counter() - inicio, 3)
+        }
@@ -0,0 +1,233 @@
+import base64
+import json
+import re
+import unicodedata
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING
+
+# Solo los ensayos no archivados entran en los índices de listado: el
+# filtro por defecto {archivado: false} los usa y los archivados no pesan
+SOLO_ACTIVOS = {'archivado': False}
+
+# Campos que necesita la tabla resumen de la UI
+PROYECCION_RESUMEN = {
+    'codigo_ensayo': 1,
+    'farmaco': 1,
+    'principio_activo': 1,
+    'fase': 1,
+    'estado': 1,
+    'fecha_inicio': 1,
+    'fecha_fin_estimada': 1,
+    'objetivo_principal': 1,
+    'metadata.version_documento': 1,
+}
+
+PERFILES = {
+    'resumen': PROYECCION_RESUMEN,
+    'completo': None,
+}
+
+ORDEN_LISTADO = [('fecha_inicio', DESCENDING), ('_id', DESCENDING)]
+
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 200
+
+
+def normalizar_texto(texto):
+    """Minúsculas, sin acentos y con espacios simples ("Ácido  Fólico" -> "acido folico")"""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_acentos.lower().split())
+
+
+def filtro_prefijo_farmaco(texto):
+    """
+    Búsqueda por prefijo sobre farmaco_search (normalizado).
+
+    La entrada se escapa con re.escape y la expresión queda anclada y sin
+    opciones, así MongoDB la resuelve como un rango del índice farmaco_search.
+    """
+    normalizado = normalizar_texto(texto)
+    if not normalizado:
+        raise ValueError('El parámetro farmaco no puede estar vacío')
+    return {'farmaco_search': {'$regex': '^' + re.escape(normalizado)}}
+
+
+def filtro_texto_libre(texto):
+    """
+    Búsqueda de texto libre sobre el índice de texto (farmaco,
+    principio_activo, objetivo_principal).
+
+    Solo se conservan palabras: las comillas y el prefijo "-" del lenguaje
+    de $text (frases y negaciones) no llegan desde el usuario.
+    """
+    palabras = re.findall(r'\w+', texto or '')
+    if not palabras:
+        raise ValueError('El parámetro q no puede estar vacío')
+    return {'$text': {'$search': ' '.join(palabras[:20])}}
+
+
+def filtro_busqueda_avanzada(criterios):
+    """
+    Filtro de la búsqueda avanzada.
+
+    El rango de edad [edad_minima, edad_maxima] se interpreta como la
+    población buscada: el ensayo debe admitir todo el rango, es decir
+    su edad mínima <= edad_minima y su edad máxima >= edad_maxima.
+    """
+    query = {}
+
+    if 'fase' in criterios:
+        query['fase'] = {'$in': criterios['fase']}
+
+    if 'estado' in criterios:
+        query['estado'] = {'$in': criterios['estado']}
+
+    edad_minima = criterios.get('edad_minima')
+    edad_maxima = criterios.get('edad_maxima')
+    if edad_minima is not None and edad_maxima is not None and edad_minima > edad_maxima:
+        raise ValueError('edad_minima no puede ser mayor que edad_maxima')
+
+    if edad_minima is not None:
+        query['criterios_inclusion.edad_minima'] = {'$lte': edad_minima}
+
+    if edad_maxima is not None:
+        query['criterios_inclusion.edad_maxima'] = {'$gte': edad_maxima}
+
+    if 'condiciones' in criterios:
+        query['criterios_inclusion.condiciones_medicas'] = {
+            '$in': criterios['condiciones']
+        }
+
+    return query
+
+
+def _planes_ganadores(explain):
+    """winningPlan de un explain de find o de aggregate ($cursor por etapa)"""
+    planes = []
+    pendientes = [explain]
+    while pendientes:
+        nodo = pendientes.pop()
+        if isinstance(nodo, dict):
+            if 'winningPlan' in nodo:
+                planes.append(nodo['winningPlan'])
+            pendientes.extend(v for k, v in nodo.items()
+                              if k not in ('winningPlan', 'rejectedPlans', 'executionStats'))
+        elif isinstance(nodo, list):
+            pendientes.extend(nodo)
+    return planes
+
+
+def etapas_plan(explain):
+    """Nombres de las etapas del plan ganador de un explain()"""
+    etapas = []
+    pendientes = _planes_ganadores(explain)
+    while pendientes:
+        nodo = pendientes.pop()
+        if isinstance(nodo, dict):
+            if 'stage' in nodo:
+                etapas.append(nodo['stage'])
+            pendientes.extend(nodo.values())
+        elif isinstance(nodo, list):
+            pendientes.extend(nodo)
+    return etapas
+
+
+def usa_indice(explain):
+    """True si el plan ganador no recorre la colección completa"""
+    etapas = etapas_plan(explain)
+    return bool(etapas) and 'COLLSCAN' not in etapas
+
+
+class CursorInvalido(ValueError):
+    """Cursor de paginación mal formado"""
+    pass
+
+
+def codificar_cursor(doc):
+    """Cursor opaco con la clave (fecha_inicio, _id) del último documento"""
+    fecha = doc.get('fecha_inicio')
+    datos = {
+        'f': fecha.isoformat() if isinstance(fecha, datetime) else None,
+        'i': str(doc['_id'])
+    }
+    return base64.urlsafe_b64encode(json.dumps(datos).encode()).decode()
+
+
+def decodificar_cursor(token):
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(token.encode()))
+        fecha = datetime.fromisoformat(datos['f']) if datos['f'] else None
+        return fecha, ObjectId(datos['i'])
+    except Exception:
+        raise CursorInvalido('Cursor de paginación inválido')
+
+
+def filtro_keyset(token):
+    """
+    Condición "después de" para el orden (fecha_inicio desc, _id desc).
+
+    Los documentos sin fecha_inicio van al final en orden descendente,
+    por eso se incluyen explícitamente cuando el cursor tiene fecha.
+    """
+    fecha, oid = decodificar_cursor(token)
+
+    if fecha is None:
+        return {'fecha_inicio': None, '_id': {'$lt': oid}}
+
+    return {'$or': [
+        {'fecha_inicio': {'$lt': fecha}},
+        {'fecha_inicio': fecha, '_id': {'$lt': oid}},
+        {'fecha_inicio': None},
+    ]}
+
+
+def construir_consulta(filtro, cursor=None, incluir_archivados=False):
+    """Filtro final de un listado: criterios + activos + posición del cursor"""
+    condiciones = [filtro] if filtro else []
+    if not incluir_archivados:
+        condiciones.append(SOLO_ACTIVOS)
+    if cursor:
+        condiciones.append(filtro_keyset(cursor))
+
+    if len(condiciones) > 1:
+        return {'$and': condiciones}
+    return condiciones[0] if condiciones else {}
+
+
+def paginar_ensayos(collection, filtro, fields='resumen', cursor=None,
+                    limite=LIMITE_POR_DEFECTO, incluir_archivados=False):
+    """
+    Página de ensayos con proyección y paginación keyset.
+
+    Args:
+        collection: Colección ensayos_clinicos
+        filtro: Filtro de la consulta
+        fields: Perfil de proyección ('resumen' o 'completo')
+        cursor: Cursor devuelto por la página anterior
+        limite: Tamaño de página (acotado a LIMITE_MAXIMO)
+        incluir_archivados: Incluir ensayos archivados
+
+    Returns:
+        tuple: (documentos, siguiente_cursor o None)
+    """
+    if fields not in PERFILES:
+        raise ValueError(f"fields inválido. Debe ser: {', '.join(PERFILES)}")
+
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    consulta = construir_consulta(filtro, cursor, incluir_archivados)
+
+    documentos = list(
+        collection.find(consulta, PERFILES[fields])
+        .sort(ORDEN_LISTADO)
+        .limit(limite + 1)
+        .batch_size(limite + 1)
+    )
+
+    siguiente = None
+    if len(documentos) > limite:
+        documentos = documentos[:limite]
+        siguiente = codificar_cursor(documentos[-1])
+
+    return documentos, siguiente
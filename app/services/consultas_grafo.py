@@ -0,0 +1,570 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from neo4j import GraphDatabase, Bookmarks, READ_ACCESS, WRITE_ACCESS, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+# Cláusulas que una consulta de lectura no puede contener
+_CLAUSULAS_ESCRITURA = re.compile(r'\b(CREATE|MERGE|DELETE|DETACH|SET|REMOVE|FOREACH)\b', re.IGNORECASE)
+_PARAMETRO = re.compile(r'\$(\w+)')
+
+
+class ConsultaCypher:
+    """
+    Sentencia Cypher con nombre y parámetros declarados.
+
+    El texto es fijo: todos los valores llegan como parámetros, así cada
+    consulta ocupa una sola entrada en la cache de planes de Neo4j.
+    """
+
+    __slots__ = ('nombre', 'texto', 'parametros', 'escritura', 'fetch_size', 'timeout', 'max_filas')
+
+    def __init__(self, nombre, texto, parametros=(), escritura=False, fetch_size=1000,
+                 timeout=None, max_filas=None):
+        """
+        Args:
+            timeout: Segundos antes de que Neo4j aborte la transacción
+                     (None: NEO4J_QUERY_TIMEOUT)
+            max_filas: Filas leídas como mucho (None: NEO4J_MAX_FILAS, 0: sin límite)
+        """
+        self.nombre = nombre
+        self.texto = texto.strip()
+        self.parametros = frozenset(parametros)
+        self.escritura = escritura
+        self.fetch_size = fetch_size
+        self.timeout = timeout
+        self.max_filas = max_filas
+
+
+_REGISTRO = [
+    ConsultaCypher('listar_medicamentos', """
+        MATCH (m:Medicamento)
+        RETURN m.id as id, m.nombre as nombre, m.nombre_comercial as nombre_comercial,
+               m.dosis as dosis, m.laboratorio as laboratorio
+        ORDER BY m.nombre
+    """, fetch_size=2000),
+
+    ConsultaCypher('detalle_medicamento', """
+        MATCH (m:Medicamento {id: $medicamento_id})
+        OPTIONAL MATCH (pa:PrincipioActivo)-[:COMPONE]->(m)
+        OPTIONAL MATCH (c:Compuesto)-[:SE_TRANSFORMA_EN]->(pa)
+        OPTIONAL MATCH (m)-[:PERTENECE_A]->(cat:Categoria)
+        RETURN m,
+               collect(DISTINCT pa) as principios_activos,
+               collect(DISTINCT c) as compuestos,
+               collect(DISTINCT cat.nombre) as categorias
+    """, parametros=['medicamento_id'], fetch_size=10),
+
+    # $severidad = null devuelve todas las severidades
+    ConsultaCypher('interacciones_medicamento', """
+        MATCH (m1:Medicamento {id: $medicamento_id})-[r:INTERACCIONA_CON]-(m2:Medicamento)
+        WHERE $severidad IS NULL OR r.severidad = $severidad
+        RETURN m1.nombre as medicamento_origen,
+               m2.id as medicamento_interaccion_id,
+               m2.nombre as medicamento_interaccion,
+               m2.nombre_comercial as nombre_comercial,
+               r.tipo as tipo_interaccion,
+               r.severidad as severidad,
+               r.descripcion as descripcion,
+               r.recomendaciones as recomendaciones,
+               r.nivel_evidencia as nivel_evidencia
+        ORDER BY
+            CASE r.severidad
+                WHEN 'grave' THEN 1
+                WHEN 'moderada' THEN 2
+                WHEN 'leve' THEN 3
+                ELSE 4
+            END
+    """, parametros=['medicamento_id', 'severidad'], fetch_size=200),
+
+    ConsultaCypher('verificar_interacciones', """
+        MATCH (m1:Medicamento)-[r:INTERACCIONA_CON]-(m2:Medicamento)
+        WHERE m1.id IN $medicamentos AND m2.id IN $medicamentos
+        RETURN DISTINCT
+            m1.id as medicamento_a_id,
+            m1.nombre as medicamento_a,
+            m2.id as medicamento_b_id,
+            m2.nombre as medicamento_b,
+            r.severidad as severidad,
+            r.descripcion as descripcion,
+            r.recomendaciones as recomendaciones
+        ORDER BY
+            CASE r.severidad
+                WHEN 'grave' THEN 1
+                WHEN 'moderada' THEN 2
+                WHEN 'leve' THEN 3
+            END
+    """, parametros=['medicamentos'], fetch_size=200, timeout=5),
+
+    # Varias prescripciones por llamada: una fila por lista con interacciones
+    ConsultaCypher('verificar_interacciones_lote', """
+        UNWIND $listas AS lista
+        MATCH (m1:Medicamento)-[r:INTERACCIONA_CON]-(m2:Medicamento)
+        WHERE m1.id IN lista.medicamentos AND m2.id IN lista.medicamentos
+        RETURN lista.indice as indice, collect(DISTINCT {
+            medicamento_a_id: m1.id,
+            medicamento_a: m1.nombre,
+            medicamento_b_id: m2.id,
+            medicamento_b: m2.nombre,
+            severidad: r.severidad,
+            descripcion: r.descripcion,
+            recomendaciones: r.recomendaciones
+        }) as interacciones
+    """, parametros=['listas'], fetch_size=1000, timeout=60, max_filas=0),
+
+    ConsultaCypher('listar_principios_activos', """
+        MATCH (pa:PrincipioActivo)
+        OPTIONAL MATCH (pa)-[:COMPONE]->(m:Medicamento)
+        RETURN pa.id as id,
+               pa.nombre as nombre,
+               pa.mecanismo_accion as mecanismo_accion,
+               pa.indicaciones as indicaciones,
+               count(m) as cantidad_medicamentos
+        ORDER BY pa.nombre
+    """, fetch_size=2000),
+
+    ConsultaCypher('cadena_compuesto', """
+        MATCH path = (c:Compuesto {id: $compuesto_id})-[:SE_TRANSFORMA_EN]->(pa:PrincipioActivo)-[:COMPONE]->(m:Medicamento)
+        RETURN c.nombre as compuesto,
+               c.formula_quimica as formula,
+               pa.nombre as principio_activo,
+               pa.mecanismo_accion as mecanismo,
+               collect({
+                   id: m.id,
+                   nombre: m.nombre,
+                   nombre_comercial: m.nombre_comercial,
+                   laboratorio: m.laboratorio
+               }) as medicamentos
+    """, parametros=['compuesto_id'], fetch_size=100),
+
+    ConsultaCypher('ruta_completa_medicamento', """
+        MATCH path = (c:Compuesto)-[:SE_TRANSFORMA_EN]->(pa:PrincipioActivo)-[:COMPONE]->(m:Medicamento {id: $medicamento_id})
+        RETURN c.nombre as compuesto,
+               c.nombre_quimico as compuesto_quimico,
+               c.formula_quimica as formula,
+               pa.nombre as principio_activo,
+               pa.mecanismo_accion as mecanismo_accion,
+               m.nombre as medicamento,
+               m.nombre_comercial as nombre_comercial,
+               m.dosis as dosis,
+               m.forma_farmaceutica as forma_farmaceutica
+    """, parametros=['medicamento_id'], fetch_size=100),
+
+    # Estadísticas del grafo: los conteos por etiqueta y tipo salen del
+    # count store (ver estadisticas_grafo.consulta_conteos)
+    ConsultaCypher('etiquetas_grafo', """
+        CALL db.labels() YIELD label
+        RETURN collect(label) as etiquetas
+    """, fetch_size=10),
+
+    ConsultaCypher('tipos_relacion_grafo', """
+        CALL db.relationshipTypes() YIELD relationshipType
+        RETURN collect(relationshipType) as tipos
+    """, fetch_size=10),
+
+    ConsultaCypher('medicamentos_por_categoria', """
+        MATCH (m:Medicamento)-[:PERTENECE_A]->(c:Categoria)
+        WHERE c.nombre = $categoria
+        RETURN m.id as id,
+               m.nombre as nombre,
+               m.nombre_comercial as nombre_comercial,
+               m.dosis as dosis,
+               m.laboratorio as laboratorio
+        ORDER BY m.nombre
+    """, parametros=['categoria'], fetch_size=2000),
+
+    # Carga de la instantánea en memoria (grafo_interacciones)
+    ConsultaCypher('instantanea_medicamentos', """
+        MATCH (m:Medicamento)
+        RETURN m.id as id, m.nombre as nombre
+    """, fetch_size=10000, timeout=120, max_filas=0),
+
+    ConsultaCypher('instantanea_interacciones', """
+        MATCH (a:Medicamento)-[r:INTERACCIONA_CON]->(b:Medicamento)
+        RETURN a.id as a, b.id as b, r.severidad as severidad,
+               r.descripcion as descripcion, r.recomendaciones as recomendaciones
+    """, fetch_size=10000, timeout=120, max_filas=0),
+
+    ConsultaCypher('instantanea_clases', """
+        MATCH (m:Medicamento)
+        OPTIONAL MATCH (pa:PrincipioActivo)-[:COMPONE]->(m)
+        OPTIONAL MATCH (m)-[:PERTENECE_A]->(cat:Categoria)
+        WITH m, collect(DISTINCT pa.id) as principios, collect(DISTINCT cat.nombre) as categorias
+        WHERE size(principios) > 0 OR size(categorias) > 0
+        RETURN m.id as id, principios, categorias
+    """, fetch_size=10000, timeout=120, max_filas=0),
+
+    ConsultaCypher('instantanea_inferidas', """
+        MATCH (a)-[r:INTERACCION_INFERIDA]->(b)
+        RETURN r.via as via,
+               CASE WHEN a:PrincipioActivo THEN a.id ELSE a.nombre END as clase_a,
+               CASE WHEN b:PrincipioActivo THEN b.id ELSE b.nombre END as clase_b,
+               r.severidad as severidad, r.descripcion as descripcion,
+               r.recomendaciones as recomendaciones,
+               r.fuente_a as fuente_a, r.fuente_b as fuente_b, r.fuentes as fuentes
+    """, fetch_size=10000, timeout=120, max_filas=0),
+
+    # Interacciones inferidas por clase (inferencia_interacciones). Con
+    # Cypher se resuelven en el mismo lote de listas que las directas
+    ConsultaCypher('verificar_interacciones_inferidas_lote', """
+        UNWIND $listas AS lista
+        CALL {
+            WITH lista
+            MATCH (m1:Medicamento)<-[:COMPONE]-(c1:PrincipioActivo)
+                  -[r:INTERACCION_INFERIDA]->(c2:PrincipioActivo)-[:COMPONE]->(m2:Medicamento)
+            WHERE m1.id IN lista.medicamentos AND m2.id IN lista.medicamentos AND m1 <> m2
+            RETURN m1, m2, r, c1.id as clase_a, c2.id as clase_b
+            UNION ALL
+            WITH lista
+            MATCH (m1:Medicamento)-[:PERTENECE_A]->(c1:Categoria)
+                  -[r:INTERACCION_INFERIDA]->(c2:Categoria)<-[:PERTENECE_A]-(m2:Medicamento)
+            WHERE m1.id IN lista.medicamentos AND m2.id IN lista.medicamentos AND m1 <> m2
+            RETURN m1, m2, r, c1.nombre as clase_a, c2.nombre as clase_b
+        }
+        RETURN lista.indice as indice, collect({
+            medicamento_a_id: m1.id,
+            medicamento_a: m1.nombre,
+            medicamento_b_id: m2.id,
+            medicamento_b: m2.nombre,
+            via: r.via,
+            clase_a: clase_a,
+            clase_b: clase_b,
+            severidad: r.severidad,
+            descripcion: r.descripcion,
+            recomendaciones: r.recomendaciones,
+            fuente_a: r.fuente_a,
+            fuente_b: r.fuente_b,
+            fuentes: r.fuentes
+        }) as candidatas
+    """, parametros=['listas'], fetch_size=1000, timeout=60, max_filas=0),
+
+    # Materialización de las tablas por clase (inferencia_interacciones)
+    ConsultaCypher('fuentes_inferencia_principios', """
+        MATCH (m1:Medicamento)-[r:INTERACCIONA_CON]->(m2:Medicamento)
+        MATCH (c1:PrincipioActivo)-[:COMPONE]->(m1)
+        MATCH (c2:PrincipioActivo)-[:COMPONE]->(m2)
+        WHERE c1 <> c2
+        RETURN c1.id as clase_a, c2.id as clase_b, m1.id as fuente_a, m2.id as fuente_b,
+               r.severidad as severidad, r.descripcion as descripcion,
+               r.recomendaciones as recomendaciones
+    """, fetch_size=10000, timeout=300, max_filas=0),
+
+    ConsultaCypher('fuentes_inferencia_categorias', """
+        MATCH (m1:Medicamento)-[r:INTERACCIONA_CON]->(m2:Medicamento)
+        MATCH (m1)-[:PERTENECE_A]->(c1:Categoria)
+        MATCH (m2)-[:PERTENECE_A]->(c2:Categoria)
+        WHERE c1 <> c2
+        RETURN c1.nombre as clase_a, c2.nombre as clase_b, m1.id as fuente_a, m2.id as fuente_b,
+               r.severidad as severidad, r.descripcion as descripcion,
+               r.recomendaciones as recomendaciones
+    """, fetch_size=10000, timeout=300, max_filas=0),
+
+    ConsultaCypher('escribir_inferidas_principios', """
+        UNWIND $filas AS f
+        MATCH (a:PrincipioActivo {id: f.clase_a})
+        MATCH (b:PrincipioActivo {id: f.clase_b})
+        MERGE (a)-[r:INTERACCION_INFERIDA]->(b)
+        SET r += f.propiedades, r.materializacion = $materializacion
+    """, parametros=['filas', 'materializacion'], escritura=True, timeout=120),
+
+    ConsultaCypher('escribir_inferidas_categorias', """
+        UNWIND $filas AS f
+        MATCH (a:Categoria {nombre: f.clase_a})
+        MATCH (b:Categoria {nombre: f.clase_b})
+        MERGE (a)-[r:INTERACCION_INFERIDA]->(b)
+        SET r += f.propiedades, r.materializacion = $materializacion
+    """, parametros=['filas', 'materializacion'], escritura=True, timeout=120),
+
+    # Sincronización desde MySQL interacciones_medicamentosas: el lote, el
+    # watermark y los huecos de ids pendientes se confirman en la misma
+    # transacción (huecos_desde: epoch en que se saltó cada hueco)
+    ConsultaCypher('watermark_sincronizacion', """
+        MATCH (s:Sincronizacion {nombre: $nombre})
+        RETURN s.watermark as watermark, s.huecos as huecos, s.huecos_desde as huecos_desde,
+               s.actualizado_en as actualizado_en
+    """, parametros=['nombre'], fetch_size=10),
+
+    ConsultaCypher('aplicar_interacciones_mysql', """
+        CALL {
+            UNWIND $borrar AS f
+            MATCH (a:Medicamento {id: f.origen})-[r:INTERACCIONA_CON]->(b:Medicamento {id: f.destino})
+            WHERE r.interaccion_mysql_id = f.interaccion_id
+            DELETE r
+            RETURN count(*) AS borradas
+        }
+        CALL {
+            UNWIND $upsert AS f
+            MATCH (a:Medicamento {id: f.origen})
+            MATCH (b:Medicamento {id: f.destino})
+            MERGE (a)-[r:INTERACCIONA_CON]->(b)
+            SET r += f.propiedades
+            RETURN count(*) AS escritas
+        }
+        MERGE (s:Sincronizacion {nombre: $nombre})
+        SET s.watermark = CASE WHEN coalesce(s.watermark, 0) < $watermark THEN $watermark ELSE s.watermark END,
+            s.huecos = $huecos,
+            s.huecos_desde = $huecos_desde,
+            s.actualizado_en = datetime()
+        RETURN borradas, escritas, s.watermark as watermark
+    """, parametros=['borrar', 'upsert', 'nombre', 'watermark', 'huecos', 'huecos_desde'],
+        escritura=True, timeout=60),
+
+    # Las aristas que no se reescribieron en esta materialización ya no
+    # tienen interacción de origen
+    ConsultaCypher('borrar_inferidas_obsoletas', """
+        MATCH ()-[r:INTERACCION_INFERIDA]->()
+        WHERE r.materializacion <> $materializacion
+        DELETE r
+        RETURN count(*) as borradas
+    """, parametros=['materializacion'], escritura=True, timeout=120),
+]
+
+CONSULTAS = {consulta.nombre: consulta for consulta in _REGISTRO}
+
+
+def validar_consultas(consultas=_REGISTRO):
+    """
+    Comprueba el registro al arrancar: nombres únicos, parámetros usados
+    igual a los declarados y ninguna cláusula de escritura en lecturas.
+
+    Raises:
+        ValueError: Con todos los errores encontrados
+    """
+    errores = []
+    vistos = set()
+    for consulta in consultas:
+        if consulta.nombre in vistos:
+            errores.append(f'{consulta.nombre}: nombre duplicado')
+        vistos.add(consulta.nombre)
+
+        usados = set(_PARAMETRO.findall(consulta.texto))
+        if usados - consulta.parametros:
+            errores.append(f"{consulta.nombre}: parámetros no declarados {sorted(usados - consulta.parametros)}")
+        if consulta.parametros - usados:
+            errores.append(f"{consulta.nombre}: parámetros sin usar {sorted(consulta.parametros - usados)}")
+        if not consulta.escritura and _CLAUSULAS_ESCRITURA.search(consulta.texto):
+            errores.append(f'{consulta.nombre}: cláusula de escritura en una consulta de lectura')
+
+    if errores:
+        raise ValueError('Registro de consultas Cypher inválido: ' + '; '.join(errores))
+
+
+class FilasConsulta(list):
+    """Filas de una consulta; truncada indica que se cortaron en max_filas"""
+
+    truncada = False
+
+
+class MetricasConsultas:
+    """
+    Tiempos por consulta registrada desde el arranque del proceso.
+
+    cliente_ms es el tiempo total visto por la aplicación; servidor_ms el
+    que informa Neo4j (result_available_after + result_consumed_after).
+    La primera ejecución de cada consulta en un servidor incluye la
+    planificación: si las siguientes no bajan, el plan no se reutiliza.
+    textos_distintos cuenta los textos enviados con ese nombre: más de uno
+    (p. ej. en consultas construidas como consulta_conteos) son varias
+    entradas en la cache de planes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._consultas = {}
+
+    def registrar(self, nombre, duracion, servidor_ms=None, filas=0, error=False, truncada=False,
+                  texto=None):
+        with self._lock:
+            datos = self._consultas.setdefault(nombre, {
+                'ejecuciones': 0, 'errores': 0, 'truncadas': 0, 'filas': 0,
+                'cliente_total': 0.0, 'cliente_max': 0.0, 'primera_ms': None,
+                'servidor_total': 0.0, 'servidor_n': 0, 'textos': set(),
+            })
+            datos['ejecuciones'] += 1
+            if texto is not None:
+                datos['textos'].add(hash(texto))
+            datos['errores'] += 1 if error else 0
+            datos['truncadas'] += 1 if truncada else 0
+            datos['filas'] += filas
+            datos['cliente_total'] += duracion
+            datos['cliente_max'] = max(datos['cliente_max'], duracion)
+            if datos['primera_ms'] is None:
+                datos['primera_ms'] = round(duracion * 1000, 3)
+            if servidor_ms is not None:
+                datos['servidor_total'] += servidor_ms
+                datos['servidor_n'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                nombre: {
+                    'ejecuciones': d['ejecuciones'],
+                    'errores': d['errores'],
+                    'truncadas': d['truncadas'],
+                    'filas': d['filas'],
+                    'cliente_promedio_ms': round(d['cliente_total'] / d['ejecuciones'] * 1000, 3),
+                    'cliente_max_ms': round(d['cliente_max'] * 1000, 3),
+                    'primera_ejecucion_ms': d['primera_ms'],
+                    'servidor_promedio_ms': round(d['servidor_total'] / d['servidor_n'], 3)
+                    if d['servidor_n'] else None,
+                    'textos_distintos': len(d['textos']),
+                }
+                for nombre, d in sorted(self._consultas.items())
+            }
+
+
+metricas_consultas = MetricasConsultas()
+
+
+# Opciones de acceso del proceso (configurar_acceso, desde create_app)
+_opciones = {'database': None, 'timeout': None, 'max_filas': None}
+_gestor_bookmarks = {'gestor': None}
+_lock_gestor = threading.Lock()
+
+
+def _reiniciar_tras_fork():
+    global _lock_gestor
+    _lock_gestor = threading.Lock()
+    _gestor_bookmarks['gestor'] = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def configurar_acceso(database=None, timeout=None, max_filas=None):
+    """
+    Base de datos, timeout por defecto (s) y máximo de filas por defecto
+    de todas las consultas. Cada ConsultaCypher puede fijar los suyos.
+    """
+    _opciones.update(database=database, timeout=timeout, max_filas=max_filas)
+
+
+def gestor_bookmarks():
+    """
+    BookmarkManager compartido por las sesiones del proceso: una lectura
+    ve siempre las escrituras anteriores del mismo worker aunque vaya a
+    otra réplica del clúster.
+    """
+    if _gestor_bookmarks['gestor'] is None:
+        with _lock_gestor:
+            if _gestor_bookmarks['gestor'] is None:
+                _gestor_bookmarks['gestor'] = GraphDatabase.bookmark_manager()
+    return _gestor_bookmarks['gestor']
+
+
+def abrir_sesion(driver, escritura=False, bookmarks=None, fetch_size=1000):
+    """
+    Sesión con la base de datos configurada, modo de acceso (enruta a
+    lectores o al líder) y bookmarks del proceso más los recibidos.
+
+    Args:
+        bookmarks: Valores de bookmark de otro proceso (p. ej. de una
+                   cabecera X-Neo4j-Bookmarks) que la sesión debe esperar
+    """
+    return driver.session(
+        database=_opciones['database'],
+        default_access_mode=WRITE_ACCESS if escritura else READ_ACCESS,
+        bookmarks=Bookmarks.from_raw_values(bookmarks) if bookmarks else None,
+        bookmark_manager=gestor_bookmarks(),
+        fetch_size=fetch_size
+    )
+
+
+def _ejecutar_en_sesion(session, consulta, parametros):
+    """Una consulta registrada en una transacción gestionada de la sesión"""
+    if set(parametros) != consulta.parametros:
+        raise ValueError(f'{consulta.nombre}: se esperaban los parámetros {sorted(consulta.parametros)}')
+
+    max_filas = consulta.max_filas if consulta.max_filas is not None else _opciones['max_filas']
+
+    @unit_of_work(timeout=consulta.timeout or _opciones['timeout'],
+                  metadata={'consulta': consulta.nombre})
+    def transaccion(tx):
+        resultado = tx.run(consulta.texto, parametros)
+        filas = FilasConsulta()
+        for registro in resultado:
+            if max_filas and len(filas) >= max_filas:
+                filas.truncada = True
+                break
+            filas.append(registro.data())
+        return filas, resultado.consume()
+
+    inicio = time.perf_counter()
+    try:
+        ejecutar = session.execute_write if consulta.escritura else session.execute_read
+        filas, resumen = ejecutar(transaccion)
+    except Exception:
+        metricas_consultas.registrar(consulta.nombre, time.perf_counter() - inicio, error=True,
+                                     texto=consulta.texto)
+        raise
+
+    if filas.truncada:
+        logger.warning('Consulta %s truncada a %s filas', consulta.nombre, max_filas)
+
+    servidor_ms = None
+    if resumen.result_available_after is not None:
+        servidor_ms = resumen.result_available_after + (resumen.result_consumed_after or 0)
+    metricas_consultas.registrar(consulta.nombre, time.perf_counter() - inicio, servidor_ms,
+                                 len(filas), truncada=filas.truncada, texto=consulta.texto)
+    return filas
+
+
+def _consulta(nombre):
+    """Consulta registrada por nombre, o la propia ConsultaCypher si se pasa una"""
+    return CONSULTAS[nombre] if isinstance(nombre, str) else nombre
+
+
+def ejecutar_consulta(driver, nombre, parametros=None, bookmarks=None):
+    """
+    Ejecuta una consulta registrada (o una ConsultaCypher construida y
+    validada por quien llama) en una transacción gestionada
+    (execute_read / execute_write según la consulta) con su fetch_size,
+    timeout y máximo de filas.
+
+    Returns:
+        FilasConsulta: Registros como dict (como mucho max_filas; si se
+        cortaron, truncada es True)
+
+    Raises:
+        KeyError: Si la consulta no está registrada
+        ValueError: Si faltan o sobran parámetros
+    """
+    consulta = _consulta(nombre)
+    with abrir_sesion(driver, consulta.escritura, bookmarks, consulta.fetch_size) as session:
+        return _ejecutar_en_sesion(session, consulta, parametros or {})
+
+
+def ejecutar_consultas(driver, consultas, concurrente=False, bookmarks=None):
+    """
+    Varias consultas de lectura independientes.
+
+    En serie comparten una sola sesión (una conexión del pool); con
+    concurrente=True cada una va en su propia sesión en paralelo.
+
+    Args:
+        consultas: Lista de (nombre, parametros)
+
+    Returns:
+        list: FilasConsulta de cada consulta, en el mismo orden
+    """
+    registradas = [(_consulta(nombre), parametros or {}) for nombre, parametros in consultas]
+    if any(consulta.escritura for consulta, _ in registradas):
+        raise ValueError('ejecutar_consultas solo admite consultas de lectura')
+
+    if not concurrente or len(registradas) < 2:
+        fetch_size = max(consulta.fetch_size for consulta, _ in registradas)
+        with abrir_sesion(driver, False, bookmarks, fetch_size) as session:
+            return [_ejecutar_en_sesion(session, consulta, parametros)
+                    for consulta, parametros in registradas]
+
+    with ThreadPoolExecutor(max_workers=len(registradas)) as ejecutor:
+        futuros = [
+            ejecutor.submit(ejecutar_consulta, driver, consulta, parametros, bookmarks)
+            for consulta, parametros in registradas
+        ]
+        return [futuro.result() for futuro in futuros]
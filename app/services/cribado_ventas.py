@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from app.models.mysql_models import db, Producto, Lote
+from app.services.grafo_interacciones import CODIGO_SEVERIDAD, GrafoInteraccionesService
+
+logger = logging.getLogger(__name__)
+
+POLITICAS = ('abierta', 'cerrada')
+
+# lote_id -> medicamento_id del grafo (None si el producto no tiene) del
+# proceso actual. Se vacía entero cada CRIBADO_TTL_MAPEO segundos.
+_mapeo = {'lotes': {}, 'cargado_en': time.monotonic()}
+_lock_mapeo = threading.Lock()
+
+
+def interacciones_nuevas(instantanea, nuevos, otros):
+    """
+    Interacciones de la instantánea en las que participa algún medicamento
+    de `nuevos`, contra `otros` o entre ellos. Los pares entre `otros` ya se
+    cribaron al venderlos y no se repiten.
+
+    Cada par aparece una vez, con el medicamento nuevo como medicamento_a.
+
+    Returns:
+        list: Filas de InstantaneaInteracciones.verificar (grave primero)
+    """
+    nuevos = set(nuevos)
+    if not nuevos:
+        return []
+    filas = instantanea.verificar(list(nuevos) + [m for m in otros if m not in nuevos])
+    return [
+        f for f in filas
+        if f['medicamento_a_id'] in nuevos
+        and (f['medicamento_b_id'] not in nuevos or str(f['medicamento_a_id']) < str(f['medicamento_b_id']))
+    ]
+
+
+class CribadoVentasService:
+    """
+    Cribado de interacciones en el camino de la venta: el medicamento del
+    lote que se vende contra los ya dispensados en la sesión, los del
+    carrito y la medicación del paciente.
+
+    Solo usa memoria del worker (mapeo lote -> medicamento e instantánea de
+    interacciones) más un SMEMBERS en Redis; nunca consulta Neo4j. Si la
+    instantánea no está vigente, MySQL o Redis fallan o se agota el
+    presupuesto, el resultado es 'no_disponible' y decide la política
+    (CRIBADO_POLITICA). El presupuesto se comprueba antes de cada paso y
+    la sesión se lee con un cliente cuyo timeout es el propio presupuesto.
+    """
+
+    PREFIJO_SESION = 'dispensacion:'
+
+    @staticmethod
+    def medicamentos_de_lotes(lote_ids, ttl=300):
+        """
+        Medicamento del grafo de cada lote, con cache por proceso.
+
+        Los lotes que faltan se leen en una sola consulta (Lote -> Producto).
+
+        Returns:
+            dict: lote_id -> medicamento_id (None si el producto no tiene)
+        """
+        ahora = time.monotonic()
+        if ahora - _mapeo['cargado_en'] >= ttl:
+            with _lock_mapeo:
+                if ahora - _mapeo['cargado_en'] >= ttl:
+                    _mapeo['lotes'] = {}
+                    _mapeo['cargado_en'] = ahora
+
+        lotes = _mapeo['lotes']
+        faltan = [l for l in dict.fromkeys(lote_ids) if l not in lotes]
+        if faltan:
+            encontrados = dict(db.session.execute(
+                select(Lote.id, Producto.medicamento_id)
+                .join(Producto, Producto.id == Lote.producto_id)
+                .where(Lote.id.in_(faltan))
+            ).all())
+            for lote_id in faltan:
+                if lote_id not in encontrados:
+                    raise ValueError(f'Lote {lote_id} no encontrado')
+                lotes[lote_id] = encontrados[lote_id]
+        return {l: lotes[l] for l in lote_ids}
+
+    @staticmethod
+    def cribar(lote_ids, redis_client, driver, otros_lotes=(), medicamentos_paciente=(), sesion=None,
+               presupuesto_ms=5.0, severidad_bloqueo='grave', intervalo=2.0, ttl_mapeo=300,
+               redis_sesion=None):
+        """
+        Criba los lotes que se van a vender.
+
+        Args:
+            lote_ids: Lotes nuevos (uno en una venta, todos al cribar un carrito)
+            otros_lotes: Resto del carrito, aún sin vender
+            medicamentos_paciente: Ids del grafo de la medicación actual
+            sesion: Sesión de dispensación (medicamentos ya vendidos en Redis)
+            presupuesto_ms: Tiempo máximo esperando mapeo, sesión e instantánea
+            severidad_bloqueo: Severidad desde la que se bloquea ('' = solo avisar)
+            redis_sesion: Cliente para leer la sesión, con timeout del orden
+                          del presupuesto (por defecto redis_client)
+
+        Returns:
+            dict: estado ('sin_interacciones', 'interacciones', 'sin_medicamento'
+                  o 'no_disponible'), bloquear, interacciones, medicamentos
+                  de los lotes nuevos, motivo y milisegundos
+        """
+        inicio = time.perf_counter()
+        limite = inicio + presupuesto_ms / 1000
+
+        def resultado(estado, interacciones=(), motivo=None):
+            umbral = CODIGO_SEVERIDAD.get(severidad_bloqueo)
+            return {
+                'estado': estado,
+                'bloquear': umbral is not None and any(
+                    CODIGO_SEVERIDAD.get(f['severidad'], umbral + 1) <= umbral for f in interacciones
+                ),
+                'interacciones': list(interacciones),
+                'medicamentos': nuevos,
+                'motivo': motivo,
+                'milisegundos': round((time.perf_counter() - inicio) * 1000, 3)
+            }
+
+        def agotado():
+            return time.perf_counter() > limite
+
+        nuevos = []
+        try:
+            mapeo = CribadoVentasService.medicamentos_de_lotes(list(lote_ids) + list(otros_lotes), ttl_mapeo)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.warning('Cribado sin mapeo de lotes: %s', e)
+            return resultado('no_disponible', motivo='mysql')
+        nuevos = list(dict.fromkeys(mapeo[l] for l in lote_ids if mapeo[l]))
+        if not nuevos:
+            return resultado('sin_medicamento')
+
+        otros = [mapeo[l] for l in otros_lotes if mapeo[l]] + list(medicamentos_paciente)
+        try:
+            if sesion:
+                if agotado():
+                    return resultado('no_disponible', motivo='presupuesto')
+                clave = CribadoVentasService.PREFIJO_SESION + sesion
+                otros += sorted((redis_sesion or redis_client).smembers(clave))
+            if agotado():
+                return resultado('no_disponible', motivo='presupuesto')
+            instantanea = GrafoInteraccionesService.instantanea(redis_client, driver, intervalo)
+        except RedisError as e:
+            logger.warning('Cribado sin Redis: %s', e)
+            return resultado('no_disponible', motivo='redis')
+        if instantanea is None:
+            return resultado('no_disponible', motivo='instantanea')
+        if agotado():
+            return resultado('no_disponible', motivo='presupuesto')
+
+        interacciones = interacciones_nuevas(instantanea, nuevos, otros)
+        return resultado('interacciones' if interacciones else 'sin_interacciones', interacciones)
+
+    @staticmethod
+    def registrar_en_sesion(sesion, medicamentos, redis_client, ttl=14400):
+        """Añade los medicamentos vendidos a la sesión de dispensación (tras la venta)"""
+        if not sesion or not medicamentos:
+            return
+        clave = CribadoVentasService.PREFIJO_SESION + sesion
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.sadd(clave, *medicamentos)
+            pipe.expire(clave, ttl)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning('No se pudo registrar la venta en la sesión %s: %s', sesion, e)
@@ -0,0 +1,236 @@
+import re
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+
+# Eventos por bucket: un ensayo activo abre buckets nuevos dentro del mismo
+# mes en lugar de crecer sin límite (y cada bucket queda muy por debajo de 16 MB)
+EVENTOS_POR_BUCKET = 200
+
+SEVERIDADES = {'leve': 1, 'moderada': 2, 'grave': 3}
+NOMBRES_SEVERIDAD = {v: k for k, v in SEVERIDADES.items()}
+
+ORDENES_RANKING = {
+    'eventos': 'eventos',
+    'frecuencia': 'frecuencia_media',
+    'severidad': 'severidad_media',
+    'graves': 'graves',
+}
+
+
+def _numero(valor, campo):
+    """Valor numérico de 15, "15%", "3 días" o un rango como "2-3 días" (media)"""
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return float(valor)
+    numeros = re.findall(r'\d+(?:[.,]\d+)?', str(valor or ''))
+    if not numeros:
+        raise ValueError(f'{campo} debe ser numérico')
+    return sum(float(n.replace(',', '.')) for n in numeros) / len(numeros)
+
+
+def normalizar_evento(data, fecha=None, usuario=None):
+    """
+    Evento adverso con campos numéricos.
+
+    Acepta el formato anterior ("15%", "moderada", "3 días"):
+    frecuencia en porcentaje (0-100), severidad 1 (leve) a 3 (grave) y
+    duración en días.
+    """
+    if not data.get('tipo'):
+        raise ValueError('tipo es requerido')
+
+    frecuencia = _numero(data.get('frecuencia'), 'frecuencia')
+    if not 0 <= frecuencia <= 100:
+        raise ValueError('frecuencia debe estar entre 0 y 100')
+
+    severidad = data.get('severidad')
+    if isinstance(severidad, str):
+        severidad = SEVERIDADES.get(severidad.strip().lower())
+    if severidad not in NOMBRES_SEVERIDAD:
+        raise ValueError(f"severidad inválida. Debe ser: {', '.join(SEVERIDADES)} o 1-3")
+
+    evento = {
+        'tipo': data['tipo'].strip().lower(),
+        'frecuencia': frecuencia,
+        'severidad': severidad,
+        'duracion_dias': _numero(data['duracion_promedio'], 'duracion_promedio')
+        if data.get('duracion_promedio') is not None else None,
+        'fecha': fecha or datetime.utcnow(),
+    }
+    if usuario:
+        evento['registrado_por'] = usuario
+    return evento
+
+
+def inicio_de_mes(fecha):
+    return datetime(fecha.year, fecha.month, 1)
+
+
+class EfectosAdversosService:
+    """
+    Efectos adversos en la colección efectos_adversos, agrupados en
+    buckets de hasta EVENTOS_POR_BUCKET eventos por ensayo y mes.
+
+    Cada bucket lleva el fármaco y el principio activo del ensayo para
+    poder agregar por compuesto sin leer ensayos_clinicos.
+    """
+
+    @staticmethod
+    def _upsert_bucket(ensayo, evento):
+        """Filtro y cambio para añadir un evento al bucket abierto (upsert)"""
+        filtro = {
+            'ensayo_id': ensayo['_id'],
+            'mes': inicio_de_mes(evento['fecha']),
+            'n': {'$lt': EVENTOS_POR_BUCKET}
+        }
+        cambio = {
+            '$push': {'eventos': evento},
+            '$inc': {'n': 1},
+            '$setOnInsert': {
+                'farmaco': ensayo.get('farmaco'),
+                'principio_activo': ensayo.get('principio_activo')
+            }
+        }
+        return filtro, cambio
+
+    @staticmethod
+    def registrar(mongo_db, ensayo_id, data, usuario=None):
+        """
+        Registra un efecto adverso en el bucket abierto del ensayo y mes.
+
+        Returns:
+            dict: Evento guardado o None si el ensayo no existe
+        """
+        ensayo = mongo_db.ensayos_clinicos.find_one(
+            {'_id': ObjectId(ensayo_id)}, {'farmaco': 1, 'principio_activo': 1}
+        )
+        if ensayo is None:
+            return None
+
+        evento = normalizar_evento(data, usuario=usuario)
+        filtro, cambio = EfectosAdversosService._upsert_bucket(ensayo, evento)
+        mongo_db.efectos_adversos.update_one(filtro, cambio, upsert=True)
+        return evento
+
+    @staticmethod
+    def listar(mongo_db, ensayo_id, desde=None, hasta=None):
+        """Eventos de un ensayo, del más reciente al más antiguo"""
+        filtro = {'ensayo_id': ObjectId(ensayo_id)}
+        if desde or hasta:
+            filtro['mes'] = {}
+            if desde:
+                filtro['mes']['$gte'] = inicio_de_mes(desde)
+            if hasta:
+                filtro['mes']['$lte'] = inicio_de_mes(hasta)
+
+        pipeline = [
+            {'$match': filtro},
+            {'$unwind': '$eventos'},
+            {'$replaceRoot': {'newRoot': '$eventos'}},
+            {'$sort': {'fecha': -1}},
+        ]
+        return list(mongo_db.efectos_adversos.aggregate(pipeline))
+
+    @staticmethod
+    def ranking(mongo_db, principio_activo=None, desde=None, hasta=None,
+                orden='eventos', limite=20):
+        """
+        Ranking de efectos adversos por compuesto (principio activo) entre
+        todos los ensayos.
+
+        Returns:
+            list: Por compuesto, sus efectos ordenados según `orden`
+                  (eventos, frecuencia, severidad o graves)
+        """
+        if orden not in ORDENES_RANKING:
+            raise ValueError(f"orden inválido. Debe ser: {', '.join(ORDENES_RANKING)}")
+
+        filtro = {}
+        if principio_activo:
+            filtro['principio_activo'] = principio_activo
+        if desde or hasta:
+            filtro['mes'] = {}
+            if desde:
+                filtro['mes']['$gte'] = inicio_de_mes(desde)
+            if hasta:
+                filtro['mes']['$lte'] = inicio_de_mes(hasta)
+
+        campo_orden = ORDENES_RANKING[orden]
+        pipeline = [
+            {'$match': filtro},
+            {'$project': {'principio_activo': 1, 'ensayo_id': 1,
+                          'eventos.tipo': 1, 'eventos.frecuencia': 1, 'eventos.severidad': 1}},
+            {'$unwind': '$eventos'},
+            {'$group': {
+                '_id': {'compuesto': '$principio_activo', 'tipo': '$eventos.tipo'},
+                'eventos': {'$sum': 1},
+                'ensayos': {'$addToSet': '$ensayo_id'},
+                'frecuencia_media': {'$avg': '$eventos.frecuencia'},
+                'severidad_media': {'$avg': '$eventos.severidad'},
+                'graves': {'$sum': {'$cond': [{'$eq': ['$eventos.severidad', 3]}, 1, 0]}},
+            }},
+            {'$sort': {campo_orden: -1, 'eventos': -1}},
+            {'$group': {
+                '_id': '$_id.compuesto',
+                'total_eventos': {'$sum': '$eventos'},
+                'efectos': {'$push': {
+                    'tipo': '$_id.tipo',
+                    'eventos': '$eventos',
+                    'ensayos': {'$size': '$ensayos'},
+                    'frecuencia_media': {'$round': ['$frecuencia_media', 2]},
+                    'severidad_media': {'$round': ['$severidad_media', 2]},
+                    'graves': '$graves',
+                }},
+            }},
+            {'$project': {'_id': 0, 'principio_activo': '$_id', 'total_eventos': 1,
+                          'efectos': {'$slice': ['$efectos', limite]}}},
+            {'$sort': {'total_eventos': -1}},
+        ]
+        return list(mongo_db.efectos_adversos.aggregate(pipeline))
+
+    @staticmethod
+    def migrar_embebidos(mongo_db, lote=500):
+        """
+        Mueve resultados_intermedios.efectos_secundarios_frecuentes de los
+        ensayos a buckets y elimina el array embebido. Los ensayos con algún
+        evento no convertible se dejan como están para revisarlos a mano.
+
+        Returns:
+            tuple: (eventos migrados, ids de ensayos no migrados)
+        """
+        ensayos = mongo_db.ensayos_clinicos.find(
+            {'resultados_intermedios.efectos_secundarios_frecuentes.0': {'$exists': True}},
+            {'farmaco': 1, 'principio_activo': 1, 'fecha_inicio': 1,
+             'metadata.ultima_modificacion': 1,
+             'resultados_intermedios.efectos_secundarios_frecuentes': 1}
+        )
+
+        migrados = 0
+        pendientes = []
+        for ensayo in ensayos:
+            fecha = (ensayo.get('metadata') or {}).get('ultima_modificacion') \
+                or ensayo.get('fecha_inicio') or datetime.utcnow()
+            embebidos = ensayo['resultados_intermedios']['efectos_secundarios_frecuentes']
+
+            try:
+                operaciones = [
+                    UpdateOne(*EfectosAdversosService._upsert_bucket(
+                        ensayo, normalizar_evento(e, fecha=fecha)
+                    ), upsert=True)
+                    for e in embebidos
+                ]
+            except ValueError:
+                pendientes.append(ensayo['_id'])
+                continue
+
+            # Ordenado: cada upsert debe ver el contador n del anterior
+            for inicio in range(0, len(operaciones), lote):
+                mongo_db.efectos_adversos.bulk_write(operaciones[inicio:inicio + lote], ordered=True)
+
+            mongo_db.ensayos_clinicos.update_one(
+                {'_id': ensayo['_id']},
+                {'$unset': {'resultados_intermedios.efectos_secundarios_frecuentes': ''}}
+            )
+            migrados += len(operaciones)
+
+        return migrados, pendientes
@@ -0,0 +1,334 @@
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from redis.exceptions import WatchError
+
+# Cada ensayo aporta unos contadores al resumen (su "contribución"). Al
+# escribir un ensayo se resta la contribución anterior y se suma la nueva
+# en un único script Lua, así aplicar dos veces el mismo documento no
+# duplica nada y los hooks de escritura y el consumidor del change stream
+# pueden convivir.
+#
+# La contribución se guarda con la metadata.version_documento del ensayo
+# ({"version": n, "aporte": {...}}) y el script ignora las escrituras con
+# una versión menor: dos hooks concurrentes pueden llegar en cualquier
+# orden sin que el documento antiguo pise al nuevo. Un borrado deja una
+# lápida ({"borrado": true, "version": n}) que descarta las escrituras
+# atrasadas de ese ensayo. Los documentos sin versión se aplican siempre.
+#
+# Mientras hay una reconstrucción en curso (KEYS[3]) cada escritura anota
+# el id en KEYS[4] para que reconstruir vuelva a leer ese ensayo.
+_SCRIPT_APLICAR = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('RPUSH', KEYS[4], ARGV[1])
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local version = tonumber(ARGV[3])
+local anterior = redis.call('HGET', KEYS[2], ARGV[1])
+if anterior then
+    anterior = cjson.decode(anterior)
+    if version and anterior.version then
+        if version < anterior.version or (anterior.borrado and version <= anterior.version) then
+            return 2
+        end
+    end
+    local aporte = anterior.aporte
+    if aporte == nil and not anterior.borrado then
+        -- Formato anterior: solo el aporte
+        aporte = anterior
+    end
+    for campo, valor in pairs(aporte or {}) do
+        redis.call('HINCRBYFLOAT', KEYS[1], campo, -valor)
+    end
+end
+if ARGV[2] == '' then
+    if anterior and anterior.version then
+        redis.call('HSET', KEYS[2], ARGV[1], cjson.encode({borrado = true, version = anterior.version}))
+    else
+        redis.call('HDEL', KEYS[2], ARGV[1])
+    end
+else
+    local nuevo = cjson.decode(ARGV[2])
+    for campo, valor in pairs(nuevo.aporte) do
+        redis.call('HINCRBYFLOAT', KEYS[1], campo, valor)
+    end
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+return 1
+"""
+
+# Campos de un ensayo que intervienen en las estadísticas
+CAMPOS_ESTADISTICAS = {
+    'estado': 1,
+    'fase': 1,
+    'archivado': 1,
+    'centros_participantes.pacientes_reclutados': 1,
+    'centros_participantes.meta_pacientes': 1,
+    'resultados_intermedios.efectividad_global': 1,
+    'metadata.version_documento': 1,
+}
+
+
+def contribucion(ensayo):
+    """Contadores que un ensayo aporta al resumen"""
+    estado = ensayo.get('estado')
+    fase = ensayo.get('fase')
+    centros = ensayo.get('centros_participantes') or []
+    efectividad = (ensayo.get('resultados_intermedios') or {}).get('efectividad_global')
+
+    aporte = {
+        'total': 1,
+        f'estado:{estado}': 1,
+        f'fase:{fase}': 1,
+        'activos': 0 if ensayo.get('archivado') else 1,
+        'pacientes_reclutados': sum(c.get('pacientes_reclutados') or 0 for c in centros),
+        'meta_pacientes': sum(c.get('meta_pacientes') or 0 for c in centros),
+    }
+    # fase_promedio solo promedia fases numéricas (bool es int en Python)
+    if isinstance(fase, (int, float)) and not isinstance(fase, bool):
+        aporte[f'fase_suma:{estado}'] = fase
+        aporte[f'fase_n:{estado}'] = 1
+    if isinstance(efectividad, (int, float)):
+        aporte['efectividad_suma'] = efectividad
+        aporte['efectividad_n'] = 1
+
+    return aporte
+
+
+def _id_ensayo(valor):
+    """Los ids anotados son str(_id): ObjectId si lo parece"""
+    try:
+        return ObjectId(valor)
+    except (InvalidId, TypeError):
+        return valor
+
+
+def version_documento(ensayo):
+    """metadata.version_documento del ensayo o None si no tiene"""
+    version = (ensayo.get('metadata') or {}).get('version_documento')
+    return version if isinstance(version, int) else None
+
+
+def entrada_contribucion(ensayo):
+    """Valor guardado en el hash de contribuciones para un ensayo"""
+    entrada = {'aporte': contribucion(ensayo)}
+    version = version_documento(ensayo)
+    if version is not None:
+        entrada['version'] = version
+    return json.dumps(entrada)
+
+
+class EstadisticasEnsayosService:
+    """
+    Estadísticas de ensayos clínicos mantenidas de forma incremental en
+    un hash de Redis. Servir el endpoint es un único HGETALL.
+
+    El resumen se actualiza desde las rutas de escritura (registrar) o desde
+    el change stream (consumir_cambios) y se reconstruye por completo con
+    `flask reconstruir-estadisticas` (cron) o cuando falta la clave.
+    """
+
+    # v2: fase_n por estado. Un resumen anterior no existe con esta clave
+    # y se reconstruye al leerlo
+    CLAVE_RESUMEN = 'estadisticas:ensayos:v2'
+    CLAVE_CONTRIBUCIONES = 'estadisticas:ensayos:contribuciones'
+    CLAVE_RESUME_TOKEN = 'estadisticas:ensayos:resume_token'
+    CLAVE_RECONSTRUYENDO = 'estadisticas:ensayos:reconstruyendo'
+    CLAVE_CAMBIOS = 'estadisticas:ensayos:cambios_durante_reconstruccion'
+    # Una reconstrucción que muere deja de anotar cambios pasado este tiempo
+    TTL_RECONSTRUCCION = 3600
+
+    @staticmethod
+    def _claves():
+        return [EstadisticasEnsayosService.CLAVE_RESUMEN,
+                EstadisticasEnsayosService.CLAVE_CONTRIBUCIONES,
+                EstadisticasEnsayosService.CLAVE_RECONSTRUYENDO,
+                EstadisticasEnsayosService.CLAVE_CAMBIOS]
+
+    @staticmethod
+    def registrar(redis_client, ensayo_id, ensayo):
+        """
+        Aplica el estado actual de un ensayo al resumen.
+
+        Args:
+            redis_client: Cliente Redis
+            ensayo_id: _id del ensayo
+            ensayo: Documento actual (al menos CAMPOS_ESTADISTICAS) o None si ya no existe
+
+        Returns:
+            bool: False si el resumen aún no existe (se construirá al leerlo).
+                  Una versión atrasada se ignora y también devuelve True.
+        """
+        aplicar = redis_client.register_script(_SCRIPT_APLICAR)
+        nuevo = entrada_contribucion(ensayo) if ensayo is not None else ''
+        version = version_documento(ensayo) if ensayo is not None else None
+        return bool(aplicar(
+            keys=EstadisticasEnsayosService._claves(),
+            args=[str(ensayo_id), nuevo, '' if version is None else version]
+        ))
+
+    @staticmethod
+    def registrar_lote(redis_client, ensayos):
+        """registrar para muchos ensayos en un solo pipeline (importaciones)"""
+        aplicar = redis_client.register_script(_SCRIPT_APLICAR)
+        pipe = redis_client.pipeline(transaction=False)
+        for ensayo in ensayos:
+            version = version_documento(ensayo)
+            aplicar(
+                keys=EstadisticasEnsayosService._claves(),
+                args=[str(ensayo['_id']), entrada_contribucion(ensayo),
+                      '' if version is None else version],
+                client=pipe
+            )
+        pipe.execute()
+
+    @staticmethod
+    def reconstruir(redis_client, collection, lote=1000):
+        """
+        Recalcula el resumen recorriendo la colección y lo sustituye de
+        forma atómica (MULTI/EXEC) junto con las contribuciones.
+
+        Las escrituras que llegan durante el recorrido quedan anotadas por
+        el script (CLAVE_CAMBIOS); esos ensayos se vuelven a leer justo antes
+        de sustituir el resumen, con WATCH para repetir si llegan más.
+
+        Returns:
+            int: Ensayos procesados
+        """
+        claves = EstadisticasEnsayosService
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.set(claves.CLAVE_RECONSTRUYENDO, 1, ex=claves.TTL_RECONSTRUCCION)
+        pipe.delete(claves.CLAVE_CAMBIOS)
+        pipe.execute()
+
+        contribuciones = {
+            str(ensayo['_id']): entrada_contribucion(ensayo)
+            for ensayo in collection.find({}, CAMPOS_ESTADISTICAS).batch_size(lote)
+        }
+
+        with redis_client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(claves.CLAVE_CAMBIOS)
+                    cambiados = set(pipe.lrange(claves.CLAVE_CAMBIOS, 0, -1))
+                    if cambiados:
+                        for ensayo_id in cambiados:
+                            contribuciones.pop(ensayo_id, None)
+                        for ensayo in collection.find(
+                                {'_id': {'$in': [_id_ensayo(i) for i in cambiados]}}, CAMPOS_ESTADISTICAS):
+                            contribuciones[str(ensayo['_id'])] = entrada_contribucion(ensayo)
+
+                    resumen = {}
+                    for entrada in contribuciones.values():
+                        for campo, valor in json.loads(entrada)['aporte'].items():
+                            resumen[campo] = resumen.get(campo, 0) + valor
+                    resumen['reconstruido_en'] = datetime.utcnow().isoformat()
+
+                    pipe.multi()
+                    pipe.delete(claves.CLAVE_RESUMEN, claves.CLAVE_CONTRIBUCIONES,
+                                claves.CLAVE_RECONSTRUYENDO, claves.CLAVE_CAMBIOS)
+                    pipe.hset(claves.CLAVE_RESUMEN, mapping=resumen)
+                    ids = list(contribuciones)
+                    for inicio in range(0, len(ids), lote):
+                        pipe.hset(
+                            claves.CLAVE_CONTRIBUCIONES,
+                            mapping={i: contribuciones[i] for i in ids[inicio:inicio + lote]}
+                        )
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue
+
+        return len(contribuciones)
+
+    @staticmethod
+    def obtener(redis_client, collection):
+        """
+        Estadísticas actuales. Si el resumen no existe se reconstruye antes.
+
+        Returns:
+            dict: total_ensayos, por_estado, por_fase, reclutamiento y
+                  efectividad_promedio
+        """
+        resumen = redis_client.hgetall(EstadisticasEnsayosService.CLAVE_RESUMEN)
+        if not resumen:
+            EstadisticasEnsayosService.reconstruir(redis_client, collection)
+            resumen = redis_client.hgetall(EstadisticasEnsayosService.CLAVE_RESUMEN)
+
+        return EstadisticasEnsayosService._formatear(resumen)
+
+    @staticmethod
+    def _formatear(resumen):
+        valores = {k: float(v) for k, v in resumen.items() if k != 'reconstruido_en'}
+
+        por_estado = []
+        por_fase = {}
+        for campo, valor in valores.items():
+            total = int(round(valor))
+            if total <= 0:
+                continue
+            if campo.startswith('estado:'):
+                estado = campo.split(':', 1)[1]
+                fase_n = int(round(valores.get(f'fase_n:{estado}', 0)))
+                por_estado.append({
+                    '_id': estado,
+                    'total': total,
+                    'fase_promedio': round(valores[f'fase_suma:{estado}'] / fase_n, 2)
+                    if fase_n > 0 else None
+                })
+            elif campo.startswith('fase:'):
+                por_fase[campo.split(':', 1)[1]] = total
+
+        reclutados = int(round(valores.get('pacientes_reclutados', 0)))
+        meta = int(round(valores.get('meta_pacientes', 0)))
+        efectividad_n = int(round(valores.get('efectividad_n', 0)))
+
+        return {
+            'total_ensayos': int(round(valores.get('total', 0))),
+            'activos': int(round(valores.get('activos', 0))),
+            'por_estado': sorted(por_estado, key=lambda e: e['_id']),
+            'por_fase': dict(sorted(por_fase.items())),
+            'reclutamiento': {
+                'pacientes_reclutados': reclutados,
+                'meta_pacientes': meta,
+                'porcentaje': round(reclutados / meta * 100, 1) if meta else None
+            },
+            'efectividad_promedio': round(valores['efectividad_suma'] / efectividad_n, 1)
+            if efectividad_n else None,
+            'reconstruido_en': resumen.get('reconstruido_en')
+        }
+
+    @staticmethod
+    def consumir_cambios(redis_client, collection, al_aplicar=None):
+        """
+        Consume el change stream de la colección y aplica cada cambio al
+        resumen (requiere replica set). Guarda el resume token en Redis
+        para continuar donde se quedó tras un reinicio.
+
+        Cubre también las escrituras que no pasan por la API (scripts,
+        importaciones). Bloquea indefinidamente.
+        """
+        token = redis_client.get(EstadisticasEnsayosService.CLAVE_RESUME_TOKEN)
+        pipeline = [{'$match': {'operationType': {
+            '$in': ['insert', 'update', 'replace', 'delete']
+        }}}]
+
+        with collection.watch(
+            pipeline,
+            full_document='updateLookup',
+            resume_after=json.loads(token) if token else None
+        ) as stream:
+            for cambio in stream:
+                ensayo_id = cambio['documentKey']['_id']
+                EstadisticasEnsayosService.registrar(
+                    redis_client, ensayo_id, cambio.get('fullDocument')
+                )
+                redis_client.set(
+                    EstadisticasEnsayosService.CLAVE_RESUME_TOKEN,
+                    json.dumps(stream.resume_token)
+                )
+                if al_aplicar is not None:
+                    al_aplicar(cambio)
@@ -0,0 +1,120 @@
+import json
+import logging
+from redis.exceptions import RedisError
+from app.services.consultas_grafo import ConsultaCypher, ejecutar_consulta, ejecutar_consultas, validar_consultas
+from app.services.grafo_interacciones import GrafoInteraccionesService
+
+logger = logging.getLogger(__name__)
+
+
+def _identificador(nombre):
+    """Etiqueta o tipo como identificador Cypher (las comillas invertidas se duplican)"""
+    return '`' + nombre.replace('`', '``') + '`'
+
+
+def consulta_conteos(etiquetas, tipos):
+    """
+    Una sola consulta con un conteo por etiqueta y por tipo de relación.
+
+    Cada CALL es un MATCH de una etiqueta o tipo literal con count(*), que
+    Neo4j resuelve con NodeCountFromCountStore / RelationshipCountFromCountStore
+    (O(1), sin recorrer nodos ni relaciones). Las etiquetas y tipos no pueden
+    ser parámetros: el texto solo cambia cuando cambia el esquema.
+    """
+    subconsultas = [
+        'CALL { MATCH (n) RETURN count(n) AS total_nodos }',
+        'CALL { MATCH ()-[r]->() RETURN count(r) AS total_relaciones }',
+    ]
+    nodos = []
+    for i, etiqueta in enumerate(etiquetas):
+        subconsultas.append(f'CALL {{ MATCH (n:{_identificador(etiqueta)}) RETURN count(n) AS n{i} }}')
+        nodos.append(f'{{tipo_nodo: $etiquetas[{i}], cantidad: n{i}}}')
+    relaciones = []
+    for i, tipo in enumerate(tipos):
+        subconsultas.append(f'CALL {{ MATCH ()-[r:{_identificador(tipo)}]->() RETURN count(r) AS r{i} }}')
+        relaciones.append(f'{{tipo_relacion: $tipos[{i}], cantidad: r{i}}}')
+
+    texto = '\n'.join(subconsultas) + (
+        f"\nRETURN total_nodos, total_relaciones, [{', '.join(nodos)}] AS nodos, "
+        f"[{', '.join(relaciones)}] AS relaciones"
+    )
+    parametros = [p for p, valores in (('etiquetas', etiquetas), ('tipos', tipos)) if valores]
+    consulta = ConsultaCypher('conteos_grafo', texto, parametros=parametros, fetch_size=10)
+    validar_consultas([consulta])
+    return consulta
+
+
+class EstadisticasGrafoService:
+    """
+    Estadísticas del grafo (nodos por etiqueta, relaciones por tipo) desde
+    el count store de Neo4j, cacheadas en Redis.
+
+    La clave de cache incluye el contador de escrituras del grafo
+    (GrafoInteraccionesService.incrementar_version); el TTL acota lo
+    desfasado de las escrituras que no pasan por la aplicación.
+    """
+
+    CACHE_PREFIX = 'grafo:estadisticas'
+    CACHE_TTL = 300
+
+    @staticmethod
+    def calcular(driver, bookmarks=None):
+        """
+        Conteos actuales: una consulta para etiquetas y tipos (en la misma
+        sesión) y otra con todos los conteos del count store.
+        """
+        (fila_etiquetas,), (fila_tipos,) = ejecutar_consultas(
+            driver, [('etiquetas_grafo', None), ('tipos_relacion_grafo', None)], bookmarks=bookmarks
+        )
+        etiquetas = sorted(fila_etiquetas['etiquetas'])
+        tipos = sorted(fila_tipos['tipos'])
+
+        parametros = {}
+        if etiquetas:
+            parametros['etiquetas'] = etiquetas
+        if tipos:
+            parametros['tipos'] = tipos
+        fila, = ejecutar_consulta(driver, consulta_conteos(etiquetas, tipos), parametros, bookmarks)
+
+        return {
+            'total_nodos': fila['total_nodos'],
+            'total_relaciones': fila['total_relaciones'],
+            'nodos': sorted(fila['nodos'], key=lambda n: -n['cantidad']),
+            'relaciones': sorted(fila['relaciones'], key=lambda r: -r['cantidad'])
+        }
+
+    @staticmethod
+    def obtener(driver, redis_client=None, bookmarks=None):
+        """
+        Estadísticas del grafo, desde Redis si están cacheadas para la
+        versión actual del grafo. Sin Redis se calculan sin cache.
+
+        Returns:
+            dict: total_nodos, total_relaciones, nodos, relaciones, version y cache
+        """
+        clave = None
+        version = None
+        if redis_client is not None:
+            try:
+                version = GrafoInteraccionesService.version_actual(redis_client)
+                clave = f"{EstadisticasGrafoService.CACHE_PREFIX}:{version}"
+                en_cache = redis_client.get(clave)
+            except RedisError as e:
+                logger.warning('Estadísticas del grafo sin cache: %s', e)
+                clave = en_cache = None
+            if en_cache:
+                resultado = json.loads(en_cache)
+                resultado['cache'] = True
+                return resultado
+
+        resultado = EstadisticasGrafoService.calcular(driver, bookmarks)
+        resultado['version'] = version
+        resultado['cache'] = False
+
+        if clave is not None:
+            try:
+                redis_client.setex(clave, EstadisticasGrafoService.CACHE_TTL, json.dumps(resultado))
+            except RedisError as e:
+                logger.warning('No se pudieron cachear las estadísticas del grafo: %s', e)
+
+        return resultado
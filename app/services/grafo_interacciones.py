@@ -0,0 +1,472 @@
+import logging
+import os
+import threading
+import time
+import numpy as np
+from redis.exceptions import RedisError
+from app.services.consultas_grafo import ejecutar_consultas
+
+logger = logging.getLogger(__name__)
+
+SEVERIDADES = ('grave', 'moderada', 'leve')
+# Orden del ORDER BY de las consultas Cypher; cualquier otro valor va al final
+CODIGO_SEVERIDAD = {s: i for i, s in enumerate(SEVERIDADES, start=1)}
+CODIGO_OTRA_SEVERIDAD = len(SEVERIDADES) + 1
+
+# Clases por las que se infieren interacciones, de la más a la menos
+# específica: un acierto por principio activo descarta el de categoría
+VIAS_INFERENCIA = ('principio_activo', 'categoria')
+
+
+def _clave(valor):
+    return tuple(valor) if isinstance(valor, list) else valor
+
+
+def ordenar_por_severidad(interacciones):
+    """Mismo orden que el ORDER BY de la consulta verificar_interacciones"""
+    return sorted(interacciones,
+                  key=lambda i: CODIGO_SEVERIDAD.get(i['severidad'], CODIGO_OTRA_SEVERIDAD))
+
+
+def filas_inferidas(directas, candidatas):
+    """
+    Filas de interacciones inferidas por clase para los pares de
+    medicamentos sin interacción directa.
+
+    De cada par se queda una candidata: la de la vía más específica y,
+    dentro de ella, la más grave. Se devuelve en los dos sentidos, como
+    las directas, con la procedencia (clases y par de medicamentos de la
+    interacción de origen).
+
+    Args:
+        directas: Filas de verificar_interacciones
+        candidatas: Dicts de verificar_interacciones_inferidas_lote
+
+    Returns:
+        list: Directas más inferidas, ordenadas por severidad
+    """
+    pares_directos = {frozenset((d['medicamento_a_id'], d['medicamento_b_id'])) for d in directas}
+    elegidas = {}
+    for c in candidatas:
+        par = frozenset((c['medicamento_a_id'], c['medicamento_b_id']))
+        if par in pares_directos or c['via'] not in VIAS_INFERENCIA:
+            continue
+        orden = (VIAS_INFERENCIA.index(c['via']),
+                 CODIGO_SEVERIDAD.get(c['severidad'], CODIGO_OTRA_SEVERIDAD),
+                 str(c['clase_a']), str(c['clase_b']))
+        if par not in elegidas or orden < elegidas[par][0]:
+            elegidas[par] = (orden, c)
+
+    inferidas = []
+    for _, c in sorted(elegidas.values(), key=lambda e: e[0]):
+        for a, b in (('a', 'b'), ('b', 'a')):
+            inferidas.append({
+                'medicamento_a_id': c[f'medicamento_{a}_id'],
+                'medicamento_a': c[f'medicamento_{a}'],
+                'medicamento_b_id': c[f'medicamento_{b}_id'],
+                'medicamento_b': c[f'medicamento_{b}'],
+                'severidad': c['severidad'],
+                'descripcion': c['descripcion'],
+                'recomendaciones': c['recomendaciones'],
+                'inferida': True,
+                'procedencia': {
+                    'via': c['via'],
+                    'clase_a': c[f'clase_{a}'],
+                    'clase_b': c[f'clase_{b}'],
+                    'fuente_a_id': c[f'fuente_{a}'],
+                    'fuente_b_id': c[f'fuente_{b}'],
+                    'fuentes': c.get('fuentes')
+                }
+            })
+
+    # sorted es estable: dentro de cada severidad, las directas primero
+    return ordenar_por_severidad(list(directas) + inferidas)
+
+
+def resumir_interacciones(interacciones):
+    """Respuesta de verificar-interacciones: clasificación por severidad y resumen"""
+    graves = [i for i in interacciones if i['severidad'] == 'grave']
+    moderadas = [i for i in interacciones if i['severidad'] == 'moderada']
+    leves = [i for i in interacciones if i['severidad'] == 'leve']
+
+    return {
+        'total_interacciones': len(interacciones),
+        'tiene_interacciones_graves': len(graves) > 0,
+        'resumen': {
+            'graves': len(graves),
+            'moderadas': len(moderadas),
+            'leves': len(leves)
+        },
+        'interacciones_graves': graves,
+        'interacciones_moderadas': moderadas,
+        'interacciones_leves': leves
+    }
+
+
+class InstantaneaInteracciones:
+    """
+    Copia inmutable de las aristas INTERACCIONA_CON en formato CSR.
+
+    Los ids de medicamento se internan como enteros 0..n-1. Los vecinos del
+    medicamento i son vecinos[inicio[i]:inicio[i + 1]] (ordenados) y
+    aristas[...] apunta a la severidad y los textos de cada interacción.
+    Cada interacción aparece en los dos sentidos, igual que en el patrón no
+    dirigido de la consulta Cypher.
+
+    Las interacciones inferidas por clase se resuelven con diccionarios:
+    clases de cada medicamento y tabla materializada (via, clase_a,
+    clase_b), sin recorrer el grafo.
+    """
+
+    __slots__ = ('version', 'cargada_en', 'ids', 'nombres', 'indice',
+                 'inicio', 'vecinos', 'aristas', 'severidad', 'detalles',
+                 'clases', 'inferidas')
+
+    def __init__(self, version, medicamentos, interacciones, clases=(), inferidas=()):
+        """
+        Args:
+            version: Versión del grafo con la que se leyeron los datos
+            medicamentos: Iterable de (id, nombre)
+            interacciones: Iterable de (id_a, id_b, severidad, descripcion, recomendaciones)
+            clases: Iterable de (id, principios activos, categorías)
+            inferidas: Iterable de (via, clase_a, clase_b, severidad, descripcion,
+                       recomendaciones, fuente_a, fuente_b, fuentes)
+        """
+        self.version = version
+        self.cargada_en = time.time()
+        self.ids = []
+        self.nombres = []
+        self.indice = {}
+        for medicamento_id, nombre in medicamentos:
+            if medicamento_id not in self.indice:
+                self.indice[medicamento_id] = len(self.ids)
+                self.ids.append(medicamento_id)
+                self.nombres.append(nombre)
+
+        # Una A->B y una B->A con los mismos datos dan las mismas filas
+        # (DISTINCT en Cypher): se guardan una sola vez
+        vistas = set()
+        origen, destino, detalles = [], [], []
+        for a, b, severidad, descripcion, recomendaciones in interacciones:
+            i, j = self.indice.get(a), self.indice.get(b)
+            if i is None or j is None or i == j:
+                continue
+            clave = (min(i, j), max(i, j), _clave(severidad), _clave(descripcion), _clave(recomendaciones))
+            if clave in vistas:
+                continue
+            vistas.add(clave)
+            origen.append(i)
+            destino.append(j)
+            detalles.append((severidad, descripcion, recomendaciones))
+
+        self.detalles = detalles
+        self.severidad = np.fromiter(
+            (CODIGO_SEVERIDAD.get(d[0], CODIGO_OTRA_SEVERIDAD) for d in detalles),
+            dtype=np.int8, count=len(detalles)
+        )
+
+        numero_aristas = np.arange(len(detalles), dtype=np.int32)
+        fuente = np.concatenate([np.array(origen, dtype=np.int32), np.array(destino, dtype=np.int32)])
+        vecino = np.concatenate([np.array(destino, dtype=np.int32), np.array(origen, dtype=np.int32)])
+        orden = np.lexsort((vecino, fuente))
+
+        self.vecinos = vecino[orden]
+        self.aristas = np.concatenate([numero_aristas, numero_aristas])[orden]
+        self.inicio = np.zeros(len(self.ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(fuente, minlength=len(self.ids)), out=self.inicio[1:])
+
+        self.clases = {}
+        for medicamento_id, principios, categorias in clases:
+            i = self.indice.get(medicamento_id)
+            if i is not None:
+                self.clases[i] = (tuple(principios or ()), tuple(categorias or ()))
+
+        # Cada arista materializada se guarda en los dos sentidos
+        self.inferidas = {}
+        for via, a, b, severidad, descripcion, recomendaciones, fuente_a, fuente_b, fuentes in inferidas:
+            self.inferidas[(via, a, b)] = (severidad, descripcion, recomendaciones, fuente_a, fuente_b, fuentes)
+            self.inferidas[(via, b, a)] = (severidad, descripcion, recomendaciones, fuente_b, fuente_a, fuentes)
+
+    @property
+    def total_interacciones(self):
+        return len(self.detalles)
+
+    @property
+    def total_inferidas(self):
+        return len(self.inferidas) // 2
+
+    def candidatas_inferidas(self, presentes):
+        """Candidatas de filas_inferidas para los pares de índices presentes"""
+        candidatas = []
+        for posicion, i in enumerate(presentes):
+            clases_i = self.clases.get(i)
+            if clases_i is None:
+                continue
+            for j in presentes[posicion + 1:]:
+                clases_j = self.clases.get(j)
+                if clases_j is None:
+                    continue
+                for via, de_i, de_j in zip(VIAS_INFERENCIA, clases_i, clases_j):
+                    for a in de_i:
+                        for b in de_j:
+                            tabla = self.inferidas.get((via, a, b))
+                            if tabla is None:
+                                continue
+                            severidad, descripcion, recomendaciones, fuente_a, fuente_b, fuentes = tabla
+                            candidatas.append({
+                                'medicamento_a_id': self.ids[i], 'medicamento_a': self.nombres[i],
+                                'medicamento_b_id': self.ids[j], 'medicamento_b': self.nombres[j],
+                                'via': via, 'clase_a': a, 'clase_b': b,
+                                'severidad': severidad, 'descripcion': descripcion,
+                                'recomendaciones': recomendaciones,
+                                'fuente_a': fuente_a, 'fuente_b': fuente_b, 'fuentes': fuentes
+                            })
+        return candidatas
+
+    def verificar(self, medicamentos):
+        """
+        Interacciones entre todos los pares de la lista, con las mismas
+        filas y orden por severidad que la consulta verificar_interacciones,
+        más las inferidas por clase (filas_inferidas). Los ids que no están
+        en el grafo se ignoran.
+        """
+        presentes = sorted({self.indice[m] for m in medicamentos if m in self.indice})
+        if len(presentes) < 2:
+            return []
+
+        directas = self._directas(presentes)
+        if not self.inferidas:
+            return directas
+        candidatas = self.candidatas_inferidas(presentes)
+        return filas_inferidas(directas, candidatas) if candidatas else directas
+
+    def _directas(self, presentes):
+        # Todas las posiciones de los tramos de vecinos de la lista, sin bucle
+        # por medicamento: concatenación de los rangos inicio[i]..inicio[i+1]
+        objetivo = np.array(presentes, dtype=np.int32)
+        inicios = self.inicio[objetivo]
+        longitudes = self.inicio[objetivo + 1] - inicios
+        total = int(longitudes.sum())
+        if total == 0:
+            return []
+        desplazamiento = np.repeat(inicios - (np.cumsum(longitudes) - longitudes), longitudes)
+        posiciones = desplazamiento + np.arange(total, dtype=np.int32)
+
+        vecinos = self.vecinos[posiciones]
+        encaje = np.minimum(np.searchsorted(objetivo, vecinos), len(objetivo) - 1)
+        dentro = objetivo[encaje] == vecinos
+        if not dentro.any():
+            return []
+
+        origenes = np.repeat(objetivo, longitudes)[dentro]
+        destinos = vecinos[dentro]
+        aristas = self.aristas[posiciones[dentro]]
+        orden = np.argsort(self.severidad[aristas], kind='stable')
+
+        filas = []
+        for i, j, arista in zip(origenes[orden].tolist(), destinos[orden].tolist(),
+                                aristas[orden].tolist()):
+            severidad, descripcion, recomendaciones = self.detalles[arista]
+            filas.append({
+                'medicamento_a_id': self.ids[i],
+                'medicamento_a': self.nombres[i],
+                'medicamento_b_id': self.ids[j],
+                'medicamento_b': self.nombres[j],
+                'severidad': severidad,
+                'descripcion': descripcion,
+                'recomendaciones': recomendaciones
+            })
+        return filas
+
+
+# Instantánea del proceso actual. Se sustituye entera (una asignación), así
+# las peticiones en curso siguen usando la anterior hasta terminar.
+_estado = {'instantanea': None, 'vigente': False, 'comprobado_en': 0.0}
+_lock_recarga = threading.Lock()
+
+
+def _reiniciar_tras_fork():
+    """El worker no hereda una recarga en curso del padre"""
+    global _lock_recarga
+    _lock_recarga = threading.Lock()
+    _estado['comprobado_en'] = 0.0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+class GrafoInteraccionesService:
+    """
+    Verificación de interacciones contra una instantánea en memoria del
+    grafo (por worker), con Neo4j como fuente de verdad.
+
+    Quien escriba en Neo4j debe llamar a incrementar_version: es el
+    contador de escrituras del grafo (también invalida
+    estadisticas_grafo). Cada worker compara su versión con la de Redis
+    como mucho cada `intervalo` segundos; si está desfasada recarga en
+    segundo plano y mientras tanto responde con Cypher.
+    """
+
+    CLAVE_VERSION = 'grafo:version'
+
+    @staticmethod
+    def incrementar_version(redis_client):
+        """Marca como desfasadas las instantáneas y estadísticas del grafo de todos los workers"""
+        return redis_client.incr(GrafoInteraccionesService.CLAVE_VERSION)
+
+    @staticmethod
+    def version_actual(redis_client):
+        return int(redis_client.get(GrafoInteraccionesService.CLAVE_VERSION) or 0)
+
+    @staticmethod
+    def cargar(driver, version):
+        """Lee medicamentos e interacciones de Neo4j y construye la instantánea"""
+        filas_medicamentos, filas_interacciones, filas_clases, filas_inferidas = ejecutar_consultas(driver, [
+            ('instantanea_medicamentos', None),
+            ('instantanea_interacciones', None),
+            ('instantanea_clases', None),
+            ('instantanea_inferidas', None),
+        ])
+        medicamentos = [(r['id'], r['nombre']) for r in filas_medicamentos]
+        interacciones = [
+            (r['a'], r['b'], r['severidad'], r['descripcion'], r['recomendaciones'])
+            for r in filas_interacciones
+        ]
+        clases = [(r['id'], r['principios'], r['categorias']) for r in filas_clases]
+        inferidas = [
+            (r['via'], r['clase_a'], r['clase_b'], r['severidad'], r['descripcion'],
+             r['recomendaciones'], r['fuente_a'], r['fuente_b'], r['fuentes'])
+            for r in filas_inferidas
+        ]
+        return InstantaneaInteracciones(version, medicamentos, interacciones, clases, inferidas)
+
+    @staticmethod
+    def recargar(redis_client, driver):
+        """
+        Construye una instantánea nueva y la publica. La versión se lee antes
+        que el grafo: una escritura durante la carga provoca otra recarga.
+
+        Returns:
+            InstantaneaInteracciones o None si ya había una recarga en curso
+        """
+        if not _lock_recarga.acquire(blocking=False):
+            return None
+        try:
+            version = GrafoInteraccionesService.version_actual(redis_client)
+            instantanea = GrafoInteraccionesService.cargar(driver, version)
+            _estado['instantanea'] = instantanea
+            _estado['vigente'] = True
+            logger.info('Instantánea de interacciones v%s: %s medicamentos, %s interacciones, %s inferidas',
+                        version, len(instantanea.ids), instantanea.total_interacciones,
+                        instantanea.total_inferidas)
+            return instantanea
+        finally:
+            _lock_recarga.release()
+
+    @staticmethod
+    def _recargar_en_segundo_plano(redis_client, driver):
+        def recargar():
+            try:
+                GrafoInteraccionesService.recargar(redis_client, driver)
+            except Exception:
+                logger.exception('No se pudo recargar la instantánea de interacciones')
+
+        if not _lock_recarga.locked():
+            threading.Thread(target=recargar, name='recarga-interacciones', daemon=True).start()
+
+    @staticmethod
+    def instantanea(redis_client, driver, intervalo=2.0):
+        """
+        Instantánea vigente o None si falta, está desfasada o no se puede
+        comprobar la versión (Redis caído). En los dos primeros casos lanza
+        la recarga en segundo plano.
+        """
+        ahora = time.monotonic()
+        actual = _estado['instantanea']
+
+        if ahora - _estado['comprobado_en'] >= intervalo:
+            _estado['comprobado_en'] = ahora
+            try:
+                version = GrafoInteraccionesService.version_actual(redis_client)
+            except RedisError as e:
+                logger.warning('No se pudo leer la versión del grafo de interacciones: %s', e)
+                _estado['vigente'] = False
+                return None
+            _estado['vigente'] = actual is not None and actual.version >= version
+            if not _estado['vigente']:
+                GrafoInteraccionesService._recargar_en_segundo_plano(redis_client, driver)
+
+        return actual if _estado['vigente'] else None
+
+    @staticmethod
+    def verificar_cypher(driver, medicamentos):
+        directas, inferidas = ejecutar_consultas(driver, [
+            ('verificar_interacciones', {'medicamentos': medicamentos}),
+            ('verificar_interacciones_inferidas_lote',
+             {'listas': [{'indice': 0, 'medicamentos': medicamentos}]}),
+        ])
+        candidatas = inferidas[0]['candidatas'] if inferidas else []
+        return filas_inferidas(directas, candidatas) if candidatas else directas
+
+    @staticmethod
+    def verificar(medicamentos, redis_client, driver, intervalo=2.0, en_memoria=True):
+        """
+        Interacciones entre los medicamentos de una prescripción.
+
+        Returns:
+            tuple: (filas de verificar_interacciones, origen 'memoria' o 'neo4j')
+        """
+        if en_memoria:
+            instantanea = GrafoInteraccionesService.instantanea(redis_client, driver, intervalo)
+            if instantanea is not None:
+                return instantanea.verificar(medicamentos), 'memoria'
+
+        return GrafoInteraccionesService.verificar_cypher(driver, medicamentos), 'neo4j'
+
+    @staticmethod
+    def verificar_cypher_lote(driver, listas):
+        """
+        Varias prescripciones en una sola consulta UNWIND.
+
+        Args:
+            listas: Listas de ids de medicamentos
+
+        Returns:
+            list: Filas de cada lista, en el mismo orden que `listas`
+        """
+        resultados = [[] for _ in listas]
+        parametros = [{'indice': i, 'medicamentos': m} for i, m in enumerate(listas)]
+        directas, inferidas = ejecutar_consultas(driver, [
+            ('verificar_interacciones_lote', {'listas': parametros}),
+            ('verificar_interacciones_inferidas_lote', {'listas': parametros}),
+        ])
+        for fila in directas:
+            resultados[fila['indice']] = ordenar_por_severidad(fila['interacciones'])
+        for fila in inferidas:
+            resultados[fila['indice']] = filas_inferidas(resultados[fila['indice']], fila['candidatas'])
+        return resultados
+
+    @staticmethod
+    def verificar_lote(listas, redis_client, driver, intervalo=2.0, en_memoria=True, tamano_lote=500):
+        """
+        Verifica muchas prescripciones. Se decide entre la instantánea y
+        Cypher una vez por tramo de `tamano_lote` listas; con Cypher cada
+        tramo es una única consulta UNWIND.
+
+        Yields:
+            tuple: (posición en `listas`, filas, origen 'memoria' o 'neo4j')
+        """
+        for inicio in range(0, len(listas), tamano_lote):
+            tramo = listas[inicio:inicio + tamano_lote]
+
+            instantanea = GrafoInteraccionesService.instantanea(redis_client, driver, intervalo) \
+                if en_memoria else None
+            if instantanea is not None:
+                for desplazamiento, medicamentos in enumerate(tramo):
+                    yield inicio + desplazamiento, instantanea.verificar(medicamentos), 'memoria'
+                continue
+
+            filas = GrafoInteraccionesService.verificar_cypher_lote(driver, tramo)
+            for desplazamiento, interacciones in enumerate(filas):
+                yield inicio + desplazamiento, interacciones, 'neo4j'
@@ -0,0 +1,172 @@
+import json
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from app.services.consultas_ensayos import SOLO_ACTIVOS, normalizar_texto
+from app.services.json_bson import tipo_bson_a_json
+
+CAMPOS_REQUERIDOS = ('codigo_ensayo', 'farmaco', 'fase', 'estado')
+CAMPOS_FECHA = ('fecha_inicio', 'fecha_fin_estimada')
+CAMPO_EFECTOS_EMBEBIDOS = 'resultados_intermedios.efectos_secundarios_frecuentes'
+
+# Errores por documento devueltos en la respuesta (el total se cuenta aparte)
+MAXIMO_ERRORES_DETALLADOS = 1000
+
+
+def preparar_ensayo(data, usuario, ahora=None):
+    """
+    Valida un ensayo nuevo y añade los campos derivados (archivado,
+    farmaco_search, metadata) y las fechas como datetime.
+
+    Raises:
+        ValueError: Si faltan campos requeridos, una fecha no es ISO 8601
+            o el ensayo trae efectos adversos embebidos
+    """
+    if not isinstance(data, dict):
+        raise ValueError('El ensayo debe ser un objeto JSON')
+    if not all(k in data for k in CAMPOS_REQUERIDOS):
+        raise ValueError('Faltan campos requeridos')
+    rechazar_efectos_embebidos(data)
+
+    ahora = ahora or datetime.utcnow()
+
+    data['archivado'] = data['estado'] == 'archivado'
+    data['farmaco_search'] = normalizar_texto(data['farmaco'])
+    data['metadata'] = {
+        'creado_por': usuario,
+        'fecha_creacion': ahora,
+        'ultima_modificacion': ahora,
+        'version_documento': 1
+    }
+
+    return parsear_fechas(data)
+
+
+def rechazar_efectos_embebidos(data):
+    """
+    Rechaza efectos adversos dentro del documento del ensayo, ya sea como
+    resultados_intermedios.efectos_secundarios_frecuentes anidado o como
+    clave con puntos de un $set.
+
+    Los efectos viven en la colección efectos_adversos (buckets): un array
+    embebido volvería a crecer sin límite y no aparecería en el ranking.
+
+    Raises:
+        ValueError: Si el documento trae el array embebido
+    """
+    padre, hijo = CAMPO_EFECTOS_EMBEBIDOS.split('.')
+    anidado = isinstance(data.get(padre), dict) and hijo in data[padre]
+    if anidado or any(c.startswith(CAMPO_EFECTOS_EMBEBIDOS) for c in data):
+        raise ValueError(
+            f'{CAMPO_EFECTOS_EMBEBIDOS} no se admite: registre cada efecto en '
+            'POST /api/ensayos/<id>/efectos-secundarios'
+        )
+
+
+def parsear_fechas(data):
+    """
+    Convierte las fechas del ensayo (CAMPOS_FECHA) a datetime.
+
+    El listado pagina por fecha_inicio con un cursor de fechas: una fecha
+    guardada como texto o número quedaría fuera de la paginación, así que
+    solo se admiten fechas ISO 8601 o null.
+
+    Raises:
+        ValueError: Si una fecha no es ISO 8601
+    """
+    for campo in CAMPOS_FECHA:
+        valor = data.get(campo)
+        if valor is None or isinstance(valor, datetime):
+            continue
+        try:
+            if not isinstance(valor, str):
+                raise ValueError
+            data[campo] = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f'{campo} no es una fecha ISO 8601: {valor}')
+
+    return data
+
+
+def importar_ndjson(collection, lineas, usuario, lote=1000, al_insertar=None):
+    """
+    Importa ensayos desde NDJSON (un documento por línea) sin cargar el
+    cuerpo entero en memoria.
+
+    Cada lote se escribe con insert_many(ordered=False): un documento
+    erróneo no detiene los demás y el error se informa con su línea.
+
+    Args:
+        collection: Colección ensayos_clinicos
+        lineas: Iterable de líneas (bytes o str)
+        usuario: Usuario que figura como creado_por
+        lote: Documentos por insert_many
+        al_insertar: Callback con los documentos insertados de cada lote
+
+    Returns:
+        dict: lineas, insertados, total_errores y errores (con número de línea)
+    """
+    ahora = datetime.utcnow()
+    resultado = {'lineas': 0, 'insertados': 0, 'total_errores': 0, 'errores': []}
+
+    def registrar_error(linea, error, codigo=None):
+        resultado['total_errores'] += 1
+        if len(resultado['errores']) < MAXIMO_ERRORES_DETALLADOS:
+            resultado['errores'].append({'linea': linea, 'codigo_ensayo': codigo, 'error': error})
+
+    def escribir(documentos, numeros):
+        if not documentos:
+            return
+        fallidos = set()
+        try:
+            collection.insert_many(documentos, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                indice = error['index']
+                fallidos.add(indice)
+                registrar_error(numeros[indice], error.get('errmsg'),
+                                documentos[indice].get('codigo_ensayo'))
+        resultado['insertados'] += len(documentos) - len(fallidos)
+        if al_insertar is not None:
+            al_insertar([d for i, d in enumerate(documentos) if i not in fallidos])
+
+    documentos, numeros = [], []
+    for numero, linea in enumerate(lineas, start=1):
+        if not linea.strip():
+            continue
+        resultado['lineas'] += 1
+        data = None
+        try:
+            data = json.loads(linea)
+            documentos.append(preparar_ensayo(data, usuario, ahora))
+            numeros.append(numero)
+        except ValueError as e:
+            # json.JSONDecodeError también es ValueError
+            registrar_error(numero, str(e), data.get('codigo_ensayo') if isinstance(data, dict) else None)
+            continue
+
+        if len(documentos) >= lote:
+            escribir(documentos, numeros)
+            documentos, numeros = [], []
+
+    escribir(documentos, numeros)
+
+    return resultado
+
+
+def exportar_ndjson(collection, filtro=None, incluir_archivados=False, lote=1000):
+    """
+    Genera el NDJSON de los ensayos leyendo directamente del cursor (en
+    orden de _id), sin acumular la colección en memoria.
+
+    La colección debería leer RawBSONDocument (json_bson.OPCIONES_RAW).
+    """
+    condiciones = dict(filtro or {})
+    if not incluir_archivados:
+        condiciones.update(SOLO_ACTIVOS)
+
+    cursor = collection.find(condiciones).sort('_id', 1).batch_size(lote)
+    try:
+        for documento in cursor:
+            yield json.dumps(documento, default=tipo_bson_a_json, ensure_ascii=False) + '\n'
+    finally:
+        cursor.close()
@@ -0,0 +1,122 @@
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, UpdateOne
+from app.services.consultas_ensayos import SOLO_ACTIVOS, normalizar_texto
+
+EDAD_MINIMA = 'criterios_inclusion.edad_minima'
+EDAD_MAXIMA = 'criterios_inclusion.edad_maxima'
+CONDICIONES = 'criterios_inclusion.condiciones_medicas'
+
+INDICES_ENSAYOS = [
+    IndexModel([('farmaco', ASCENDING)], name='farmaco_1'),
+    IndexModel([('fase', ASCENDING)], name='fase_1'),
+    IndexModel([('fecha_inicio', ASCENDING)], name='fecha_inicio_1'),
+    IndexModel(
+        [('fecha_inicio', DESCENDING), ('_id', DESCENDING)],
+        name='listado_activos',
+        partialFilterExpression=SOLO_ACTIVOS
+    ),
+    # Prefijo sobre el nombre normalizado (minúsculas, sin acentos)
+    IndexModel([('farmaco_search', ASCENDING)], name='farmaco_search_1'),
+    # Texto libre
+    IndexModel(
+        [('farmaco', TEXT), ('principio_activo', TEXT), ('objetivo_principal', TEXT)],
+        name='busqueda_texto',
+        default_language='spanish',
+        weights={'farmaco': 10, 'principio_activo': 5, 'objetivo_principal': 1}
+    ),
+    # Búsqueda avanzada (igualdad, orden, rango). Sin filtro parcial: también
+    # se usan con incluir_archivados. busqueda_estado_fase sustituye a estado_1
+    IndexModel(
+        [('estado', ASCENDING), ('fase', ASCENDING),
+         ('fecha_inicio', DESCENDING), ('_id', DESCENDING)],
+        name='busqueda_estado_fase'
+    ),
+    # Multikey sobre el array de condiciones
+    IndexModel(
+        [(CONDICIONES, ASCENDING), ('fase', ASCENDING),
+         (EDAD_MINIMA, ASCENDING), (EDAD_MAXIMA, ASCENDING)],
+        name='busqueda_condiciones'
+    ),
+    IndexModel(
+        [(EDAD_MINIMA, ASCENDING), (EDAD_MAXIMA, ASCENDING), ('fase', ASCENDING)],
+        name='busqueda_edad'
+    ),
+    # Reclutamiento por ciudad / investigador (multikey sobre centros)
+    IndexModel(
+        [('centros_participantes.ciudad', ASCENDING),
+         ('centros_participantes.investigador_principal', ASCENDING)],
+        name='centros_ciudad_investigador'
+    ),
+    IndexModel(
+        [('centros_participantes.investigador_principal', ASCENDING)],
+        name='centros_investigador'
+    ),
+]
+
+INDICES_EFECTOS_ADVERSOS = [
+    # Bucket abierto de un ensayo y mes (upsert de registrar)
+    IndexModel([('ensayo_id', ASCENDING), ('mes', ASCENDING), ('n', ASCENDING)],
+               name='bucket_abierto'),
+    # Ranking por compuesto y periodo
+    IndexModel([('principio_activo', ASCENDING), ('mes', ASCENDING)],
+               name='ranking_compuesto'),
+]
+
+# Índices que quedaron cubiertos por otro compuesto (mismo prefijo)
+INDICES_OBSOLETOS = ['estado_1']
+
+# Formas de consulta reales de busqueda_avanzada para las que están
+# pensados los índices; los tests y el benchmark las recorren con explain
+FORMAS_BUSQUEDA_AVANZADA = {
+    'estado': {'estado': ['en_curso', 'reclutamiento']},
+    'estado_fase': {'estado': ['reclutamiento'], 'fase': [2, 3]},
+    'estado_fase_edad': {'estado': ['reclutamiento'], 'fase': [3], 'edad_minima': 18, 'edad_maxima': 65},
+    'fase': {'fase': [1]},
+    'fase_edad': {'fase': [2, 3], 'edad_minima': 18},
+    'edad': {'edad_minima': 16, 'edad_maxima': 60},
+    'condiciones': {'condiciones': ['hipertension', 'diabetes_tipo2']},
+    'condiciones_fase_edad': {'condiciones': ['asma'], 'fase': [2], 'edad_minima': 18, 'edad_maxima': 50},
+    'completa': {'estado': ['reclutamiento'], 'fase': [3], 'condiciones': ['hipertension'],
+                 'edad_minima': 21, 'edad_maxima': 60},
+}
+
+
+def asegurar_indices_ensayos(mongo_db):
+    """
+    Crea los índices de ensayos_clinicos (y de efectos_adversos) que falten
+    y marca el campo archivado en documentos antiguos (necesario para el
+    índice parcial).
+
+    Returns:
+        list: Nombres de los índices de la colección
+    """
+    collection = mongo_db.ensayos_clinicos
+
+    collection.update_many(
+        {'archivado': {'$exists': False}},
+        [{'$set': {'archivado': {'$eq': ['$estado', 'archivado']}}}]
+    )
+    
+    # farmaco_search se calcula en Python: el plegado de acentos no es
+    # expresable en una actualización con pipeline
+    pendientes = collection.find({'farmaco_search': {'$exists': False}}, {'farmaco': 1})
+    operaciones = []
+    for doc in pendientes:
+        operaciones.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'farmaco_search': normalizar_texto(doc.get('farmaco'))}}
+        ))
+        if len(operaciones) == 1000:
+            collection.bulk_write(operaciones, ordered=False)
+            operaciones = []
+    if operaciones:
+        collection.bulk_write(operaciones, ordered=False)
+    
+    collection.create_indexes(INDICES_ENSAYOS)
+    mongo_db.efectos_adversos.create_indexes(INDICES_EFECTOS_ADVERSOS)
+
+    existentes = collection.index_information()
+    for nombre in INDICES_OBSOLETOS:
+        if nombre in existentes:
+            collection.drop_index(nombre)
+
+    return sorted(collection.index_information())
@@ -0,0 +1,117 @@
+import logging
+import time
+import uuid
+from app.services.consultas_grafo import ejecutar_consulta, ejecutar_consultas
+from app.services.grafo_interacciones import (
+    CODIGO_SEVERIDAD, CODIGO_OTRA_SEVERIDAD, GrafoInteraccionesService
+)
+
+logger = logging.getLogger(__name__)
+
+# Consultas de origen y de escritura de cada vía de inferencia
+CONSULTAS_VIA = {
+    'principio_activo': ('fuentes_inferencia_principios', 'escribir_inferidas_principios'),
+    'categoria': ('fuentes_inferencia_categorias', 'escribir_inferidas_categorias'),
+}
+
+
+def agregar_por_clase(via, filas):
+    """
+    Tabla de interacciones entre clases a partir de las interacciones
+    directas de sus medicamentos.
+
+    Cada par no ordenado de clases queda una vez (clase_a < clase_b) con
+    la interacción de origen más grave como procedencia (fuente_a es el
+    medicamento del lado de clase_a) y el número de interacciones directas
+    que lo respaldan.
+
+    Args:
+        via: 'principio_activo' o 'categoria'
+        filas: Dicts de fuentes_inferencia_principios / _categorias
+
+    Returns:
+        list: Filas de escribir_inferidas_* ({clase_a, clase_b, propiedades})
+    """
+    pares = {}
+    for f in filas:
+        a, b, fuente_a, fuente_b = f['clase_a'], f['clase_b'], f['fuente_a'], f['fuente_b']
+        if a is None or b is None or a == b:
+            continue
+        if str(a) > str(b):
+            a, b, fuente_a, fuente_b = b, a, fuente_b, fuente_a
+
+        par = pares.setdefault((a, b), {'fuentes': set(), 'mejor': None})
+        par['fuentes'].add(frozenset((fuente_a, fuente_b)))
+        orden = (CODIGO_SEVERIDAD.get(f['severidad'], CODIGO_OTRA_SEVERIDAD), str(fuente_a), str(fuente_b))
+        if par['mejor'] is None or orden < par['mejor'][0]:
+            par['mejor'] = (orden, f, fuente_a, fuente_b)
+
+    tabla = []
+    for (a, b), par in sorted(pares.items(), key=lambda p: (str(p[0][0]), str(p[0][1]))):
+        _, f, fuente_a, fuente_b = par['mejor']
+        tabla.append({
+            'clase_a': a,
+            'clase_b': b,
+            'propiedades': {
+                'via': via,
+                'severidad': f['severidad'],
+                'descripcion': f['descripcion'],
+                'recomendaciones': f['recomendaciones'],
+                'fuente_a': fuente_a,
+                'fuente_b': fuente_b,
+                'fuentes': len(par['fuentes'])
+            }
+        })
+    return tabla
+
+
+class InferenciaInteraccionesService:
+    """
+    Materializa las interacciones por clase (INTERACCION_INFERIDA entre
+    PrincipioActivo y entre Categoria) que usa la verificación de
+    prescripciones para detectar interacciones de medicamentos sin aristas
+    INTERACCIONA_CON propias (p. ej. una marca nueva de un principio
+    activo ya conocido).
+    """
+
+    @staticmethod
+    def materializar(driver, redis_client, tamano_lote=1000):
+        """
+        Recalcula las tablas por clase desde las interacciones directas.
+
+        Las aristas se escriben con MERGE marcadas con el id de esta
+        materialización y después se borran las que no se reescribieron:
+        durante el proceso siempre hay una tabla completa. Al terminar se
+        incrementa la versión del grafo para que los workers recarguen la
+        instantánea.
+
+        Returns:
+            dict: Aristas escritas por vía, borradas, versión y duración
+        """
+        inicio = time.perf_counter()
+        materializacion = uuid.uuid4().hex
+        fuentes = ejecutar_consultas(driver, [(origen, None) for origen, _ in CONSULTAS_VIA.values()])
+
+        escritas = {}
+        for (via, (_, escritura)), filas in zip(CONSULTAS_VIA.items(), fuentes):
+            tabla = agregar_por_clase(via, filas)
+            for posicion in range(0, len(tabla), tamano_lote):
+                ejecutar_consulta(driver, escritura, {
+                    'filas': tabla[posicion:posicion + tamano_lote],
+                    'materializacion': materializacion
+                })
+            escritas[via] = len(tabla)
+
+        borradas = ejecutar_consulta(driver, 'borrar_inferidas_obsoletas',
+                                     {'materializacion': materializacion})
+        version = GrafoInteraccionesService.incrementar_version(redis_client)
+
+        resultado = {
+            'materializacion': materializacion,
+            'escritas': escritas,
+            'borradas': borradas[0]['borradas'] if borradas else 0,
+            'version': version,
+            'duracion_s': round(time.perf_counter() - inicio, 3)
+        }
+        logger.info('Interacciones inferidas materializadas: %s', resultado)
+        return resultado
@@ -0,0 +1,45 @@
+from datetime import date, datetime
+from bson import ObjectId, Decimal128, decode
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from flask.json.provider import DefaultJSONProvider
+
+# Lecturas sin decodificar: el cursor entrega los bytes BSON de cada documento
+OPCIONES_RAW = CodecOptions(document_class=RawBSONDocument)
+
+# Al serializar se decodifica el documento entero de una vez con la
+# extensión C de bson (subdocumentos como dict, no como RawBSONDocument)
+_OPCIONES_DICT = CodecOptions(document_class=dict)
+
+
+def tipo_bson_a_json(o):
+    """
+    Hook default de json para los tipos que devuelve pymongo.
+
+    El encoder C de json recorre dicts y listas a cualquier profundidad
+    (incluidas listas de listas) y solo llama a este hook para valores que
+    no sabe serializar, así no hay recorrido recursivo en Python.
+    """
+    if isinstance(o, RawBSONDocument):
+        return decode(o.raw, _OPCIONES_DICT)
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal128):
+        return str(o.to_decimal())
+    return DefaultJSONProvider.default(o)
+
+
+class ProveedorJSONBson(DefaultJSONProvider):
+    """
+    Proveedor JSON de Flask que serializa documentos de MongoDB
+    (RawBSONDocument, ObjectId, datetime, Decimal128) sin copiarlos antes.
+
+    Las fechas salen en ISO 8601, igual que los to_dict de los modelos.
+    Las claves conservan el orden del documento: ordenarlas (sort_keys por
+    defecto en Flask) encarece notablemente los documentos grandes.
+    """
+
+    default = staticmethod(tipo_bson_a_json)
+    sort_keys = False
@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+import neo4j
+import redis
+from pymongo import monitoring
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Versiones mayores del driver de Neo4j cuyo pool interno (driver._pool con
+# acquire/release) se sabe instrumentar
+VERSIONES_NEO4J_INSTRUMENTABLES = (5,)
+
+
+class MetricasPool:
+    """
+    Contadores de saturación de un pool de conexiones.
+
+    en_uso es un gauge (conexiones prestadas ahora mismo); el resto son
+    acumulados desde el arranque del proceso.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # False si el cliente no permite medir su pool (contadores a cero)
+        self.instrumentado = True
+        self.en_uso = 0
+        self.adquisiciones = 0
+        self.timeouts = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def registrar_adquisicion(self, espera):
+        with self._lock:
+            self.en_uso += 1
+            self.adquisiciones += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+
+    def registrar_liberacion(self, cantidad=1):
+        with self._lock:
+            self.en_uso = max(self.en_uso - cantidad, 0)
+
+    def registrar_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def reiniciar_en_uso(self):
+        with self._lock:
+            self.en_uso = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'instrumentado': self.instrumentado,
+                'en_uso': self.en_uso,
+                'adquisiciones': self.adquisiciones,
+                'timeouts': self.timeouts,
+                'espera_promedio_ms': round(self.espera_total / self.adquisiciones * 1000, 3)
+                if self.adquisiciones else 0.0,
+                'espera_max_ms': round(self.espera_max * 1000, 3)
+            }
+
+
+# ============================================
+# MYSQL (SQLAlchemy)
+# ============================================
+
+class QueuePoolInstrumentado(QueuePool):
+    """QueuePool que mide la espera para obtener conexión y los timeouts"""
+
+    def __init__(self, *args, **kwargs):
+        self.metricas = MetricasPool()
+        super().__init__(*args, **kwargs)
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except exc.TimeoutError:
+            self.metricas.registrar_timeout()
+            raise
+        self.metricas.registrar_adquisicion(time.perf_counter() - inicio)
+        return conexion
+
+    def _do_return_conn(self, record):
+        self.metricas.registrar_liberacion()
+        super()._do_return_conn(record)
+
+
+def snapshot_sqlalchemy(engines):
+    """Métricas de cada engine (primario y réplicas) de Flask-SQLAlchemy"""
+    resultado = {}
+    for clave, engine in engines.items():
+        pool = engine.pool
+        datos = pool.metricas.snapshot() if hasattr(pool, 'metricas') else {}
+        if isinstance(pool, QueuePool):
+            datos.update({
+                'en_uso': pool.checkedout(),
+                'tamano': pool.size(),
+                'overflow': pool.overflow(),
+                'disponibles': pool.checkedin()
+            })
+        resultado[clave or 'primario'] = datos
+    return resultado
+
+
+# ============================================
+# MONGODB
+# ============================================
+
+class ListenerPoolMongo(monitoring.ConnectionPoolListener):
+    """Listener de eventos CMAP de pymongo que alimenta MetricasPool"""
+
+    def __init__(self, metricas):
+        self.metricas = metricas
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.inicio = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        inicio = getattr(self._local, 'inicio', None)
+        espera = time.perf_counter() - inicio if inicio is not None else 0.0
+        self.metricas.registrar_adquisicion(espera)
+
+    def connection_check_out_failed(self, event):
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self.metricas.registrar_timeout()
+
+    def connection_checked_in(self, event):
+        self.metricas.registrar_liberacion()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+# ============================================
+# REDIS
+# ============================================
+
+class BlockingConnectionPoolInstrumentado(redis.BlockingConnectionPool):
+    """
+    Pool bloqueante de redis-py: con max_connections alcanzado espera
+    hasta `timeout` segundos en lugar de abrir conexiones sin límite.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.metricas = MetricasPool()
+        super().__init__(*args, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.metricas.reiniciar_en_uso()
+
+    def get_connection(self, *args, **options):
+        # command_name es opcional (y obsoleto) desde redis-py 5.3
+        inicio = time.perf_counter()
+        try:
+            conexion = super().get_connection(*args, **options)
+        except redis.ConnectionError as e:
+            if 'No connection available' in str(e):
+                self.metricas.registrar_timeout()
+            raise
+        self.metricas.registrar_adquisicion(time.perf_counter() - inicio)
+        return conexion
+
+    def release(self, connection):
+        super().release(connection)
+        self.metricas.registrar_liberacion()
+
+
+# ============================================
+# NEO4J
+# ============================================
+
+def instrumentar_driver_neo4j(driver, metricas):
+    """
+    Envuelve acquire/release del pool interno del driver de Neo4j.
+
+    El driver no expone eventos de pool: solo se instrumentan las versiones
+    de VERSIONES_NEO4J_INSTRUMENTABLES y si driver._pool tiene acquire y
+    release. En otro caso el driver queda sin instrumentar pero funcional
+    y las métricas se marcan con instrumentado=False.
+    """
+    version = str(getattr(neo4j, '__version__', ''))
+    mayor = int(version.split('.')[0]) if version.split('.')[0].isdigit() else None
+    pool = getattr(driver, '_pool', None)
+    if mayor not in VERSIONES_NEO4J_INSTRUMENTABLES or pool is None \
+            or not callable(getattr(pool, 'acquire', None)) or not callable(getattr(pool, 'release', None)):
+        logger.warning('Pool de Neo4j sin instrumentar (driver %s)', version or 'desconocido')
+        metricas.instrumentado = False
+        return driver
+
+    acquire_original = pool.acquire
+    release_original = pool.release
+
+    def acquire(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            conexion = acquire_original(*args, **kwargs)
+        except Exception as e:
+            if 'timeout' in str(e):
+                metricas.registrar_timeout()
+            raise
+        metricas.registrar_adquisicion(time.perf_counter() - inicio)
+        return conexion
+
+    def release(*connections):
+        try:
+            return release_original(*connections)
+        finally:
+            metricas.registrar_liberacion(len(connections))
+
+    pool.acquire = acquire
+    pool.release = release
+    return driver
@@ -0,0 +1,220 @@
+import json
+import logging
+import math
+from datetime import date, timedelta
+from statistics import NormalDist
+import numpy as np
+from redis.exceptions import RedisError
+from sqlalchemy import select, func
+from app.models.mysql_models import db, Producto, Lote, Transaccion, VentaDiaria
+
+logger = logging.getLogger(__name__)
+
+
+def cargar_series(dias_historia, hasta=None):
+    """
+    Carga la demanda diaria de todo el catálogo como una matriz densa.
+
+    Lee el rollup ventas_diarias (derivado de transacciones) y el stock
+    disponible por producto en dos consultas agregadas.
+
+    Returns:
+        tuple: (producto_ids [n], ventas [n, dias_historia], stock [n])
+    """
+    hasta = hasta or date.today()
+    desde = hasta - timedelta(days=dias_historia - 1)
+
+    ventas = db.session.execute(
+        select(VentaDiaria.producto_id, VentaDiaria.fecha, VentaDiaria.unidades)
+        .where(VentaDiaria.fecha.between(desde, hasta))
+    ).all()
+    stock = db.session.execute(
+        select(Lote.producto_id, func.sum(Lote.cantidad_actual))
+        .where(Lote.cantidad_actual > 0, Lote.fecha_caducidad >= hasta)
+        .group_by(Lote.producto_id)
+    ).all()
+
+    venta_ids = np.fromiter((v[0] for v in ventas), dtype=np.int64, count=len(ventas))
+    venta_dias = np.fromiter(((v[1] - desde).days for v in ventas), dtype=np.int64, count=len(ventas))
+    venta_unidades = np.fromiter((v[2] for v in ventas), dtype=np.float64, count=len(ventas))
+    stock_ids = np.fromiter((s[0] for s in stock), dtype=np.int64, count=len(stock))
+    stock_unidades = np.fromiter((s[1] for s in stock), dtype=np.float64, count=len(stock))
+
+    producto_ids = np.union1d(venta_ids, stock_ids)
+
+    matriz = np.zeros((len(producto_ids), dias_historia), dtype=np.float64)
+    np.add.at(matriz, (np.searchsorted(producto_ids, venta_ids), venta_dias), venta_unidades)
+
+    stock_actual = np.zeros(len(producto_ids), dtype=np.float64)
+    stock_actual[np.searchsorted(producto_ids, stock_ids)] = stock_unidades
+
+    return producto_ids, matriz, stock_actual
+
+
+def calcular_reorden(ventas, stock, metodo='media_movil', ventana=28, alpha=0.3,
+                     dias_entrega=7, dias_revision=7, nivel_servicio=0.95):
+    """
+    Calcula demanda, stock de seguridad y días de cobertura para todo el
+    catálogo a la vez. Todas las operaciones son vectoriales sobre el eje
+    de productos; no hay bucles por producto.
+
+    Args:
+        ventas: Matriz [productos, días] de unidades vendidas por día
+        stock: Vector [productos] de unidades disponibles
+        metodo: 'media_movil' o 'suavizado' (suavizado exponencial simple)
+        ventana: Días usados para la media móvil y la desviación
+        alpha: Factor de suavizado (0 < alpha <= 1)
+        dias_entrega: Tiempo de reposición del proveedor (lead time)
+        dias_revision: Días hasta la siguiente revisión de pedidos
+        nivel_servicio: Probabilidad objetivo de no quedar sin stock
+
+    Returns:
+        dict: Vectores demanda_diaria, desviacion, stock_seguridad,
+              punto_reorden, dias_cobertura, cantidad_sugerida y
+              requiere_reorden
+
+    Raises:
+        ValueError: Si dias_entrega o dias_revision son negativos
+    """
+    if dias_entrega < 0:
+        raise ValueError('dias_entrega no puede ser negativo')
+    if dias_revision < 0:
+        raise ValueError('dias_revision no puede ser negativo')
+
+    ventana = max(1, min(ventana, ventas.shape[1]))
+    recientes = ventas[:, -ventana:]
+
+    if metodo == 'suavizado':
+        # Forma cerrada del suavizado exponencial: media ponderada con
+        # pesos alpha * (1 - alpha)^k, normalizados para sumar 1
+        pesos = alpha * (1 - alpha) ** np.arange(ventas.shape[1] - 1, -1, -1)
+        pesos /= pesos.sum()
+        demanda = ventas @ pesos
+    else:
+        demanda = recientes.mean(axis=1)
+
+    desviacion = recientes.std(axis=1)
+    z = NormalDist().inv_cdf(nivel_servicio)
+
+    stock_seguridad = z * desviacion * math.sqrt(dias_entrega)
+    punto_reorden = demanda * dias_entrega + stock_seguridad
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dias_cobertura = np.where(demanda > 0, stock / demanda, np.inf)
+
+    objetivo = punto_reorden + demanda * dias_revision
+    cantidad_sugerida = np.ceil(np.maximum(objetivo - stock, 0))
+
+    return {
+        'demanda_diaria': demanda,
+        'desviacion': desviacion,
+        'stock_seguridad': stock_seguridad,
+        'punto_reorden': punto_reorden,
+        'dias_cobertura': dias_cobertura,
+        'cantidad_sugerida': cantidad_sugerida,
+        'requiere_reorden': (stock <= punto_reorden) & (demanda > 0)
+    }
+
+
+class ReabastecimientoService:
+    """
+    Motor de puntos de reorden cacheado en Redis hasta la siguiente marca
+    de agua del ledger (máximo id de transacciones y lotes).
+    """
+
+    CACHE_PREFIX = 'reabastecimiento'
+    CACHE_TTL = 3600
+
+    @staticmethod
+    def marca_de_agua():
+        """Marca de agua del ledger: cambia con cada transacción o lote nuevo"""
+        fila = db.session.execute(
+            select(
+                select(func.max(Transaccion.id)).scalar_subquery(),
+                select(func.max(Lote.id)).scalar_subquery()
+            )
+        ).one()
+        return f"{fila[0] or 0}-{fila[1] or 0}"
+
+    @staticmethod
+    def generar_reporte(redis_client=None, solo_alertas=True, limite=500, hasta=None, **parametros):
+        """
+        Genera (o recupera de cache) el reporte de reabastecimiento.
+
+        Args:
+            redis_client: Cliente Redis para cachear el resultado (opcional)
+            solo_alertas: Devolver solo productos que requieren reorden
+            limite: Máximo de productos devueltos, ordenados por cobertura
+            hasta: Último día de las series (default hoy)
+            **parametros: dias_historia y argumentos de calcular_reorden
+
+        Returns:
+            dict: Parámetros, marca de agua y productos ordenados por días de cobertura
+        """
+        dias_historia = parametros.pop('dias_historia', 90)
+        hasta = hasta or date.today()
+        marca = ReabastecimientoService.marca_de_agua()
+
+        clave = None
+        if redis_client is not None:
+            firma = json.dumps(
+                {'dias_historia': dias_historia, 'solo_alertas': solo_alertas,
+                 'limite': limite, 'hasta': hasta.isoformat(), **parametros},
+                sort_keys=True
+            )
+            clave = f"{ReabastecimientoService.CACHE_PREFIX}:{marca}:{firma}"
+            try:
+                en_cache = redis_client.get(clave)
+            except RedisError as e:
+                logger.warning('Reporte de reabastecimiento sin cache: %s', e)
+                clave = en_cache = None
+            if en_cache:
+                reporte = json.loads(en_cache)
+                reporte['cache'] = True
+                return reporte
+
+        producto_ids, ventas, stock = cargar_series(dias_historia, hasta)
+        resultado = calcular_reorden(ventas, stock, **parametros)
+
+        mascara = resultado['requiere_reorden'] if solo_alertas else np.ones(len(producto_ids), dtype=bool)
+        indices = np.flatnonzero(mascara)
+        indices = indices[np.argsort(resultado['dias_cobertura'][indices], kind='stable')][:limite]
+
+        nombres = dict(db.session.execute(
+            select(Producto.id, Producto.nombre).where(Producto.id.in_(producto_ids[indices].tolist()))
+        ).all()) if len(indices) else {}
+
+        productos = []
+        for i in indices.tolist():
+            cobertura = resultado['dias_cobertura'][i]
+            productos.append({
+                'producto_id': int(producto_ids[i]),
+                'nombre': nombres.get(int(producto_ids[i])),
+                'stock_actual': int(stock[i]),
+                'demanda_diaria': round(float(resultado['demanda_diaria'][i]), 3),
+                'stock_seguridad': round(float(resultado['stock_seguridad'][i]), 2),
+                'punto_reorden': round(float(resultado['punto_reorden'][i]), 2),
+                'dias_cobertura': round(float(cobertura), 1) if np.isfinite(cobertura) else None,
+                'agota_antes_de_entrega': bool(
+                    cobertura < parametros.get('dias_entrega', 7)
+                ),
+                'requiere_reorden': bool(resultado['requiere_reorden'][i]),
+                'cantidad_sugerida': int(resultado['cantidad_sugerida'][i])
+            })
+
+        reporte = {
+            'marca_de_agua': marca,
+            'parametros': {'dias_historia': dias_historia, 'hasta': hasta.isoformat(), **parametros},
+            'total_productos_analizados': int(len(producto_ids)),
+            'total_requieren_reorden': int(resultado['requiere_reorden'].sum()),
+            'productos': productos,
+            'cache': False
+        }
+
+        if clave is not None:
+            try:
+                redis_client.setex(clave, ReabastecimientoService.CACHE_TTL, json.dumps(reporte))
+            except RedisError as e:
+                logger.warning('No se pudo cachear el reporte de reabastecimiento: %s', e)
+
+        return reporte
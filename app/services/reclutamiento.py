@@ -0,0 +1,194 @@
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from pymongo import ReturnDocument
+from app.services.consultas_ensayos import SOLO_ACTIVOS
+from app.services.estadisticas_ensayos import CAMPOS_ESTADISTICAS
+
+DIMENSIONES = ('ensayo', 'ciudad', 'investigador')
+
+# Campos de cada centro que necesitan las agregaciones
+_CAMPOS_CENTRO = ['ciudad', 'investigador_principal', 'pacientes_reclutados', 'meta_pacientes']
+
+_PORCENTAJE = {'$cond': [
+    {'$gt': ['$meta_pacientes', 0]},
+    {'$round': [{'$multiply': [{'$divide': ['$pacientes_reclutados', '$meta_pacientes']}, 100]}, 1]},
+    None
+]}
+
+_AGRUPACION = {
+    'ensayo': {
+        '_id': '$_id',
+        'codigo_ensayo': {'$first': '$codigo_ensayo'},
+        'farmaco': {'$first': '$farmaco'},
+        'estado': {'$first': '$estado'},
+        'fase': {'$first': '$fase'},
+        'centros': {'$sum': 1},
+    },
+    'ciudad': {
+        '_id': '$centros_participantes.ciudad',
+        'ensayos': {'$addToSet': '$_id'},
+        'centros': {'$sum': 1},
+    },
+    'investigador': {
+        '_id': '$centros_participantes.investigador_principal',
+        'ensayos': {'$addToSet': '$_id'},
+        'ciudades': {'$addToSet': '$centros_participantes.ciudad'},
+        'centros': {'$sum': 1},
+    },
+}
+
+_SALIDA = {
+    'ensayo': {'_id': 0, 'ensayo_id': {'$toString': '$_id'}, 'codigo_ensayo': 1,
+               'farmaco': 1, 'estado': 1, 'fase': 1, 'centros': 1},
+    'ciudad': {'_id': 0, 'ciudad': '$_id', 'ensayos': {'$size': '$ensayos'}, 'centros': 1},
+    'investigador': {'_id': 0, 'investigador_principal': '$_id', 'ensayos': {'$size': '$ensayos'},
+                     'ciudades': 1, 'centros': 1},
+}
+
+
+def pipeline_reclutamiento(dimension, estado=None, fase=None, ciudad=None,
+                           investigador=None, incluir_archivados=False,
+                           orden='asc', limite=100):
+    """
+    Pipeline de avance de reclutamiento agrupado por ensayo, ciudad o
+    investigador principal.
+
+    Los filtros por ciudad e investigador se aplican dos veces: antes del
+    $unwind sobre el array (usa los índices multikey de centros) y después,
+    sobre cada centro, para no sumar los demás centros del mismo ensayo.
+    """
+    if dimension not in DIMENSIONES:
+        raise ValueError(f"dimension inválida. Debe ser: {', '.join(DIMENSIONES)}")
+    if orden not in ('asc', 'desc'):
+        raise ValueError('orden inválido. Debe ser: asc, desc')
+
+    filtro_ensayo = {} if incluir_archivados else dict(SOLO_ACTIVOS)
+    if estado:
+        filtro_ensayo['estado'] = estado
+    if fase is not None:
+        filtro_ensayo['fase'] = fase
+
+    filtro_centro = {}
+    if ciudad:
+        filtro_centro['centros_participantes.ciudad'] = ciudad
+    if investigador:
+        filtro_centro['centros_participantes.investigador_principal'] = investigador
+
+    proyeccion = {'codigo_ensayo': 1, 'farmaco': 1, 'estado': 1, 'fase': 1}
+    proyeccion.update({f'centros_participantes.{c}': 1 for c in _CAMPOS_CENTRO})
+
+    pipeline = [
+        {'$match': {**filtro_ensayo, **filtro_centro}},
+        {'$project': proyeccion},
+        {'$unwind': '$centros_participantes'},
+    ]
+    if filtro_centro:
+        pipeline.append({'$match': filtro_centro})
+
+    agrupacion = dict(_AGRUPACION[dimension])
+    agrupacion['pacientes_reclutados'] = {'$sum': {'$ifNull': ['$centros_participantes.pacientes_reclutados', 0]}}
+    agrupacion['meta_pacientes'] = {'$sum': {'$ifNull': ['$centros_participantes.meta_pacientes', 0]}}
+
+    pipeline.extend([
+        {'$group': agrupacion},
+        {'$project': {**_SALIDA[dimension], 'pacientes_reclutados': 1, 'meta_pacientes': 1,
+                      'porcentaje': _PORCENTAJE}},
+        {'$sort': {'porcentaje': 1 if orden == 'asc' else -1, 'meta_pacientes': -1}},
+        {'$limit': limite},
+    ])
+    return pipeline
+
+
+class ReclutamientoService:
+    """
+    Avance de reclutamiento de los centros participantes, cacheado en
+    Redis. Cada escritura de ensayos incrementa una generación que forma
+    parte de la clave, así la cache anterior deja de usarse al instante.
+    """
+
+    CACHE_PREFIX = 'reclutamiento'
+    CLAVE_GENERACION = 'reclutamiento:generacion'
+    CACHE_TTL = 600
+
+    @staticmethod
+    def invalidar(redis_client):
+        """Descarta la cache tras una escritura en ensayos_clinicos"""
+        redis_client.incr(ReclutamientoService.CLAVE_GENERACION)
+
+    @staticmethod
+    def obtener(collection, dimension, redis_client=None, **filtros):
+        """
+        Avance de reclutamiento por dimensión (ensayo, ciudad o investigador).
+
+        Args:
+            collection: Colección ensayos_clinicos (puede leer de secundarios)
+            dimension: 'ensayo', 'ciudad' o 'investigador'
+            redis_client: Cliente Redis para cachear el resultado (opcional)
+            **filtros: Argumentos de pipeline_reclutamiento
+
+        Returns:
+            dict: Dimensión, filtros aplicados y filas ordenadas por porcentaje
+        """
+        pipeline = pipeline_reclutamiento(dimension, **filtros)
+
+        clave = None
+        if redis_client is not None:
+            generacion = redis_client.get(ReclutamientoService.CLAVE_GENERACION) or 0
+            firma = json.dumps({'dimension': dimension, **filtros}, sort_keys=True)
+            clave = f"{ReclutamientoService.CACHE_PREFIX}:{generacion}:{firma}"
+            en_cache = redis_client.get(clave)
+            if en_cache:
+                resultado = json.loads(en_cache)
+                resultado['cache'] = True
+                return resultado
+
+        filas = list(
+            collection.with_options(codec_options=DEFAULT_CODEC_OPTIONS).aggregate(pipeline)
+        )
+
+        resultado = {
+            'dimension': dimension,
+            'filtros': filtros,
+            'total': len(filas),
+            'filas': filas,
+            'cache': False
+        }
+
+        if clave is not None:
+            redis_client.setex(clave, ReclutamientoService.CACHE_TTL, json.dumps(resultado))
+
+        return resultado
+
+    @staticmethod
+    def registrar_inclusiones(collection, ensayo_id, centro, pacientes, usuario):
+        """
+        Suma pacientes reclutados a un centro con un $inc atómico sobre el
+        elemento del array (operador posicional), sin reescribir el ensayo.
+
+        Returns:
+            dict: Ensayo actualizado (campos de estadísticas y centros) o None
+                  si no existe el ensayo o el centro
+        """
+        if not isinstance(pacientes, int) or isinstance(pacientes, bool) or pacientes < 1:
+            raise ValueError('pacientes debe ser un entero positivo')
+        if not centro:
+            raise ValueError('centro es requerido')
+
+        return collection.find_one_and_update(
+            {'_id': ObjectId(ensayo_id), 'centros_participantes.nombre': centro},
+            {
+                '$inc': {
+                    'centros_participantes.$.pacientes_reclutados': pacientes,
+                    'metadata.version_documento': 1
+                },
+                '$set': {
+                    'metadata.ultima_modificacion': datetime.utcnow(),
+                    'metadata.modificado_por': usuario
+                }
+            },
+            projection={**CAMPOS_ESTADISTICAS, 'codigo_ensayo': 1,
+                        'centros_participantes.nombre': 1, 'metadata.version_documento': 1},
+            return_document=ReturnDocument.AFTER
+        )
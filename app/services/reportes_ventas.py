@@ -0,0 +1,272 @@
+from decimal import Decimal
+from sqlalchemy import select, func, case, and_, or_, insert, delete
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from app.models.mysql_models import db, Producto, Lote, Transaccion, VentaDiaria, VentaDiariaDetalle
+
+
+class ReporteVentasService:
+    """
+    Servicio de analítica de ventas basado en rollups diarios.
+
+    Las tablas ventas_diarias y ventas_diarias_detalle se actualizan en la
+    misma transacción que registra la venta, de modo que los reportes solo
+    leen los rollups y su latencia no depende del tamaño de transacciones.
+    """
+
+    @staticmethod
+    def _upsert(modelo, valores):
+        """INSERT ... ON DUPLICATE KEY UPDATE acumulando las métricas"""
+        tabla = modelo.__table__
+        stmt = mysql_insert(tabla).values(**valores)
+        stmt = stmt.on_duplicate_key_update(
+            unidades=tabla.c.unidades + stmt.inserted.unidades,
+            ingresos=tabla.c.ingresos + stmt.inserted.ingresos,
+            num_ventas=tabla.c.num_ventas + stmt.inserted.num_ventas
+        )
+        db.session.execute(stmt)
+
+    @staticmethod
+    def registrar_venta(lote, usuario_id, cantidad, fecha):
+        """
+        Acumula una venta en los rollups.
+
+        Se ejecuta dentro de la transacción en curso (no hace commit), así
+        el ledger y los rollups se confirman o revierten juntos.
+
+        Args:
+            lote: Lote vendido (ya bloqueado con FOR UPDATE)
+            usuario_id: ID del usuario que registra la venta
+            cantidad: Unidades vendidas (positivo)
+            fecha: Fecha (date) de la transacción
+        """
+        ingresos = Decimal(cantidad) * Decimal(lote.precio_venta)
+
+        ReporteVentasService._upsert(VentaDiaria, {
+            'producto_id': lote.producto_id,
+            'fecha': fecha,
+            'unidades': cantidad,
+            'ingresos': ingresos,
+            'num_ventas': 1
+        })
+        ReporteVentasService._upsert(VentaDiariaDetalle, {
+            'fecha': fecha,
+            'producto_id': lote.producto_id,
+            'lote_id': lote.id,
+            'usuario_id': usuario_id,
+            'unidades': cantidad,
+            'ingresos': ingresos,
+            'num_ventas': 1
+        })
+
+    @staticmethod
+    def reconstruir():
+        """
+        Reconstruye los rollups completos a partir del ledger.
+
+        Pensado para la carga inicial o para reparar los rollups; el
+        mantenimiento normal es incremental en registrar_venta.
+
+        Returns:
+            dict: Filas generadas en cada tabla
+        """
+        fecha = func.date(Transaccion.fecha_transaccion)
+        ingresos = func.sum(Transaccion.cantidad * Lote.precio_venta)
+
+        por_producto = (
+            select(
+                Lote.producto_id, fecha, func.sum(Transaccion.cantidad),
+                ingresos, func.count(Transaccion.id)
+            )
+            .join(Lote, Lote.id == Transaccion.lote_id)
+            .where(Transaccion.tipo_transaccion == 'salida')
+            .group_by(Lote.producto_id, fecha)
+        )
+        por_detalle = (
+            select(
+                fecha, Lote.producto_id, Transaccion.lote_id, Transaccion.usuario_id,
+                func.sum(Transaccion.cantidad), ingresos, func.count(Transaccion.id)
+            )
+            .join(Lote, Lote.id == Transaccion.lote_id)
+            .where(Transaccion.tipo_transaccion == 'salida')
+            .group_by(fecha, Lote.producto_id, Transaccion.lote_id, Transaccion.usuario_id)
+        )
+
+        try:
+            db.session.execute(delete(VentaDiaria))
+            db.session.execute(delete(VentaDiariaDetalle))
+
+            filas_producto = db.session.execute(
+                insert(VentaDiaria).from_select(
+                    ['producto_id', 'fecha', 'unidades', 'ingresos', 'num_ventas'],
+                    por_producto
+                )
+            ).rowcount
+            filas_detalle = db.session.execute(
+                insert(VentaDiariaDetalle).from_select(
+                    ['fecha', 'producto_id', 'lote_id', 'usuario_id',
+                     'unidades', 'ingresos', 'num_ventas'],
+                    por_detalle
+                )
+            ).rowcount
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return {
+            'ventas_diarias': filas_producto,
+            'ventas_diarias_detalle': filas_detalle
+        }
+
+    # ============================================
+    # CONSULTAS (solo leen rollups)
+    # ============================================
+
+    @staticmethod
+    def top_productos(desde, hasta, limite=10, orden='ingresos'):
+        """Top-N productos por ingresos o unidades en un rango de fechas"""
+        unidades = func.sum(VentaDiaria.unidades).label('unidades')
+        ingresos = func.sum(VentaDiaria.ingresos).label('ingresos')
+        criterio = unidades if orden == 'unidades' else ingresos
+
+        filas = db.session.execute(
+            select(VentaDiaria.producto_id, Producto.nombre, unidades, ingresos)
+            .join(Producto, Producto.id == VentaDiaria.producto_id)
+            .where(VentaDiaria.fecha.between(desde, hasta))
+            .group_by(VentaDiaria.producto_id, Producto.nombre)
+            .order_by(criterio.desc())
+            .limit(limite)
+        ).all()
+
+        return [
+            {
+                'producto_id': f.producto_id,
+                'nombre': f.nombre,
+                'unidades': int(f.unidades or 0),
+                'ingresos': float(f.ingresos or 0)
+            }
+            for f in filas
+        ]
+
+    @staticmethod
+    def comparar_periodos(periodo_a, periodo_b, limite=20):
+        """
+        Compara dos periodos (desde, hasta) en una sola pasada sobre el rollup.
+
+        Returns:
+            dict: Totales de cada periodo, variación y detalle por producto
+        """
+        en_a = VentaDiaria.fecha.between(*periodo_a)
+        en_b = VentaDiaria.fecha.between(*periodo_b)
+
+        unidades_a = func.sum(case((en_a, VentaDiaria.unidades), else_=0)).label('unidades_a')
+        ingresos_a = func.sum(case((en_a, VentaDiaria.ingresos), else_=0)).label('ingresos_a')
+        unidades_b = func.sum(case((en_b, VentaDiaria.unidades), else_=0)).label('unidades_b')
+        ingresos_b = func.sum(case((en_b, VentaDiaria.ingresos), else_=0)).label('ingresos_b')
+
+        filas = db.session.execute(
+            select(
+                VentaDiaria.producto_id, Producto.nombre,
+                unidades_a, ingresos_a, unidades_b, ingresos_b
+            )
+            .join(Producto, Producto.id == VentaDiaria.producto_id)
+            .where(or_(en_a, en_b))
+            .group_by(VentaDiaria.producto_id, Producto.nombre)
+        ).all()
+
+        def variacion(actual, anterior):
+            if not anterior:
+                return None
+            return round((actual - anterior) / anterior * 100, 2)
+
+        productos = []
+        totales = {'unidades_a': 0, 'ingresos_a': 0.0, 'unidades_b': 0, 'ingresos_b': 0.0}
+        for f in filas:
+            item = {
+                'producto_id': f.producto_id,
+                'nombre': f.nombre,
+                'unidades_a': int(f.unidades_a or 0),
+                'ingresos_a': float(f.ingresos_a or 0),
+                'unidades_b': int(f.unidades_b or 0),
+                'ingresos_b': float(f.ingresos_b or 0)
+            }
+            item['variacion_ingresos_pct'] = variacion(item['ingresos_b'], item['ingresos_a'])
+            for clave in totales:
+                totales[clave] += item[clave]
+            productos.append(item)
+
+        productos.sort(key=lambda p: abs(p['ingresos_b'] - p['ingresos_a']), reverse=True)
+
+        return {
+            'periodo_a': {'desde': periodo_a[0].isoformat(), 'hasta': periodo_a[1].isoformat(),
+                          'unidades': totales['unidades_a'], 'ingresos': round(totales['ingresos_a'], 2)},
+            'periodo_b': {'desde': periodo_b[0].isoformat(), 'hasta': periodo_b[1].isoformat(),
+                          'unidades': totales['unidades_b'], 'ingresos': round(totales['ingresos_b'], 2)},
+            'variacion_unidades_pct': variacion(totales['unidades_b'], totales['unidades_a']),
+            'variacion_ingresos_pct': variacion(totales['ingresos_b'], totales['ingresos_a']),
+            'productos': productos[:limite]
+        }
+
+    @staticmethod
+    def serie_ingresos(desde, hasta, producto_id=None, granularidad='dia'):
+        """Serie temporal de ingresos y unidades por día o por mes"""
+        if granularidad == 'mes':
+            periodo = func.date_format(VentaDiaria.fecha, '%Y-%m')
+        else:
+            periodo = VentaDiaria.fecha
+        periodo = periodo.label('periodo')
+
+        condiciones = [VentaDiaria.fecha.between(desde, hasta)]
+        if producto_id is not None:
+            condiciones.append(VentaDiaria.producto_id == producto_id)
+
+        filas = db.session.execute(
+            select(
+                periodo,
+                func.sum(VentaDiaria.unidades).label('unidades'),
+                func.sum(VentaDiaria.ingresos).label('ingresos')
+            )
+            .where(and_(*condiciones))
+            .group_by(periodo)
+            .order_by(periodo)
+        ).all()
+
+        return [
+            {
+                'periodo': f.periodo if isinstance(f.periodo, str) else f.periodo.isoformat(),
+                'unidades': int(f.unidades or 0),
+                'ingresos': float(f.ingresos or 0)
+            }
+            for f in filas
+        ]
+
+    @staticmethod
+    def desglose(desde, hasta, dimension='lote', limite=50):
+        """Ventas agregadas por lote o por usuario en un rango de fechas"""
+        columna = VentaDiariaDetalle.usuario_id if dimension == 'usuario' else VentaDiariaDetalle.lote_id
+        columna = columna.label(f'{dimension}_id')
+        ingresos = func.sum(VentaDiariaDetalle.ingresos).label('ingresos')
+
+        filas = db.session.execute(
+            select(
+                columna,
+                func.sum(VentaDiariaDetalle.unidades).label('unidades'),
+                ingresos,
+                func.sum(VentaDiariaDetalle.num_ventas).label('num_ventas')
+            )
+            .where(VentaDiariaDetalle.fecha.between(desde, hasta))
+            .group_by(columna)
+            .order_by(ingresos.desc())
+            .limit(limite)
+        ).all()
+
+        return [
+            {
+                f'{dimension}_id': f[0],
+                'unidades': int(f.unidades or 0),
+                'ingresos': float(f.ingresos or 0),
+                'num_ventas': int(f.num_ventas or 0)
+            }
+            for f in filas
+        ]
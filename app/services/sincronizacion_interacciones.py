@@ -0,0 +1,382 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, select, delete, func, inspect
+from app.models.mysql_models import db, Producto, InteraccionMedicamentosa, OutboxInteraccion
+from app.services.consultas_grafo import ejecutar_consulta
+from app.services.grafo_interacciones import GrafoInteraccionesService
+
+logger = logging.getLogger(__name__)
+
+# Ids de huecos saltados que se siguen revisando como mucho (el resto solo
+# se registra en el log)
+MAXIMO_HUECOS_REVISADOS = 1000
+
+
+# ============================================
+# CAPTURA (misma transacción que el cambio)
+# ============================================
+
+def _evento(operacion, interaccion, producto_a_id=None, producto_b_id=None):
+    return {
+        'interaccion_id': interaccion.id,
+        'operacion': operacion,
+        'producto_a_id': producto_a_id if producto_a_id is not None else interaccion.medicamento_a_id,
+        'producto_b_id': producto_b_id if producto_b_id is not None else interaccion.medicamento_b_id,
+        'severidad': interaccion.tipo_interaccion,
+        'descripcion': interaccion.descripcion,
+        'recomendaciones': interaccion.recomendaciones,
+        'fecha': datetime.utcnow()
+    }
+
+
+def _anterior(estado, atributo):
+    """Valor antes del flush de un atributo modificado (None si no cambió)"""
+    historia = estado.attrs[atributo].history
+    return historia.deleted[0] if historia.deleted else None
+
+
+@event.listens_for(InteraccionMedicamentosa, 'after_insert')
+def _capturar_alta(mapper, connection, interaccion):
+    connection.execute(insert(OutboxInteraccion.__table__), [_evento('upsert', interaccion)])
+
+
+def _cargar_valor_anterior(target, valor, anterior, iniciador):
+    return valor
+
+
+# Con active_history el valor anterior se carga aunque el objeto esté
+# expirado (tras un commit), para poder borrar la arista del par antiguo
+for _atributo in (InteraccionMedicamentosa.medicamento_a_id, InteraccionMedicamentosa.medicamento_b_id):
+    event.listen(_atributo, 'set', _cargar_valor_anterior, active_history=True, retval=True)
+
+
+@event.listens_for(InteraccionMedicamentosa, 'after_update')
+def _capturar_cambio(mapper, connection, interaccion):
+    estado = inspect(interaccion)
+    eventos = []
+    # Cambiar de par es borrar la arista anterior y crear la nueva
+    anterior_a = _anterior(estado, 'medicamento_a_id')
+    anterior_b = _anterior(estado, 'medicamento_b_id')
+    if anterior_a is not None or anterior_b is not None:
+        eventos.append(_evento('borrar', interaccion,
+                               anterior_a if anterior_a is not None else interaccion.medicamento_a_id,
+                               anterior_b if anterior_b is not None else interaccion.medicamento_b_id))
+    eventos.append(_evento('upsert', interaccion))
+    connection.execute(insert(OutboxInteraccion.__table__), eventos)
+
+
+@event.listens_for(InteraccionMedicamentosa, 'after_delete')
+def _capturar_baja(mapper, connection, interaccion):
+    connection.execute(insert(OutboxInteraccion.__table__), [_evento('borrar', interaccion)])
+
+
+# ============================================
+# APLICACIÓN EN NEO4J
+# ============================================
+
+def compactar_eventos(eventos, mapeo):
+    """
+    Eventos del outbox (en orden de id) -> parámetros de
+    aplicar_interacciones_mysql.
+
+    De varios eventos de la misma interacción y el mismo par queda el
+    último; los borrados se aplican antes que las altas, así un cambio
+    de par dentro del lote también queda bien.
+
+    Args:
+        eventos: Filas de OutboxInteraccion
+        mapeo: dict productos.id -> Medicamento.id
+
+    Returns:
+        tuple: (borrar, upsert, eventos sin medicamento en el grafo)
+    """
+    ultimos = {}
+    sin_mapeo = 0
+    for e in eventos:
+        origen, destino = mapeo.get(e.producto_a_id), mapeo.get(e.producto_b_id)
+        if not origen or not destino:
+            sin_mapeo += 1
+            continue
+        ultimos[(e.interaccion_id, origen, destino)] = e
+
+    borrar, upsert = [], []
+    for (interaccion_id, origen, destino), e in ultimos.items():
+        fila = {'interaccion_id': interaccion_id, 'origen': origen, 'destino': destino}
+        if e.operacion == 'borrar':
+            borrar.append(fila)
+        else:
+            fila['propiedades'] = {
+                'severidad': e.severidad,
+                'descripcion': e.descripcion,
+                'recomendaciones': e.recomendaciones,
+                'interaccion_mysql_id': interaccion_id,
+                'origen': 'mysql'
+            }
+            upsert.append(fila)
+    return borrar, upsert, sin_mapeo
+
+
+def eventos_contiguos(eventos, watermark, limite_hueco):
+    """
+    Prefijo de `eventos` (en orden de id) que se puede aplicar sin saltar
+    ningún evento.
+
+    Los ids del outbox se asignan al insertar, no al confirmar: un id menor
+    puede aparecer después si su transacción confirma más tarde. Ante un
+    hueco se para, salvo que el evento que lo sigue sea anterior a
+    `limite_hueco`: la transacción del id que falta lleva abierta al menos
+    ese tiempo y el hueco se salta. Los ids saltados se devuelven para
+    revisarlos en los siguientes lotes (aplicar_lote).
+
+    Args:
+        eventos: Filas de OutboxInteraccion posteriores a watermark
+        limite_hueco: datetime; un hueco delante de un evento más antiguo se salta
+
+    Returns:
+        tuple: (eventos aplicables, vacía si el primero espera un hueco;
+                ids saltados)
+    """
+    contiguos, saltados = [], []
+    anterior = watermark
+    for e in eventos:
+        if e.id != anterior + 1:
+            if e.fecha > limite_hueco:
+                break
+            saltados.extend(range(anterior + 1, e.id))
+        contiguos.append(e)
+        anterior = e.id
+    return contiguos, saltados
+
+
+class SincronizacionInteraccionesService:
+    """
+    Lleva los cambios de interacciones_medicamentosas (MySQL) a las aristas
+    INTERACCIONA_CON de Neo4j a través del outbox.
+
+    El watermark (último id del outbox aplicado) vive en un nodo
+    :Sincronizacion y se actualiza en la misma transacción que cada lote:
+    tras un reinicio se continúa sin saltar ni repetir eventos, y aunque
+    se repitieran las escrituras son idempotentes (MERGE por par). El
+    watermark no pasa de un hueco de ids hasta que se llena o supera
+    `espera_huecos` segundos (eventos_contiguos). Los ids saltados se
+    guardan en el mismo nodo y se buscan en cada lote durante
+    `revision_huecos` segundos: un evento que confirma tarde se aplica
+    entonces (eventos_tardios en las métricas).
+    """
+
+    NOMBRE = 'interacciones_mysql'
+    CLAVE_METRICAS = 'sincronizacion:interacciones'
+
+    @staticmethod
+    def watermark(driver):
+        return SincronizacionInteraccionesService.estado(driver)[0]
+
+    @staticmethod
+    def estado(driver):
+        """
+        Returns:
+            tuple: (watermark, dict id del hueco -> epoch en que se saltó)
+        """
+        filas = ejecutar_consulta(driver, 'watermark_sincronizacion',
+                                  {'nombre': SincronizacionInteraccionesService.NOMBRE})
+        if not filas:
+            return 0, {}
+        return filas[0]['watermark'] or 0, dict(zip(filas[0]['huecos'] or [], filas[0]['huecos_desde'] or []))
+
+    @staticmethod
+    def aplicar_lote(driver, redis_client, watermark, tamano_lote=500, espera_huecos=5.0,
+                     huecos=None, revision_huecos=3600):
+        """
+        Aplica los siguientes eventos del outbox después de watermark,
+        hasta el primer hueco de ids más reciente que `espera_huecos`, más
+        los eventos de huecos saltados antes que ya han aparecido.
+
+        Args:
+            huecos: dict id -> epoch en que se saltó (estado); se actualiza
+                    en el sitio con los huecos nuevos, llenados y caducados
+
+        Returns:
+            dict: Resultado del lote o None si no había eventos aplicables
+        """
+        inicio = time.perf_counter()
+        huecos = {} if huecos is None else huecos
+        ahora = time.time()
+        eventos = db.session.execute(
+            select(OutboxInteraccion)
+            .where(OutboxInteraccion.id > watermark)
+            .order_by(OutboxInteraccion.id)
+            .limit(tamano_lote)
+        ).scalars().all()
+        eventos, saltados = eventos_contiguos(eventos, watermark,
+                                              datetime.utcnow() - timedelta(seconds=espera_huecos))
+
+        tardios = []
+        if huecos:
+            tardios = db.session.execute(
+                select(OutboxInteraccion).where(OutboxInteraccion.id.in_(list(huecos)))
+            ).scalars().all()
+            for e in tardios:
+                del huecos[e.id]
+            if tardios:
+                logger.warning('Eventos del outbox confirmados después de saltar su hueco, se aplican: ids %s',
+                               [e.id for e in tardios])
+            caducados = [i for i, desde in huecos.items() if ahora - desde > revision_huecos]
+            for i in caducados:
+                del huecos[i]
+            if caducados:
+                logger.warning('Huecos del outbox sin evento tras %s s, se abandonan: ids %s',
+                               revision_huecos, caducados)
+
+        if saltados:
+            revisados = saltados[:max(0, MAXIMO_HUECOS_REVISADOS - len(huecos))]
+            huecos.update((i, ahora) for i in revisados)
+            logger.warning('Huecos del outbox de más de %s s saltados (se revisan %s de %s): ids %s',
+                           espera_huecos, len(revisados), len(saltados), saltados[:50])
+
+        if not eventos and not tardios:
+            return None
+        nuevo_watermark = eventos[-1].id if eventos else watermark
+        # Los tardíos tienen ids menores: van antes al compactar
+        eventos = sorted(tardios, key=lambda e: e.id) + eventos
+
+        productos = {e.producto_a_id for e in eventos} | {e.producto_b_id for e in eventos}
+        mapeo = dict(db.session.execute(
+            select(Producto.id, Producto.medicamento_id).where(Producto.id.in_(productos))
+        ).all())
+        borrar, upsert, sin_mapeo = compactar_eventos(eventos, mapeo)
+        if sin_mapeo:
+            logger.warning('%s eventos del outbox con productos sin medicamento_id (ids %s-%s)',
+                           sin_mapeo, eventos[0].id, eventos[-1].id)
+
+        pendientes = sorted(huecos)
+        fila = ejecutar_consulta(driver, 'aplicar_interacciones_mysql', {
+            'borrar': borrar,
+            'upsert': upsert,
+            'nombre': SincronizacionInteraccionesService.NOMBRE,
+            'watermark': nuevo_watermark,
+            'huecos': pendientes,
+            'huecos_desde': [huecos[i] for i in pendientes]
+        })[0]
+        if fila['borradas'] or fila['escritas']:
+            GrafoInteraccionesService.incrementar_version(redis_client)
+
+        segundos = time.perf_counter() - inicio
+        resultado = {
+            'eventos': len(eventos),
+            'escritas': fila['escritas'],
+            'borradas': fila['borradas'],
+            # Aristas cuyo Medicamento no existe en el grafo
+            'sin_nodo': len(upsert) - fila['escritas'],
+            'sin_mapeo': sin_mapeo,
+            'tardios': len(tardios),
+            'huecos_saltados': len(saltados),
+            'huecos_pendientes': len(huecos),
+            'watermark': nuevo_watermark,
+            'segundos': round(segundos, 4),
+            'eventos_por_segundo': round(len(eventos) / segundos) if segundos else None,
+            'lag_segundos': round((datetime.utcnow() - eventos[-1].fecha).total_seconds(), 3)
+        }
+        SincronizacionInteraccionesService._registrar_metricas(redis_client, resultado)
+        return resultado
+
+    @staticmethod
+    def _registrar_metricas(redis_client, resultado):
+        pipe = redis_client.pipeline(transaction=False)
+        clave = SincronizacionInteraccionesService.CLAVE_METRICAS
+        pipe.hset(clave, mapping={
+            'ultimo_lote_eventos': resultado['eventos'],
+            'ultimo_lote_segundos': resultado['segundos'],
+            'ultimo_lote_eventos_por_segundo': resultado['eventos_por_segundo'] or 0,
+            'ultimo_lote_lag_segundos': resultado['lag_segundos'],
+            'ultimo_lote_aplicado_en': datetime.utcnow().isoformat(),
+            'watermark': resultado['watermark'],
+            'huecos_pendientes': resultado['huecos_pendientes']
+        })
+        pipe.hincrby(clave, 'lotes', 1)
+        pipe.hincrby(clave, 'eventos', resultado['eventos'])
+        pipe.hincrby(clave, 'sin_mapeo', resultado['sin_mapeo'])
+        pipe.hincrby(clave, 'sin_nodo', resultado['sin_nodo'])
+        pipe.hincrby(clave, 'eventos_tardios', resultado['tardios'])
+        pipe.hincrby(clave, 'huecos_saltados', resultado['huecos_saltados'])
+        pipe.execute()
+
+    @staticmethod
+    def purgar(watermark, dias_retencion=7, limite=10000):
+        """Borra eventos ya aplicados más antiguos que la retención"""
+        resultado = db.session.execute(
+            delete(OutboxInteraccion)
+            .where(OutboxInteraccion.id <= watermark,
+                   OutboxInteraccion.fecha < datetime.utcnow() - timedelta(days=dias_retencion))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return resultado.rowcount
+
+    @staticmethod
+    def encolar_todas():
+        """
+        Encola un upsert por cada interacción existente (carga inicial o
+        tras asignar medicamento_id a productos). Un único INSERT ... SELECT.
+        """
+        ahora = datetime.utcnow()
+        resultado = db.session.execute(
+            insert(OutboxInteraccion).from_select(
+                ['interaccion_id', 'operacion', 'producto_a_id', 'producto_b_id',
+                 'severidad', 'descripcion', 'recomendaciones', 'fecha'],
+                select(InteraccionMedicamentosa.id, db.literal('upsert'),
+                       InteraccionMedicamentosa.medicamento_a_id, InteraccionMedicamentosa.medicamento_b_id,
+                       InteraccionMedicamentosa.tipo_interaccion, InteraccionMedicamentosa.descripcion,
+                       InteraccionMedicamentosa.recomendaciones, db.literal(ahora))
+            )
+        )
+        db.session.commit()
+        return resultado.rowcount
+
+    @staticmethod
+    def consumir(driver, redis_client, tamano_lote=500, intervalo=1.0, dias_retencion=7,
+                 una_vez=False, al_aplicar=None, espera_huecos=5.0, revision_huecos=3600):
+        """
+        Aplica el outbox en lotes hasta vaciarlo (o hasta un hueco de ids
+        reciente); después espera `intervalo` segundos entre sondeos (o
+        termina con una_vez). Al vaciarse purga los eventos aplicados
+        antiguos.
+        """
+        watermark, huecos = SincronizacionInteraccionesService.estado(driver)
+        while True:
+            resultado = SincronizacionInteraccionesService.aplicar_lote(
+                driver, redis_client, watermark, tamano_lote, espera_huecos, huecos, revision_huecos
+            )
+            # Sin retener la transacción de lectura entre sondeos
+            db.session.rollback()
+            if resultado is not None:
+                watermark = resultado['watermark']
+                if al_aplicar is not None:
+                    al_aplicar(resultado)
+                continue
+
+            SincronizacionInteraccionesService.purgar(watermark, dias_retencion)
+            if una_vez:
+                return watermark
+            time.sleep(intervalo)
+
+    @staticmethod
+    def metricas(driver, redis_client):
+        """Watermark, pendientes, huecos en revisión, lag del evento pendiente más antiguo y último lote"""
+        filas = ejecutar_consulta(driver, 'watermark_sincronizacion',
+                                  {'nombre': SincronizacionInteraccionesService.NOMBRE})
+        watermark = (filas[0]['watermark'] or 0) if filas else 0
+        pendientes, mas_antiguo, ultimo_id = db.session.execute(
+            select(func.count(OutboxInteraccion.id), func.min(OutboxInteraccion.fecha),
+                   select(func.max(OutboxInteraccion.id)).scalar_subquery())
+            .where(OutboxInteraccion.id > watermark)
+        ).one()
+        return {
+            'watermark': watermark,
+            'ultimo_id_outbox': ultimo_id or watermark,
+            'pendientes': pendientes,
+            'huecos_pendientes': len(filas[0]['huecos'] or []) if filas else 0,
+            'lag_segundos': round((datetime.utcnow() - mas_antiguo).total_seconds(), 3) if mas_antiguo else 0,
+            'actualizado_en': str(filas[0]['actualizado_en']) if filas else None,
+            'consumidor': redis_client.hgetall(SincronizacionInteraccionesService.CLAVE_METRICAS)
+        }
@@ -0,0 +1,214 @@
+import json
+import logging
+from collections import defaultdict
+from datetime import date
+from redis.exceptions import RedisError
+from sqlalchemy import select, func
+from app.models.mysql_models import db, Producto, Lote
+from app.services.consultas_grafo import ejecutar_consulta
+from app.services.grafo_interacciones import GrafoInteraccionesService
+
+logger = logging.getLogger(__name__)
+
+# Candidatos guardados por medicamento (antes de filtrar por stock e interacciones)
+MAXIMO_SIMILARES = 30
+
+
+def rasgos_medicamento(principios, categorias):
+    """Conjunto de rasgos con el que se compara cada medicamento"""
+    return frozenset([f'principio_activo:{p}' for p in principios or ()] +
+                     [f'categoria:{c}' for c in categorias or ()])
+
+
+def similares(medicamento_id, rasgos, indice, maximo=MAXIMO_SIMILARES):
+    """
+    Medicamentos que comparten algún principio activo o categoría con
+    medicamento_id, ordenados por similitud de Jaccard de sus rasgos.
+
+    Args:
+        rasgos: dict medicamento -> frozenset de rasgos_medicamento
+        indice: dict rasgo -> set de medicamentos (índice invertido)
+
+    Returns:
+        list: [[medicamento, similitud], ...] (mayor similitud primero)
+    """
+    propios = rasgos.get(medicamento_id, frozenset())
+    candidatos = set()
+    for rasgo in propios:
+        candidatos |= indice.get(rasgo, set())
+    candidatos.discard(medicamento_id)
+
+    puntuados = []
+    for candidato in candidatos:
+        otros = rasgos[candidato]
+        puntuados.append([candidato, round(len(propios & otros) / len(propios | otros), 4)])
+    puntuados.sort(key=lambda c: (-c[1], c[0]))
+    return puntuados[:maximo]
+
+
+class SustitucionService:
+    """
+    Sustitutos terapéuticos de un producto sin stock: medicamentos del
+    grafo con el mismo principio activo o categoría, sin interacciones con
+    la medicación actual del paciente y con stock vendible en lotes.
+
+    Las listas de similares se precalculan en Redis (hash medicamento ->
+    JSON) y se recalculan solo para los medicamentos cuyos rasgos, o los
+    de sus vecinos, cambiaron desde la última actualización.
+    """
+
+    CLAVE_LISTAS = 'sustitutos:listas'
+    CLAVE_RASGOS = 'sustitutos:rasgos'
+
+    @staticmethod
+    def actualizar(driver, redis_client, completo=False):
+        """
+        Actualiza el índice de similares desde el grafo (programar con cron
+        o tras cargar medicamentos).
+
+        Returns:
+            dict: Medicamentos en el grafo, cambiados, listas reescritas y borradas
+        """
+        rasgos = {
+            r['id']: rasgos_medicamento(r['principios'], r['categorias'])
+            for r in ejecutar_consulta(driver, 'instantanea_clases')
+        }
+        indice = defaultdict(set)
+        for medicamento_id, propios in rasgos.items():
+            for rasgo in propios:
+                indice[rasgo].add(medicamento_id)
+
+        anteriores = {
+            medicamento_id: frozenset(json.loads(valor))
+            for medicamento_id, valor in redis_client.hgetall(SustitucionService.CLAVE_RASGOS).items()
+        }
+        borrados = set(anteriores) - set(rasgos)
+        cambiados = {m for m, propios in rasgos.items() if anteriores.get(m) != propios} | borrados
+
+        if completo:
+            afectados = set(rasgos)
+        else:
+            # Quien compartía o comparte un rasgo con un cambiado ve
+            # cambiar su lista (entra, sale o cambia la similitud)
+            afectados = set()
+            for medicamento_id in cambiados:
+                for rasgo in rasgos.get(medicamento_id, frozenset()) | anteriores.get(medicamento_id, frozenset()):
+                    afectados |= indice.get(rasgo, set())
+            afectados = (afectados | cambiados) - borrados
+
+        pipe = redis_client.pipeline(transaction=True)
+        if completo:
+            pipe.delete(SustitucionService.CLAVE_LISTAS, SustitucionService.CLAVE_RASGOS)
+        elif borrados:
+            pipe.hdel(SustitucionService.CLAVE_LISTAS, *borrados)
+            pipe.hdel(SustitucionService.CLAVE_RASGOS, *borrados)
+        for medicamento_id in afectados:
+            pipe.hset(SustitucionService.CLAVE_LISTAS, medicamento_id,
+                      json.dumps(similares(medicamento_id, rasgos, indice)))
+        for medicamento_id in (set(rasgos) if completo else cambiados - borrados):
+            pipe.hset(SustitucionService.CLAVE_RASGOS, medicamento_id,
+                      json.dumps(sorted(rasgos[medicamento_id])))
+        pipe.execute()
+
+        return {
+            'medicamentos': len(rasgos),
+            'cambiados': len(cambiados),
+            'listas_actualizadas': len(afectados),
+            'borrados': len(borrados)
+        }
+
+    @staticmethod
+    def stock_por_medicamento(medicamento_ids, excluir_producto_id=None, hoy=None):
+        """
+        Productos activos de esos medicamentos con stock vendible (lotes
+        con cantidad y sin caducar), en una sola consulta agregada por
+        idx_productos_medicamento e idx_lotes_producto.
+
+        Returns:
+            dict: medicamento_id -> lista de productos con su stock
+        """
+        if not medicamento_ids:
+            return {}
+        hoy = hoy or date.today()
+
+        consulta = (
+            select(Producto.id, Producto.nombre, Producto.medicamento_id, Producto.precio_base,
+                   func.sum(Lote.cantidad_actual), func.min(Lote.fecha_caducidad))
+            .join(Lote, Lote.producto_id == Producto.id)
+            .where(Producto.medicamento_id.in_(list(medicamento_ids)),
+                   Producto.activo.is_(True),
+                   Lote.cantidad_actual > 0,
+                   Lote.fecha_caducidad > hoy)
+            .group_by(Producto.id, Producto.nombre, Producto.medicamento_id, Producto.precio_base)
+        )
+        if excluir_producto_id is not None:
+            consulta = consulta.where(Producto.id != excluir_producto_id)
+
+        productos = defaultdict(list)
+        for producto_id, nombre, medicamento_id, precio, stock, caducidad in db.session.execute(consulta).all():
+            productos[medicamento_id].append({
+                'producto_id': producto_id,
+                'producto': nombre,
+                'precio_base': float(precio),
+                'stock_disponible': int(stock),
+                'caducidad_proxima': caducidad.isoformat()
+            })
+        return productos
+
+    @staticmethod
+    def sugerir(producto_id, redis_client, driver, medicamentos_paciente=(), limite=5,
+                intervalo=2.0, en_memoria=True):
+        """
+        Sustitutos con stock de un producto, mejor primero.
+
+        Otros productos del mismo medicamento van antes (similitud 1.0).
+        Los candidatos que interaccionan con medicamentos_paciente (ids del
+        grafo) se descartan.
+
+        Returns:
+            dict: medicamento_id del producto, sustitutos y descartados por interacción
+        """
+        producto = db.session.get(Producto, producto_id)
+        if producto is None:
+            raise ValueError(f'Producto {producto_id} no encontrado')
+        resultado = {'medicamento_id': producto.medicamento_id, 'sustitutos': [],
+                     'descartados_por_interaccion': []}
+        if not producto.medicamento_id:
+            return resultado
+
+        valor = redis_client.hget(SustitucionService.CLAVE_LISTAS, producto.medicamento_id)
+        candidatos = [[producto.medicamento_id, 1.0]] + (json.loads(valor) if valor else [])
+
+        paciente = [m for m in dict.fromkeys(medicamentos_paciente) if m != producto.medicamento_id]
+        if paciente and len(candidatos) > 1:
+            revisar = [c[0] for c in candidatos[1:]]
+            descartados = set()
+            for posicion, filas, _ in GrafoInteraccionesService.verificar_lote(
+                    [[candidato] + paciente for candidato in revisar], redis_client, driver,
+                    intervalo=intervalo, en_memoria=en_memoria):
+                candidato = revisar[posicion]
+                if any(candidato in (f['medicamento_a_id'], f['medicamento_b_id']) for f in filas):
+                    descartados.add(candidato)
+            candidatos = [c for c in candidatos if c[0] not in descartados]
+            resultado['descartados_por_interaccion'] = sorted(descartados)
+
+        stock = SustitucionService.stock_por_medicamento(
+            [c[0] for c in candidatos], excluir_producto_id=producto.id
+        )
+        for medicamento_id, similitud in candidatos:
+            for p in sorted(stock.get(medicamento_id, []), key=lambda p: -p['stock_disponible']):
+                resultado['sustitutos'].append({**p, 'medicamento_id': medicamento_id,
+                                                'similitud': similitud})
+        resultado['sustitutos'] = resultado['sustitutos'][:limite]
+        return resultado
+
+    @staticmethod
+    def sugerir_sin_fallar(producto_id, *args, **kwargs):
+        """sugerir para respuestas de error: si Redis o Neo4j fallan devuelve None"""
+        try:
+            return SustitucionService.sugerir(producto_id, *args, **kwargs)
+        except (RedisError, ValueError) as e:
+            logger.warning('Sin sustitutos para el producto %s: %s', producto_id, e)
+        except Exception:
+            logger.exception('Error calculando sustitutos del producto %s', producto_id)
+        return None
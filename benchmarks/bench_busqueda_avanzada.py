@@ -0,0 +1,99 @@
+"""
+Plan de consulta de busqueda_avanzada sobre una colección sintética grande.
+
+Para cada forma de consulta (indices_ensayos.FORMAS_BUSQUEDA_AVANZADA)
+registra el executionStats de la primera página: claves examinadas,
+documentos examinados y documentos devueltos. Termina con código 1 si
+alguna forma hace COLLSCAN.
+
+Requiere un mongod local (ver datos_sinteticos.conectar_coleccion).
+
+Ejecutar con:
+    python -m benchmarks.bench_busqueda_avanzada --total 500000 --salida plan.json
+"""
+import argparse
+import json
+import sys
+from app.services.consultas_ensayos import (
+    construir_consulta, filtro_busqueda_avanzada, etapas_plan, ORDEN_LISTADO, LIMITE_POR_DEFECTO
+)
+from app.services.indices_ensayos import FORMAS_BUSQUEDA_AVANZADA, INDICES_ENSAYOS
+from benchmarks.datos_sinteticos import conectar_coleccion, poblar
+
+
+def indices_plan(explain):
+    """Nombres de los índices usados por el plan ganador"""
+    nombres = set()
+    pendientes = [explain.get('queryPlanner', {}).get('winningPlan', {})]
+    while pendientes:
+        nodo = pendientes.pop()
+        if isinstance(nodo, dict):
+            if 'indexName' in nodo:
+                nombres.add(nodo['indexName'])
+            pendientes.extend(nodo.values())
+        elif isinstance(nodo, list):
+            pendientes.extend(nodo)
+    return sorted(nombres)
+
+
+def medir_forma(collection, criterios, incluir_archivados):
+    consulta = construir_consulta(filtro_busqueda_avanzada(criterios),
+                                  incluir_archivados=incluir_archivados)
+    explain = (
+        collection.find(consulta)
+        .sort(ORDEN_LISTADO)
+        .limit(LIMITE_POR_DEFECTO + 1)
+        .explain()
+    )
+    estadisticas = explain.get('executionStats', {})
+    devueltos = estadisticas.get('nReturned', 0)
+    claves = estadisticas.get('totalKeysExamined', 0)
+    return {
+        'etapas': etapas_plan(explain),
+        'indices': indices_plan(explain),
+        'claves_examinadas': claves,
+        'documentos_examinados': estadisticas.get('totalDocsExamined', 0),
+        'documentos_devueltos': devueltos,
+        'claves_por_documento': round(claves / devueltos, 2) if devueltos else None,
+        'tiempo_ms': estadisticas.get('executionTimeMillis', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--total', type=int, default=500000)
+    parser.add_argument('--sin-poblar', action='store_true', help='Reutilizar datos existentes')
+    parser.add_argument('--salida', help='Fichero JSON donde guardar los resultados')
+    args = parser.parse_args()
+
+    collection = conectar_coleccion()
+    if not args.sin_poblar:
+        print(f"Insertando {args.total} ensayos sintéticos...")
+        poblar(collection, args.total)
+    collection.create_indexes(INDICES_ENSAYOS)
+
+    resultados = {}
+    regresiones = []
+    print(f"\n{'forma':<34} {'claves':>9} {'docs exam':>10} {'devueltos':>10} {'ms':>6}  índices")
+    for nombre, criterios in FORMAS_BUSQUEDA_AVANZADA.items():
+        for incluir_archivados in (False, True):
+            etiqueta = f"{nombre}{' +archivados' if incluir_archivados else ''}"
+            medida = medir_forma(collection, criterios, incluir_archivados)
+            resultados[etiqueta] = medida
+            if 'COLLSCAN' in medida['etapas']:
+                regresiones.append(etiqueta)
+            print(f"{etiqueta:<34} {medida['claves_examinadas']:>9} "
+                  f"{medida['documentos_examinados']:>10} {medida['documentos_devueltos']:>10} "
+                  f"{medida['tiempo_ms']:>6}  {', '.join(medida['indices']) or 'COLLSCAN'}")
+
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump({'total': collection.estimated_document_count(), 'formas': resultados}, f, indent=2)
+
+    if regresiones:
+        print(f"\nCOLLSCAN en: {', '.join(regresiones)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
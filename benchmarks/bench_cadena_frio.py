@@ -0,0 +1,71 @@
+"""
+Benchmark de ingesta de lecturas de temperatura (lecturas/s por proceso).
+
+Requiere un mongod local (ver datos_sinteticos.conectar_coleccion). Usa la
+misma base de benchmarks y recrea la colección time-series en cada pasada.
+
+Ejecutar con:
+    python -m benchmarks.bench_cadena_frio --total 200000 --por-peticion 500,5000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from app.services.cadena_frio import (
+    CadenaFrioService, COLECCION_LECTURAS, COLECCION_ROLLUPS, asegurar_colecciones_temperatura
+)
+from benchmarks.datos_sinteticos import conectar_coleccion
+
+UBICACIONES = [f'Cámara Frío {i}' for i in range(1, 9)]
+
+
+def generar_peticiones(total, por_peticion, semilla=42):
+    """Peticiones de ingesta: cada una trae un lote por ubicación, una lectura cada 10 s"""
+    rng = random.Random(semilla)
+    inicio = datetime(2024, 6, 1)
+    por_ubicacion = max(por_peticion // len(UBICACIONES), 1)
+    peticiones = []
+    generadas = 0
+    paso = 0
+    while generadas < total:
+        lotes = []
+        for ubicacion in UBICACIONES:
+            lecturas = [
+                [(inicio + timedelta(seconds=10 * (paso + i))).isoformat(), round(rng.gauss(5, 1.5), 2)]
+                for i in range(por_ubicacion)
+            ]
+            lotes.append({'ubicacion_almacen': ubicacion, 'sensor': 'bench', 'lecturas': lecturas})
+            generadas += por_ubicacion
+        peticiones.append(lotes)
+        paso += por_ubicacion
+    return peticiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--total', type=int, default=200000)
+    parser.add_argument('--por-peticion', default='500,5000', help='Lecturas por petición a comparar')
+    args = parser.parse_args()
+
+    mongo_db = conectar_coleccion(COLECCION_LECTURAS).database
+
+    for por_peticion in (int(x) for x in args.por_peticion.split(',')):
+        mongo_db.drop_collection(COLECCION_LECTURAS)
+        mongo_db.drop_collection(COLECCION_ROLLUPS)
+        asegurar_colecciones_temperatura(mongo_db)
+        peticiones = generar_peticiones(args.total, por_peticion)
+
+        inicio = time.perf_counter()
+        lecturas = buckets = 0
+        for lotes in peticiones:
+            resultado = CadenaFrioService.ingerir(mongo_db, lotes)
+            lecturas += resultado['lecturas']
+            buckets += resultado['buckets_actualizados']
+        duracion = time.perf_counter() - inicio
+
+        print(f"{por_peticion:>6} lecturas/petición: {lecturas:>8} lecturas  "
+              f"{lecturas / duracion:>9.0f} lecturas/s  {buckets} upserts de rollup")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark del listado de ensayos: consulta original vs proyección + keyset.
+
+Requiere un mongod local (ver datos_sinteticos.conectar_coleccion).
+
+Ejecutar con:
+    python -m benchmarks.bench_ensayos_listado --total 100000
+"""
+import argparse
+import time
+from flask import Flask
+from app.services.consultas_ensayos import paginar_ensayos
+from app.services.indices_ensayos import INDICES_ENSAYOS
+from app.services.json_bson import OPCIONES_RAW, ProveedorJSONBson
+from benchmarks.datos_sinteticos import conectar_coleccion, poblar
+
+
+PROVEEDOR_JSON = ProveedorJSONBson(Flask(__name__))
+
+
+def medir(nombre, funcion, repeticiones):
+    tiempos = []
+    tamano = 0
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        documentos = funcion()
+        payload = PROVEEDOR_JSON.dumps(documentos)
+        tiempos.append(time.perf_counter() - inicio)
+        tamano = len(payload.encode())
+    tiempos.sort()
+    print(f"{nombre:<38} {len(documentos):>7} docs  {tamano / 1024:>10.1f} KB  "
+          f"p50 {tiempos[len(tiempos) // 2] * 1000:>9.1f} ms  max {tiempos[-1] * 1000:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--total', type=int, default=100000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--sin-poblar', action='store_true', help='Reutilizar datos existentes')
+    args = parser.parse_args()
+
+    collection = conectar_coleccion()
+    if not args.sin_poblar:
+        print(f"Insertando {args.total} ensayos sintéticos...")
+        poblar(collection, args.total)
+        collection.create_indexes(INDICES_ENSAYOS)
+    # Igual que las rutas de lectura (coleccion_ensayos)
+    collection = collection.with_options(codec_options=OPCIONES_RAW)
+
+    print(f"\n{'consulta':<38} {'docs':>7}       {'payload':>10}")
+    medir('original: find() sin proyección',
+          lambda: list(collection.find({})), max(1, args.repeticiones // 5))
+    for fields in ('resumen', 'completo'):
+        for limite in (50, 200):
+            medir(f'{fields}, página de {limite}',
+                  lambda: paginar_ensayos(collection, {}, fields=fields, limite=limite)[0],
+                  args.repeticiones)
+
+    # Recorrer 10 páginas seguidas para comprobar que el coste no crece con el offset
+    def diez_paginas():
+        cursor = None
+        documentos = []
+        for _ in range(10):
+            pagina, cursor = paginar_ensayos(collection, {'fase': 3}, cursor=cursor, limite=50)
+            documentos.extend(pagina)
+        return documentos
+    medir('resumen, 10 páginas keyset (fase=3)', diez_paginas, args.repeticiones)
+
+
+if __name__ == '__main__':
+    main()
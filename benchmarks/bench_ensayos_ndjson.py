@@ -0,0 +1,65 @@
+"""
+Benchmark de importación y exportación NDJSON de ensayos (documentos/s).
+
+Requiere un mongod local (ver datos_sinteticos.conectar_coleccion).
+
+Ejecutar con:
+    python -m benchmarks.bench_ensayos_ndjson --total 50000
+"""
+import argparse
+import io
+import json
+import random
+import time
+from app.services.importacion_ensayos import importar_ndjson, exportar_ndjson
+from app.services.json_bson import OPCIONES_RAW, tipo_bson_a_json
+from benchmarks.datos_sinteticos import conectar_coleccion, generar_ensayo
+
+
+def generar_ndjson(total, semilla=42):
+    """Cuerpo NDJSON como lo enviaría un promotor (fechas ISO, sin _id ni efectos embebidos)"""
+    rng = random.Random(semilla)
+    lineas = []
+    for i in range(total):
+        ensayo = generar_ensayo(i, rng)
+        for campo in ('archivado', 'farmaco_search', 'metadata'):
+            ensayo.pop(campo)
+        # Los efectos adversos se registran aparte, en buckets
+        ensayo['resultados_intermedios'].pop('efectos_secundarios_frecuentes')
+        lineas.append(json.dumps(ensayo, default=tipo_bson_a_json))
+    return ('\n'.join(lineas) + '\n').encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--total', type=int, default=50000)
+    parser.add_argument('--lotes', default='100,1000,5000', help='Tamaños de lote a comparar')
+    args = parser.parse_args()
+
+    collection = conectar_coleccion('ensayos_ndjson')
+    cuerpo = generar_ndjson(args.total)
+    print(f"NDJSON: {args.total} ensayos, {len(cuerpo) / 1024 / 1024:.1f} MB\n")
+
+    for lote in (int(x) for x in args.lotes.split(',')):
+        collection.drop()
+        inicio = time.perf_counter()
+        resultado = importar_ndjson(collection, io.BytesIO(cuerpo), 'benchmark', lote=lote)
+        duracion = time.perf_counter() - inicio
+        print(f"importar lote {lote:>5}: {resultado['insertados']:>7} docs  "
+              f"{resultado['insertados'] / duracion:>9.0f} docs/s  errores {resultado['total_errores']}")
+
+    lectura = collection.with_options(codec_options=OPCIONES_RAW)
+    for lote in (100, 1000):
+        inicio = time.perf_counter()
+        documentos = 0
+        tamano = 0
+        for linea in exportar_ndjson(lectura, incluir_archivados=True, lote=lote):
+            documentos += 1
+            tamano += len(linea)
+        duracion = time.perf_counter() - inicio
+        print(f"exportar lote {lote:>5}: {documentos:>7} docs  {documentos / duracion:>9.0f} docs/s  "
+              f"{tamano / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
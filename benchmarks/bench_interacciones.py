@@ -0,0 +1,101 @@
+"""
+Verificación de interacciones: instantánea en memoria (CSR) frente a la
+consulta Cypher de verificar-interacciones, para prescripciones de 2 a 30
+medicamentos. Informa p50/p99 en microsegundos.
+
+Con --sintetico no necesita Neo4j: genera un grafo aleatorio y mide solo
+la instantánea. Sin él, carga el grafo de NEO4J_URI y mide ambas rutas.
+
+Ejecutar con:
+    python -m benchmarks.bench_interacciones --tamanos 2,5,10,20,30
+    python -m benchmarks.bench_interacciones --sintetico 50000 --grado 12
+"""
+import argparse
+import os
+import random
+import time
+import numpy as np
+from app.services.grafo_interacciones import (
+    GrafoInteraccionesService, InstantaneaInteracciones, SEVERIDADES
+)
+
+
+def grafo_sintetico(medicamentos, grado, semilla=42):
+    rng = random.Random(semilla)
+    ids = [f'MED{i:06d}' for i in range(medicamentos)]
+    interacciones = [
+        (rng.choice(ids), rng.choice(ids), rng.choice(SEVERIDADES), 'descripcion', 'recomendaciones')
+        for _ in range(medicamentos * grado // 2)
+    ]
+    return InstantaneaInteracciones(0, [(i, i) for i in ids], interacciones)
+
+
+def percentiles(tiempos):
+    micros = np.array(tiempos) * 1e6
+    return np.percentile(micros, 50), np.percentile(micros, 99)
+
+
+def medir(funcion, prescripciones):
+    tiempos = []
+    filas = 0
+    for prescripcion in prescripciones:
+        inicio = time.perf_counter()
+        filas += len(funcion(prescripcion))
+        tiempos.append(time.perf_counter() - inicio)
+    return percentiles(tiempos), filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tamanos', default='2,5,10,20,30', help='Medicamentos por prescripción')
+    parser.add_argument('--repeticiones', type=int, default=500)
+    parser.add_argument('--sintetico', type=int, metavar='MEDICAMENTOS',
+                        help='Grafo aleatorio de N medicamentos en lugar de Neo4j')
+    parser.add_argument('--grado', type=int, default=12, help='Interacciones medias por medicamento (sintético)')
+    args = parser.parse_args()
+
+    driver = None
+    if args.sintetico:
+        instantanea = grafo_sintetico(args.sintetico, args.grado)
+    else:
+        from neo4j import GraphDatabase
+        driver = GraphDatabase.driver(
+            os.getenv('NEO4J_URI', 'bolt://localhost:7687'),
+            auth=(os.getenv('NEO4J_USER', 'neo4j'), os.getenv('NEO4J_PASSWORD', 'neo4jpass123'))
+        )
+        inicio = time.perf_counter()
+        instantanea = GrafoInteraccionesService.cargar(driver, version=0)
+        print(f"Carga de la instantánea: {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+    memoria = (instantanea.inicio.nbytes + instantanea.vecinos.nbytes
+               + instantanea.aristas.nbytes + instantanea.severidad.nbytes)
+    print(f"{len(instantanea.ids)} medicamentos, {instantanea.total_interacciones} interacciones, "
+          f"arrays CSR {memoria / 1024:.0f} KB\n")
+
+    rng = random.Random(7)
+    print(f"{'tamaño':>6} {'memoria p50':>12} {'p99':>9} {'neo4j p50':>11} {'p99':>9} {'filas':>7}")
+    for tamano in (int(x) for x in args.tamanos.split(',')):
+        tamano = min(tamano, len(instantanea.ids))
+        prescripciones = [rng.sample(instantanea.ids, tamano) for _ in range(args.repeticiones)]
+
+        (p50, p99), filas = medir(instantanea.verificar, prescripciones)
+        linea = f"{tamano:>6} {p50:>10.1f}µs {p99:>7.1f}µs"
+
+        if driver is not None:
+            (c50, c99), filas_cypher = medir(
+                lambda p: GrafoInteraccionesService.verificar_cypher(driver, p), prescripciones
+            )
+            if filas_cypher != filas:
+                raise SystemExit(f"Resultados distintos con {tamano} medicamentos: {filas} != {filas_cypher}")
+            linea += f" {c50:>9.1f}µs {c99:>7.1f}µs"
+        else:
+            linea += f" {'-':>11} {'-':>9}"
+
+        print(f"{linea} {filas:>7}")
+
+    if driver is not None:
+        driver.close()
+
+
+if __name__ == '__main__':
+    main()
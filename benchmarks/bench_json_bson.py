@@ -0,0 +1,85 @@
+"""
+Microbenchmark de serialización de ensayos a JSON: serialize_mongo_doc
+(recorrido recursivo en Python) frente a RawBSONDocument + ProveedorJSONBson.
+
+Ambos caminos parten de los bytes BSON que entrega el cursor, así el coste
+de decodificar entra en la medida. No necesita mongod.
+
+Ejecutar con:
+    python -m benchmarks.bench_json_bson
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+import bson
+from bson.raw_bson import RawBSONDocument
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from app.services.json_bson import ProveedorJSONBson
+from benchmarks.datos_sinteticos import generar_ensayo
+
+TAMANOS = {'1 KB': 1024, '50 KB': 50 * 1024, '1 MB': 1024 * 1024}
+
+
+def serialize_mongo_doc(doc):
+    """Versión anterior de app/routes/ensayos.py, como referencia"""
+    if doc:
+        if '_id' in doc:
+            doc['_id'] = str(doc['_id'])
+        # Convertir fechas a ISO format
+        for key, value in doc.items():
+            if isinstance(value, datetime):
+                doc[key] = value.isoformat()
+            elif isinstance(value, list):
+                doc[key] = [serialize_mongo_doc(item) if isinstance(item, dict) else item for item in value]
+            elif isinstance(value, dict):
+                doc[key] = serialize_mongo_doc(value)
+    return doc
+
+
+def documento_bson(objetivo, rng):
+    """BSON de un ensayo sintético de aproximadamente `objetivo` bytes"""
+    base = len(bson.encode(generar_ensayo(0, rng, num_centros=0)))
+    por_centro = (len(bson.encode(generar_ensayo(0, rng, num_centros=100))) - base) / 100
+    num_centros = max(0, round((objetivo - base) / por_centro))
+    documento = generar_ensayo(0, rng, num_centros=num_centros)
+    documento['_id'] = bson.ObjectId()
+    return bson.encode(documento)
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeticiones', type=int, default=50)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    original = DefaultJSONProvider(app)
+    nuevo = ProveedorJSONBson(app)
+    rng = random.Random(42)
+
+    print(f"{'documento':<10} {'bytes':>9} {'original p50':>14} {'raw p50':>11} {'mejora':>8}")
+    for etiqueta, objetivo in TAMANOS.items():
+        raw = documento_bson(objetivo, rng)
+        # Menos repeticiones para el documento grande
+        repeticiones = args.repeticiones if len(raw) < 512 * 1024 else max(5, args.repeticiones // 5)
+
+        t_original = medir(lambda: original.dumps(serialize_mongo_doc(bson.decode(raw))), repeticiones)
+        t_nuevo = medir(lambda: nuevo.dumps(RawBSONDocument(raw)), repeticiones)
+
+        print(f"{etiqueta:<10} {len(raw):>9} {t_original * 1000:>11.3f} ms "
+              f"{t_nuevo * 1000:>8.3f} ms {t_original / t_nuevo:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
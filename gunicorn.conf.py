@@ -0,0 +1,48 @@
+"""
+Configuración de Gunicorn para PharmaFlow (ver wsgi.py).
+
+Todos los valores se pueden sobrescribir con variables de entorno.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Workers preforked con hilos: cada worker crea sus propios clientes de
+# backend tras el fork (ver app._reiniciar_tras_fork)
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Cargar la app una vez en el master y compartir memoria con los workers.
+# Desactivado por defecto: solo es seguro si nada crea clientes de backend
+# en el master (se crean de forma perezosa; ver pre_fork)
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Reciclar workers periódicamente para acotar fugas de memoria
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOGLEVEL', 'info')
+
+
+def pre_fork(server, worker):
+    """Con preload_app, avisa si el master ya creó clientes de backend"""
+    if not server.cfg.preload_app:
+        return
+    import app
+
+    creados = [nombre for nombre, cliente in (('mongodb', app.mongo_client),
+                                              ('redis', app.redis_client),
+                                              ('redis_cribado', app.redis_cribado),
+                                              ('neo4j', app.neo4j_driver))
+               if cliente is not None]
+    if creados:
+        server.log.warning('Clientes creados en el master antes del fork: %s '
+                           '(los workers los recrean)', ', '.join(creados))
@@ -7,7 +7,33 @@ db.createCollection("ensayos_clinicos");
 db.ensayos_clinicos.createIndex({ "farmaco": 1 });
 db.ensayos_clinicos.createIndex({ "fase": 1 });
 db.ensayos_clinicos.createIndex({ "fecha_inicio": 1 });
-db.ensayos_clinicos.createIndex({ "estado": 1 });
+
+// Búsqueda avanzada (igualdad, orden, rango); estado queda cubierto por busqueda_estado_fase
+db.ensayos_clinicos.createIndex(
+    { "estado": 1, "fase": 1, "fecha_inicio": -1, "_id": -1 },
+    { name: "busqueda_estado_fase" }
+);
+db.ensayos_clinicos.createIndex(
+    {
+        "criterios_inclusion.condiciones_medicas": 1, "fase": 1,
+        "criterios_inclusion.edad_minima": 1, "criterios_inclusion.edad_maxima": 1
+    },
+    { name: "busqueda_condiciones" }
+);
+db.ensayos_clinicos.createIndex(
+    { "criterios_inclusion.edad_minima": 1, "criterios_inclusion.edad_maxima": 1, "fase": 1 },
+    { name: "busqueda_edad" }
+);
+
+// Reclutamiento por ciudad / investigador (multikey sobre centros_participantes)
+db.ensayos_clinicos.createIndex(
+    { "centros_participantes.ciudad": 1, "centros_participantes.investigador_principal": 1 },
+    { name: "centros_ciudad_investigador" }
+);
+db.ensayos_clinicos.createIndex(
+    { "centros_participantes.investigador_principal": 1 },
+    { name: "centros_investigador" }
+);
 
 // Insertar datos de ejemplo de ensayos clínicos
 db.ensayos_clinicos.insertMany([
@@ -132,6 +158,53 @@ db.ensayos_clinicos.insertMany([
     }
 ]);
 
+// Flag de archivado usado por el índice parcial de listados
+db.ensayos_clinicos.updateMany(
+    { archivado: { $exists: false } },
+    [{ $set: { archivado: { $eq: ["$estado", "archivado"] } } }]
+);
+
+// Nombre de fármaco normalizado (minúsculas, sin acentos) para búsqueda por prefijo
+db.ensayos_clinicos.find({ farmaco_search: { $exists: false } }).forEach(function (e) {
+    var normalizado = (e.farmaco || "").normalize("NFKD").replace(/[\u0300-\u036f]/g, "")
+        .toLowerCase().split(/\s+/).filter(function (p) { return p; }).join(" ");
+    db.ensayos_clinicos.updateOne({ _id: e._id }, { $set: { farmaco_search: normalizado } });
+});
+db.ensayos_clinicos.createIndex({ "farmaco_search": 1 });
+
+// Búsqueda de texto libre
+db.ensayos_clinicos.createIndex(
+    { farmaco: "text", principio_activo: "text", objetivo_principal: "text" },
+    {
+        name: "busqueda_texto",
+        default_language: "spanish",
+        weights: { farmaco: 10, principio_activo: 5, objetivo_principal: 1 }
+    }
+);
+
+// Listado paginado (keyset sobre fecha_inicio, _id) solo de ensayos activos
+db.ensayos_clinicos.createIndex(
+    { "fecha_inicio": -1, "_id": -1 },
+    { name: "listado_activos", partialFilterExpression: { archivado: false } }
+);
+
+// Efectos adversos en buckets por ensayo y mes (flask init-db migra los
+// efectos_secundarios_frecuentes embebidos en los ensayos)
+db.createCollection("efectos_adversos");
+db.efectos_adversos.createIndex({ "ensayo_id": 1, "mes": 1, "n": 1 }, { name: "bucket_abierto" });
+db.efectos_adversos.createIndex({ "principio_activo": 1, "mes": 1 }, { name: "ranking_compuesto" });
+
+// Cadena de frío: lecturas de sensores por ubicación de almacén (time-series)
+// y rollups de 5 minutos / 1 hora que mantiene la ingesta
+db.createCollection("lecturas_temperatura", {
+    timeseries: { timeField: "ts", metaField: "meta", granularity: "minutes" },
+    expireAfterSeconds: 34560000 // 400 días
+});
+db.temperatura_rollups.createIndex(
+    { "ubicacion": 1, "granularidad": 1, "inicio": 1 },
+    { name: "ubicacion_granularidad_inicio", unique: true }
+);
+
 // Crear colección para cache de informes
 db.createCollection("cache_informes");
 
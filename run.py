@@ -8,9 +8,9 @@ config_name = os.getenv('FLASK_ENV', 'development')
 app = create_app(config_name)
 
 if __name__ == '__main__':
-    # Configuración para desarrollo
+    # Servidor de desarrollo (en producción usar: gunicorn -c gunicorn.conf.py wsgi:app)
     app.run(
         host='0.0.0.0',
         port=5000,
-        debug=True
+        debug=app.config['DEBUG']
     )
\ No newline at end of file
@@ -35,7 +35,8 @@ CREATE TABLE productos (
     precio_base DECIMAL(10,2) NOT NULL,
     temperatura_almacenamiento DECIMAL(3,1),
     requiere_refrigeracion BOOLEAN DEFAULT FALSE,
-    activo BOOLEAN DEFAULT TRUE
+    activo BOOLEAN DEFAULT TRUE,
+    medicamento_id VARCHAR(50) -- id del nodo Medicamento en Neo4j
 );
 
 -- Tabla de lotes (con control de concurrencia)
@@ -83,6 +84,20 @@ CREATE TABLE interacciones_medicamentosas (
     FOREIGN KEY (medicamento_b_id) REFERENCES productos(id)
 );
 
+-- Outbox de cambios de interacciones hacia Neo4j (sin claves foráneas:
+-- conserva los borrados). El id es el watermark del consumidor
+CREATE TABLE outbox_interacciones (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    interaccion_id INT NOT NULL,
+    operacion ENUM('upsert', 'borrar') NOT NULL,
+    producto_a_id INT NOT NULL,
+    producto_b_id INT NOT NULL,
+    severidad VARCHAR(20),
+    descripcion TEXT,
+    recomendaciones TEXT,
+    fecha DATETIME NOT NULL
+);
+
 -- Índices para optimización
 CREATE INDEX idx_lotes_producto ON lotes(producto_id);
 CREATE INDEX idx_lotes_caducidad ON lotes(fecha_caducidad);
@@ -91,4 +106,36 @@ CREATE INDEX idx_transacciones_fecha ON transacciones(fecha_transaccion);
 CREATE INDEX idx_transacciones_lote ON transacciones(lote_id);
 CREATE INDEX idx_transacciones_usuario ON transacciones(usuario_id);
 CREATE INDEX idx_productos_codigo ON productos(codigo_barras);
-CREATE INDEX idx_productos_activo ON productos(activo);
\ No newline at end of file
+CREATE INDEX idx_productos_activo ON productos(activo);
+CREATE INDEX idx_productos_medicamento ON productos(medicamento_id);
+CREATE INDEX idx_outbox_interacciones_fecha ON outbox_interacciones(fecha);
+
+-- Rollups diarios de ventas (mantenidos en la misma transacción que la venta)
+CREATE TABLE ventas_diarias (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    producto_id INT NOT NULL,
+    fecha DATE NOT NULL,
+    unidades INT NOT NULL DEFAULT 0,
+    ingresos DECIMAL(14,2) NOT NULL DEFAULT 0,
+    num_ventas INT NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_ventas_diarias_producto_fecha (producto_id, fecha),
+    FOREIGN KEY (producto_id) REFERENCES productos(id)
+);
+
+CREATE TABLE ventas_diarias_detalle (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    fecha DATE NOT NULL,
+    producto_id INT NOT NULL,
+    lote_id INT NOT NULL,
+    usuario_id INT NOT NULL,
+    unidades INT NOT NULL DEFAULT 0,
+    ingresos DECIMAL(14,2) NOT NULL DEFAULT 0,
+    num_ventas INT NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_ventas_detalle_fecha_lote_usuario (fecha, lote_id, usuario_id),
+    FOREIGN KEY (producto_id) REFERENCES productos(id),
+    FOREIGN KEY (lote_id) REFERENCES lotes(id),
+    FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
+);
+
+CREATE INDEX idx_ventas_diarias_fecha ON ventas_diarias(fecha);
+CREATE INDEX idx_ventas_detalle_usuario_fecha ON ventas_diarias_detalle(usuario_id, fecha);
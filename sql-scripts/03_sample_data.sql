@@ -13,11 +13,11 @@ INSERT INTO proveedores (nombre, contacto, telefono, email) VALUES
 ('BioPharm Inc', 'Carlos López', '+34 914 567 890', 'carlos@biopharm.com');
 
 -- Insertar productos
-INSERT INTO productos (codigo_barras, nombre, descripcion, principio_activo, tipo_medicamento, precio_base, temperatura_almacenamiento, requiere_refrigeracion) VALUES
-('8437001234567', 'Paracetamol 500mg', 'Analgésico y antipirético', 'Paracetamol', 'generico', 5.50, 25.0, FALSE),
-('8437001234568', 'Ibuprofeno 600mg', 'Antiinflamatorio no esteroideo', 'Ibuprofeno', 'generico', 7.25, 25.0, FALSE),
-('8437001234569', 'Amoxicilina 500mg', 'Antibiótico de amplio espectro', 'Amoxicilina', 'patentado', 12.80, 15.0, TRUE),
-('8437001234570', 'Insulina Lantus', 'Análogo de insulina de acción prolongada', 'Insulina glargina', 'controlado', 45.90, 8.0, TRUE);
+INSERT INTO productos (codigo_barras, nombre, descripcion, principio_activo, tipo_medicamento, precio_base, temperatura_almacenamiento, requiere_refrigeracion, medicamento_id) VALUES
+('8437001234567', 'Paracetamol 500mg', 'Analgésico y antipirético', 'Paracetamol', 'generico', 5.50, 25.0, FALSE, 'MED001'),
+('8437001234568', 'Ibuprofeno 600mg', 'Antiinflamatorio no esteroideo', 'Ibuprofeno', 'generico', 7.25, 25.0, FALSE, 'MED002'),
+('8437001234569', 'Amoxicilina 500mg', 'Antibiótico de amplio espectro', 'Amoxicilina', 'patentado', 12.80, 15.0, TRUE, 'MED003'),
+('8437001234570', 'Insulina Lantus', 'Análogo de insulina de acción prolongada', 'Insulina glargina', 'controlado', 45.90, 8.0, TRUE, NULL);
 
 -- Insertar lotes
 INSERT INTO lotes (producto_id, numero_lote, cantidad_inicial, cantidad_actual, fecha_fabricacion, fecha_caducidad, precio_compra, precio_venta, proveedor_id, ubicacion_almacen) VALUES
@@ -2,10 +2,46 @@
 Tests automatizados para PharmaFlow API
 Ejecutar con: pytest tests/test_api.py -v
 """
+import os
+import subprocess
+import sys
 import pytest
 import json
+import time
+import uuid
+import numpy as np
+from datetime import date, datetime, timedelta
+from flask import g
+from pymongo.errors import BulkWriteError
+from sqlalchemy import event, insert, select
+from sqlalchemy.exc import OperationalError
 from app import create_app, db
+from app.config import TestingConfig
 from app.models.mysql_models import Usuario, Producto, Lote
+from app.services.consultas_ensayos import (
+    ORDEN_LISTADO, construir_consulta, filtro_prefijo_farmaco,
+    filtro_texto_libre, filtro_busqueda_avanzada, etapas_plan, usa_indice
+)
+from app.services.indices_ensayos import asegurar_indices_ensayos, FORMAS_BUSQUEDA_AVANZADA
+from app.services.grafo_interacciones import (
+    GrafoInteraccionesService, InstantaneaInteracciones, resumir_interacciones
+)
+from app.services.consultas_grafo import (
+    CONSULTAS, ConsultaCypher, _ejecutar_en_sesion, ejecutar_consulta, ejecutar_consultas,
+    metricas_consultas, validar_consultas
+)
+from app.services.estadisticas_grafo import consulta_conteos
+from app.services.inferencia_interacciones import agregar_por_clase
+from app.services.sustitucion import rasgos_medicamento, similares
+from app.services.carga_grafo import ENTIDADES, preparar_fila
+from app.services.importacion_ensayos import preparar_ensayo
+from app.services.reabastecimiento import ReabastecimientoService, calcular_reorden
+from app.services.metricas_pools import MetricasPool, instrumentar_driver_neo4j
+from app.services.sincronizacion_interacciones import compactar_eventos, eventos_contiguos
+from app.services.cribado_ventas import CribadoVentasService, interacciones_nuevas
+from app.services.cadena_frio import (
+    CadenaFrioService, COLECCION_LECTURAS, COLECCION_ROLLUPS, MAXIMO_LECTURAS_POR_PETICION
+)
 
 
 @pytest.fixture
@@ -43,6 +79,21 @@ def auth_token(client):
     return data['access_token']
 
 
+def token_con_rol(client, rol):
+    """Registra un usuario con el rol indicado y devuelve su token"""
+    client.post('/api/auth/register', json={
+        'username': f'{rol}_test',
+        'email': f'{rol}@test.com',
+        'password': 'password123',
+        'rol': rol
+    })
+    response = client.post('/api/auth/login', json={
+        'username': f'{rol}_test',
+        'password': 'password123'
+    })
+    return json.loads(response.data)['access_token']
+
+
 # ============================================
 # TESTS DE AUTENTICACIÓN
 # ============================================
@@ -296,6 +347,1357 @@ def test_concurrencia_inventario_insuficiente(client, auth_token):
     assert 'insuficiente' in data['error'].lower()
 
 
+# ============================================
+# TESTS DE REPORTES DE VENTAS
+# ============================================
+
+def test_venta_actualiza_rollup_diario(client, auth_token):
+    """Test: Una venta se acumula en ventas_diarias y aparece en el top"""
+    prod_response = client.post('/api/inventario/productos',
+        headers={'Authorization': f'Bearer {auth_token}'},
+        json={
+            'codigo_barras': 'ROLLUP001',
+            'nombre': 'Producto Rollup',
+            'tipo_medicamento': 'generico',
+            'precio_base': 15.00
+        }
+    )
+    producto_id = json.loads(prod_response.data)['producto']['id']
+    
+    lote_response = client.post('/api/inventario/lotes',
+        headers={'Authorization': f'Bearer {auth_token}'},
+        json={
+            'producto_id': producto_id,
+            'numero_lote': 'LOTE-ROLLUP-001',
+            'cantidad_inicial': 100,
+            'fecha_fabricacion': '2024-01-01',
+            'fecha_caducidad': '2026-01-01',
+            'precio_compra': 10.00,
+            'precio_venta': 15.00
+        }
+    )
+    lote_id = json.loads(lote_response.data)['lote']['id']
+    
+    # Dos ventas del mismo día se acumulan en la misma fila
+    for version, cantidad in ((0, 10), (1, 5)):
+        client.post('/api/inventario/transacciones/venta',
+            headers={'Authorization': f'Bearer {auth_token}'},
+            json={'lote_id': lote_id, 'cantidad': cantidad, 'version': version}
+        )
+    
+    response = client.get('/api/inventario/reportes/ventas/top-productos',
+        headers={'Authorization': f'Bearer {auth_token}'}
+    )
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    producto = next(p for p in data['productos'] if p['producto_id'] == producto_id)
+    assert producto['unidades'] == 15
+    assert producto['ingresos'] == 225.0
+
+
+def test_calcular_reorden_punto_de_reorden_y_stock_de_seguridad():
+    """Test: Punto de reorden = demanda * entrega + z * desviación * sqrt(entrega)"""
+    ventas = np.array([[10.0] * 28, [0.0, 20.0] * 14])
+    stock = np.array([50.0, 0.0])
+    
+    resultado = calcular_reorden(ventas, stock, dias_entrega=4, dias_revision=7, nivel_servicio=0.95)
+    
+    z = 1.6448536269514722
+    assert resultado['demanda_diaria'].tolist() == [10.0, 10.0]
+    assert resultado['stock_seguridad'] == pytest.approx([0.0, z * 10 * 2])
+    assert resultado['punto_reorden'] == pytest.approx([40.0, 40.0 + z * 10 * 2])
+    assert resultado['dias_cobertura'].tolist() == [5.0, 0.0]
+    assert resultado['requiere_reorden'].tolist() == [False, True]
+    # Objetivo = punto de reorden + demanda del periodo de revisión - stock
+    assert resultado['cantidad_sugerida'].tolist() == [60.0, np.ceil(110 + z * 20)]
+
+
+def test_calcular_reorden_rechaza_dias_de_entrega_negativos():
+    """Test: Un lead time negativo es un ValueError explícito, no un fallo de math.sqrt"""
+    with pytest.raises(ValueError, match='dias_entrega no puede ser negativo'):
+        calcular_reorden(np.ones((1, 7)), np.zeros(1), dias_entrega=-1)
+
+
+def test_calcular_reorden_50k_productos_en_menos_de_un_segundo():
+    """Test: Todo el catálogo (50k productos x 90 días) se calcula sin bucles por producto"""
+    ventas = np.random.default_rng(0).poisson(3, size=(50000, 90)).astype(np.float64)
+    stock = np.full(50000, 40.0)
+    
+    for metodo in ('media_movil', 'suavizado'):
+        inicio = time.perf_counter()
+        resultado = calcular_reorden(ventas, stock, metodo=metodo)
+        assert time.perf_counter() - inicio < 1.0
+        assert resultado['punto_reorden'].shape == (50000,)
+
+
+def test_reporte_reabastecimiento_sin_cache_si_redis_falla(client):
+    """Test: Un RedisError al leer o escribir la cache no rompe el reporte, se calcula sin ella"""
+    from redis.exceptions import ConnectionError as RedisConnectionError
+
+    class RedisCaido:
+        def get(self, clave):
+            raise RedisConnectionError('Redis no disponible')
+
+        def setex(self, clave, ttl, valor):
+            raise RedisConnectionError('Redis no disponible')
+
+    reporte = ReabastecimientoService.generar_reporte(redis_client=RedisCaido(), dias_historia=7)
+    assert reporte['cache'] is False
+    assert reporte['productos'] == []
+
+
+# ============================================
+# TESTS DE CADENA DE FRÍO
+# ============================================
+
+def test_excursion_de_temperatura_marca_lote(client, auth_token):
+    """Test: Lecturas por encima del máximo del producto marcan el lote almacenado en esa ubicación"""
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    prod_response = client.post('/api/inventario/productos', headers=headers, json={
+        'codigo_barras': 'FRIO001',
+        'nombre': 'Producto Refrigerado',
+        'tipo_medicamento': 'patentado',
+        'precio_base': 40.00,
+        'temperatura_almacenamiento': 8.0,
+        'requiere_refrigeracion': True
+    })
+    producto_id = json.loads(prod_response.data)['producto']['id']
+    
+    lote_response = client.post('/api/inventario/lotes', headers=headers, json={
+        'producto_id': producto_id,
+        'numero_lote': 'LOTE-FRIO-001',
+        'cantidad_inicial': 50,
+        'fecha_fabricacion': '2024-01-01',
+        'fecha_caducidad': '2027-01-01',
+        'precio_compra': 30.00,
+        'precio_venta': 40.00,
+        'ubicacion_almacen': 'Cámara Test Excursión'
+    })
+    lote_id = json.loads(lote_response.data)['lote']['id']
+    
+    # 15 minutos a 11 °C entre lecturas normales (una por minuto)
+    inicio = datetime.combine(date.today(), datetime.min.time())
+    lecturas = [[(inicio + timedelta(minutes=m)).isoformat(), 11.0 if 10 <= m < 25 else 5.0]
+                for m in range(40)]
+    response = client.post('/api/inventario/cadena-frio/lecturas', headers=headers, json={
+        'lotes': [{'ubicacion_almacen': 'Cámara Test Excursión', 'sensor': 't1', 'lecturas': lecturas}]
+    })
+    assert response.status_code == 201
+    assert json.loads(response.data)['lecturas'] == 40
+    
+    response = client.get('/api/inventario/cadena-frio/excursiones?ubicacion=Cámara Test Excursión',
+                          headers=headers)
+    assert response.status_code == 200
+    lote = next(l for l in json.loads(response.data)['lotes'] if l['lote_id'] == lote_id)
+    assert lote['rango_objetivo'] == {'min': 2.0, 'max': 8.0}
+    assert lote['minutos_fuera_de_rango'] == 15
+    assert lote['excursiones'][0]['temperatura_max'] == 11.0
+
+
+def test_ingesta_de_temperatura_rechaza_peticiones_enormes_antes_de_normalizar():
+    """Test: El límite de lecturas se comprueba antes de recorrer las lecturas"""
+    lote = {'ubicacion_almacen': 'Cámara Test', 'lecturas': [None] * (MAXIMO_LECTURAS_POR_PETICION + 1)}
+    with pytest.raises(ValueError, match='Máximo'):
+        CadenaFrioService.ingerir(None, [lote])
+
+
+def test_rollups_de_temperatura_solo_cuentan_lecturas_insertadas():
+    """Test: Si el servidor rechaza parte de un insert_many, los rollups no incluyen esas lecturas"""
+    class Lecturas:
+        def insert_many(self, documentos, ordered):
+            assert ordered is False
+            raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 121, 'errmsg': 'validación'}],
+                                  'nInserted': len(documentos) - 1})
+    
+    class Rollups:
+        def bulk_write(self, operaciones, ordered):
+            self.operaciones = operaciones
+    
+    mongo_db = {COLECCION_LECTURAS: Lecturas(), COLECCION_ROLLUPS: Rollups()}
+    resultado = CadenaFrioService.ingerir(mongo_db, [{
+        'ubicacion_almacen': 'Cámara Test',
+        'lecturas': [['2024-06-01T10:00:00Z', 4.0], ['2024-06-01T10:01:00Z', 30.0],
+                     ['2024-06-01T10:02:00Z', 6.0]]
+    }])
+    
+    assert resultado['lecturas'] == 2
+    assert resultado['rechazadas'] == 1
+    cambios = [op._doc for op in mongo_db[COLECCION_ROLLUPS].operaciones]
+    assert len(cambios) == 2
+    for cambio in cambios:
+        assert cambio['$inc'] == {'n': 2, 'suma': 10.0}
+        assert cambio['$max'] == {'max': 6.0}
+
+
+# ============================================
+# TESTS DE RÉPLICAS DE LECTURA
+# ============================================
+
+def test_escrituras_nunca_van_a_replica(monkeypatch, tmp_path):
+    """Test: Con lectura en réplica activa, las escrituras siguen en el primario"""
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_BINDS', {
+        'replica_0': f"sqlite:///{tmp_path / 'replica.db'}"
+    })
+    app = create_app('testing')
+    
+    sentencias_replica = []
+    with app.app_context():
+        replica = db.engines['replica_0']
+        event.listen(replica, 'before_cursor_execute',
+                     lambda conn, cursor, sentencia, *args: sentencias_replica.append(sentencia))
+    
+    with app.test_request_context('/api/inventario/productos', method='GET'):
+        g.lectura_en_replica = True
+        
+        # Las lecturas se enrutan a la réplica...
+        assert db.session.get_bind(clause=select(Producto)) is replica
+        # ...pero INSERT/UPDATE/DELETE y SELECT FOR UPDATE no
+        assert db.session.get_bind(clause=insert(Producto)) is db.engine
+        assert db.session.get_bind(clause=select(Producto).with_for_update()) is db.engine
+        
+        producto = Producto(
+            codigo_barras='REPLICA001',
+            nombre='Producto Replica',
+            tipo_medicamento='generico',
+            precio_base=10.00
+        )
+        db.session.add(producto)
+        db.session.commit()
+        
+        db.session.delete(producto)
+        db.session.commit()
+        db.session.remove()
+    
+    assert sentencias_replica == []
+
+
+# ============================================
+# TESTS DE ÍNDICES DE ENSAYOS (MongoDB)
+# ============================================
+
+def test_paginacion_de_ensayos_sin_huecos_ni_duplicados(client, auth_token):
+    """Test: Con fechas repetidas y ausentes cada ensayo sale una vez; un PUT no guarda fechas como texto"""
+    from app import get_mongo_db
+    
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    farmaco = f'TestPagina{uuid.uuid4().hex[:8]}'
+    fechas = ['2024-05-01T00:00:00Z'] * 3 + ['2024-03-01T00:00:00Z', None, None, 'sin_fecha']
+    
+    try:
+        creados = []
+        for i, fecha in enumerate(fechas):
+            ensayo = {'codigo_ensayo': f'{farmaco}-{i}', 'farmaco': farmaco, 'fase': 1, 'estado': 'en_curso'}
+            if fecha != 'sin_fecha':
+                ensayo['fecha_inicio'] = fecha
+            response = client.post('/api/ensayos/', headers=headers, json=ensayo)
+            assert response.status_code == 201
+            creados.append(json.loads(response.data)['ensayo']['_id'])
+        
+        def recorrer():
+            vistos, cursor = [], None
+            while True:
+                url = f'/api/ensayos/?farmaco={farmaco}&limite=2' + (f'&cursor={cursor}' if cursor else '')
+                data = json.loads(client.get(url, headers=headers).data)
+                vistos += [e['_id'] for e in data['ensayos']]
+                cursor = data['siguiente_cursor']
+                if not cursor:
+                    return vistos
+        
+        vistos = recorrer()
+        assert len(vistos) == len(set(vistos)) == len(creados)
+        assert set(vistos) == set(creados)
+        assert set(vistos[:3]) == set(creados[:3])
+        
+        for fecha in ('mayo de 2024', 20240501):
+            response = client.put(f'/api/ensayos/{creados[4]}', headers=headers, json={'fecha_inicio': fecha})
+            assert response.status_code == 400
+        
+        response = client.put(f'/api/ensayos/{creados[4]}', headers=headers,
+                              json={'fecha_inicio': '2024-06-01T00:00:00Z'})
+        assert response.status_code == 200
+        vistos = recorrer()
+        assert vistos[0] == creados[4]
+        assert sorted(vistos) == sorted(creados)
+    finally:
+        get_mongo_db().ensayos_clinicos.delete_many({'farmaco': farmaco})
+
+
+def test_busquedas_de_ensayos_usan_indices(client):
+    """Test: Las búsquedas por fármaco y texto libre nunca hacen COLLSCAN"""
+    from app import get_mongo_db
+    
+    mongo_db = get_mongo_db()
+    asegurar_indices_ensayos(mongo_db)
+    collection = mongo_db.ensayos_clinicos
+    
+    filtros = [
+        filtro_prefijo_farmaco('Innova'),
+        filtro_prefijo_farmaco('ÁCIDO (fólico)*.+'),  # Metacaracteres escapados
+        filtro_texto_libre('colesterol'),
+        filtro_texto_libre('"reducción" -ldl'),
+    ]
+    
+    for filtro in filtros:
+        for incluir_archivados in (False, True):
+            consulta = construir_consulta(filtro, incluir_archivados=incluir_archivados)
+            explain = collection.find(consulta).sort(ORDEN_LISTADO).explain()
+            assert usa_indice(explain), (consulta, etapas_plan(explain))
+
+
+def test_proveedor_json_serializa_documentos_bson(client):
+    """Test: RawBSONDocument con ObjectId, fechas anidadas en listas de listas y Decimal128"""
+    from datetime import datetime
+    import bson
+    from bson.raw_bson import RawBSONDocument
+    
+    oid = bson.ObjectId()
+    fecha = datetime(2024, 3, 1, 8, 30)
+    raw = RawBSONDocument(bson.encode({
+        '_id': oid,
+        'visitas': [[fecha, {'fecha': fecha}]],
+        'dosis': bson.Decimal128('2.50')
+    }))
+    
+    datos = json.loads(client.application.json.dumps({'ensayo': raw}))
+    assert datos['ensayo'] == {
+        '_id': str(oid),
+        'visitas': [['2024-03-01T08:30:00', {'fecha': '2024-03-01T08:30:00'}]],
+        'dosis': '2.50'
+    }
+
+
+def test_estadisticas_incrementales_coinciden_con_reconstruccion(client, auth_token):
+    """Test: Crear y archivar ensayos mantiene el resumen igual que una reconstrucción"""
+    from app import get_mongo_db, get_redis_client
+    from app.services.estadisticas_ensayos import EstadisticasEnsayosService
+    
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    antes = json.loads(client.get('/api/ensayos/estadisticas', headers=headers).data)
+    
+    response = client.post('/api/ensayos/', headers=headers, json={
+        'codigo_ensayo': 'PF-TEST-EST-001',
+        'farmaco': 'TestStat',
+        'fase': 2,
+        'estado': 'reclutamiento',
+        'centros_participantes': [{'pacientes_reclutados': 10, 'meta_pacientes': 40}]
+    })
+    ensayo_id = json.loads(response.data)['ensayo']['_id']
+    client.delete(f'/api/ensayos/{ensayo_id}', headers=headers)
+    
+    despues = json.loads(client.get('/api/ensayos/estadisticas', headers=headers).data)
+    assert despues['total_ensayos'] == antes['total_ensayos'] + 1
+    assert despues['activos'] == antes['activos']
+    
+    EstadisticasEnsayosService.reconstruir(get_redis_client(), get_mongo_db().ensayos_clinicos)
+    reconstruidas = json.loads(client.get('/api/ensayos/estadisticas', headers=headers).data)
+    despues.pop('reconstruido_en')
+    reconstruidas.pop('reconstruido_en')
+    assert despues == reconstruidas
+
+
+def test_estadisticas_ignoran_contribuciones_con_version_atrasada(client):
+    """Test: Un hook atrasado (versión menor) o posterior a un borrado no pisa la contribución"""
+    from bson import ObjectId
+    from app import get_mongo_db, get_redis_client
+    from app.services.estadisticas_ensayos import EstadisticasEnsayosService
+    
+    redis_client = get_redis_client()
+    collection = get_mongo_db().ensayos_clinicos
+    antes = EstadisticasEnsayosService.obtener(redis_client, collection)['reclutamiento']['pacientes_reclutados']
+    
+    def ensayo(version, reclutados):
+        return {'estado': 'reclutamiento', 'fase': 2, 'metadata': {'version_documento': version},
+                'centros_participantes': [{'pacientes_reclutados': reclutados}]}
+    
+    ensayo_id = ObjectId()
+    EstadisticasEnsayosService.registrar(redis_client, ensayo_id, ensayo(2, 30))
+    EstadisticasEnsayosService.registrar(redis_client, ensayo_id, ensayo(1, 10))
+    despues = EstadisticasEnsayosService.obtener(redis_client, collection)
+    assert despues['reclutamiento']['pacientes_reclutados'] == antes + 30
+    
+    EstadisticasEnsayosService.registrar(redis_client, ensayo_id, None)
+    EstadisticasEnsayosService.registrar(redis_client, ensayo_id, ensayo(2, 30))
+    despues = EstadisticasEnsayosService.obtener(redis_client, collection)
+    assert despues['reclutamiento']['pacientes_reclutados'] == antes
+
+
+def test_fase_promedio_solo_cuenta_fases_numericas(client):
+    """Test: Una fase ausente, de texto o booleana cuenta en el total pero no en fase_promedio"""
+    from bson import ObjectId
+    from app import get_mongo_db, get_redis_client
+    from app.services.estadisticas_ensayos import EstadisticasEnsayosService
+
+    redis_client = get_redis_client()
+    collection = get_mongo_db().ensayos_clinicos
+    EstadisticasEnsayosService.obtener(redis_client, collection)
+
+    estado = f'test_fase_{uuid.uuid4().hex[:12]}'
+    ensayos = {ObjectId(): {'estado': estado, **fase}
+               for fase in ({'fase': 2}, {'fase': 3}, {'fase': 'II'}, {'fase': True}, {})}
+    for ensayo_id, ensayo in ensayos.items():
+        EstadisticasEnsayosService.registrar(redis_client, ensayo_id, ensayo)
+
+    try:
+        resumen = EstadisticasEnsayosService.obtener(redis_client, collection)
+        assert next(e for e in resumen['por_estado'] if e['_id'] == estado) == {
+            '_id': estado, 'total': 5, 'fase_promedio': 2.5
+        }
+
+        for ensayo_id in list(ensayos)[:2]:
+            EstadisticasEnsayosService.registrar(redis_client, ensayo_id, None)
+        resumen = EstadisticasEnsayosService.obtener(redis_client, collection)
+        assert next(e for e in resumen['por_estado'] if e['_id'] == estado)['fase_promedio'] is None
+    finally:
+        for ensayo_id in ensayos:
+            EstadisticasEnsayosService.registrar(redis_client, ensayo_id, None)
+
+
+def test_reconstruccion_relee_ensayos_escritos_durante_el_recorrido(client):
+    """Test: Una escritura que llega mientras se recorre la colección no se pierde al sustituir el resumen"""
+    from pymongo import ReturnDocument
+    from app import get_mongo_db, get_redis_client
+    from app.services.estadisticas_ensayos import EstadisticasEnsayosService, CAMPOS_ESTADISTICAS
+    
+    redis_client = get_redis_client()
+    collection = get_mongo_db().ensayos_clinicos
+    ensayo_id = collection.insert_one({
+        'codigo_ensayo': 'PF-TEST-RECONSTRUIR-001', 'estado': 'reclutamiento', 'fase': 2,
+        'metadata': {'version_documento': 1}, 'centros_participantes': [{'pacientes_reclutados': 5}]
+    }).inserted_id
+    
+    class ColeccionConEscrituraConcurrente:
+        """El recorrido ve la versión 1; entretanto un hook registra la 2"""
+        
+        def __init__(self):
+            self.primer_recorrido = True
+        
+        def find(self, *args, **kwargs):
+            documentos = list(collection.find(*args, **kwargs))
+            if self.primer_recorrido:
+                self.primer_recorrido = False
+                actualizado = collection.find_one_and_update(
+                    {'_id': ensayo_id},
+                    {'$set': {'centros_participantes': [{'pacientes_reclutados': 50}]},
+                     '$inc': {'metadata.version_documento': 1}},
+                    projection=CAMPOS_ESTADISTICAS, return_document=ReturnDocument.AFTER
+                )
+                EstadisticasEnsayosService.registrar(redis_client, ensayo_id, actualizado)
+            return Recorrido(documentos)
+    
+    class Recorrido(list):
+        def batch_size(self, n):
+            return self
+    
+    try:
+        EstadisticasEnsayosService.reconstruir(redis_client, ColeccionConEscrituraConcurrente())
+        
+        entrada = json.loads(redis_client.hget(EstadisticasEnsayosService.CLAVE_CONTRIBUCIONES, str(ensayo_id)))
+        assert entrada['version'] == 2
+        assert entrada['aporte']['pacientes_reclutados'] == 50
+        assert not redis_client.exists(EstadisticasEnsayosService.CLAVE_RECONSTRUYENDO)
+    finally:
+        collection.delete_one({'_id': ensayo_id})
+        EstadisticasEnsayosService.reconstruir(redis_client, collection)
+
+
+def test_actualizar_ensayo_con_if_match_rechaza_version_antigua(client, auth_token):
+    """Test: Dos ediciones con la misma ETag: la segunda recibe 412 y no sobrescribe"""
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/ensayos/', headers=headers, json={
+        'codigo_ensayo': 'PF-TEST-ETAG-001',
+        'farmaco': 'TestEtag',
+        'fase': 1,
+        'estado': 'reclutamiento'
+    })
+    assert response.status_code == 201
+    assert response.headers['ETag'] == '"1"'
+    ensayo_id = json.loads(response.data)['ensayo']['_id']
+    
+    response = client.put(f'/api/ensayos/{ensayo_id}', json={'fase': 2},
+                          headers={**headers, 'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"2"'
+    assert json.loads(response.data)['ensayo']['fase'] == 2
+    
+    response = client.put(f'/api/ensayos/{ensayo_id}', json={'fase': 3},
+                          headers={**headers, 'If-Match': '"1"'})
+    assert response.status_code == 412
+    
+    response = client.get(f'/api/ensayos/{ensayo_id}', headers=headers)
+    assert json.loads(response.data)['fase'] == 2
+    assert response.headers['ETag'] == '"2"'
+    
+    for cuerpo in ({'metadata': {'version_documento': 1}}, {'metadata.version_documento': 1},
+                   {'version_documento': 1}):
+        response = client.put(f'/api/ensayos/{ensayo_id}', json=cuerpo, headers=headers)
+        assert response.status_code == 400
+    
+    response = client.delete(f'/api/ensayos/{ensayo_id}', headers=headers)
+    assert response.status_code == 200
+    response = client.get(f'/api/ensayos/{ensayo_id}', headers=headers)
+    assert response.headers['ETag'] == '"3"'
+
+
+def test_efectos_secundarios_van_a_buckets(client, auth_token):
+    """Test: Los efectos secundarios no crecen dentro del ensayo y entran en el ranking"""
+    from bson import ObjectId
+    from app import get_mongo_db
+    
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    # Únicos por ejecución: Mongo no se vacía entre tests
+    sufijo = uuid.uuid4().hex[:12]
+    principio_activo = f'compuesto_test_ea_{sufijo}'
+    
+    response = client.post('/api/ensayos/', headers=headers, json={
+        'codigo_ensayo': f'PF-TEST-EA-{sufijo}',
+        'farmaco': 'TestEfectos',
+        'principio_activo': principio_activo,
+        'fase': 2,
+        'estado': 'en_curso'
+    })
+    ensayo_id = json.loads(response.data)['ensayo']['_id']
+    
+    try:
+        for severidad in ('leve', 'grave'):
+            response = client.post(f'/api/ensayos/{ensayo_id}/efectos-secundarios', headers=headers,
+                                   json={'tipo': 'cefalea', 'frecuencia': '15%', 'severidad': severidad})
+            assert response.status_code == 200
+        
+        response = client.post(f'/api/ensayos/{ensayo_id}/efectos-secundarios', headers=headers,
+                               json={'tipo': 'cefalea', 'frecuencia': 'a veces', 'severidad': 'leve'})
+        assert response.status_code == 400
+        
+        ensayo = json.loads(client.get(f'/api/ensayos/{ensayo_id}', headers=headers).data)
+        assert 'efectos_secundarios_frecuentes' not in ensayo.get('resultados_intermedios', {})
+        
+        response = client.get(f'/api/ensayos/efectos-adversos/ranking?principio_activo={principio_activo}',
+                              headers=headers)
+        efecto = json.loads(response.data)['compuestos'][0]['efectos'][0]
+        assert efecto == {'tipo': 'cefalea', 'eventos': 2, 'ensayos': 1,
+                          'frecuencia_media': 15.0, 'severidad_media': 2.0, 'graves': 1}
+    finally:
+        mongo_db = get_mongo_db()
+        mongo_db.efectos_adversos.delete_many({'ensayo_id': ObjectId(ensayo_id)})
+        mongo_db.ensayos_clinicos.delete_one({'_id': ObjectId(ensayo_id)})
+
+
+def test_efectos_secundarios_embebidos_se_rechazan(client, auth_token):
+    """Test: Crear, importar o actualizar con efectos embebidos es un 400; solo entran por buckets"""
+    from bson import ObjectId
+    from app import get_mongo_db
+
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    sufijo = uuid.uuid4().hex[:12]
+    efectos = [{'tipo': 'cefalea', 'frecuencia': '15%', 'severidad': 'leve'}]
+    ensayo = {'codigo_ensayo': f'PF-TEST-EMB-{sufijo}', 'farmaco': 'TestEmbebidos',
+              'fase': 2, 'estado': 'en_curso'}
+
+    response = client.post('/api/ensayos/', headers=headers, json={
+        **ensayo, 'resultados_intermedios': {'efectos_secundarios_frecuentes': efectos}
+    })
+    assert response.status_code == 400
+    assert 'efectos_secundarios_frecuentes' in json.loads(response.data)['error']
+
+    with pytest.raises(ValueError, match='efectos_secundarios_frecuentes'):
+        preparar_ensayo({**ensayo, 'resultados_intermedios': {'efectos_secundarios_frecuentes': []}}, 'test')
+
+    response = client.post('/api/ensayos/', headers=headers, json={
+        **ensayo, 'resultados_intermedios': {'efectividad_global': 80.0}
+    })
+    assert response.status_code == 201
+    ensayo_id = json.loads(response.data)['ensayo']['_id']
+
+    try:
+        for cuerpo in ({'resultados_intermedios': {'efectividad_global': 81.0,
+                                                   'efectos_secundarios_frecuentes': efectos}},
+                       {'resultados_intermedios.efectos_secundarios_frecuentes': efectos},
+                       {'resultados_intermedios.efectos_secundarios_frecuentes.0': efectos[0]}):
+            response = client.put(f'/api/ensayos/{ensayo_id}', headers=headers, json=cuerpo)
+            assert response.status_code == 400
+
+        documento = get_mongo_db().ensayos_clinicos.find_one({'_id': ObjectId(ensayo_id)})
+        assert documento['resultados_intermedios'] == {'efectividad_global': 80.0}
+    finally:
+        get_mongo_db().ensayos_clinicos.delete_one({'_id': ObjectId(ensayo_id)})
+
+
+def test_importar_y_exportar_ndjson(client, auth_token):
+    """Test: La importación NDJSON informa errores por línea y la exportación los devuelve"""
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    cuerpo = '\n'.join([
+        json.dumps({'codigo_ensayo': 'PF-TEST-NDJ-001', 'farmaco': 'TestNd', 'fase': 1,
+                    'estado': 'en_curso', 'fecha_inicio': '2024-01-15T00:00:00Z'}),
+        '{no es json',
+        json.dumps({'codigo_ensayo': 'PF-TEST-NDJ-002', 'farmaco': 'TestNd'}),
+        json.dumps({'codigo_ensayo': 'PF-TEST-NDJ-003', 'farmaco': 'TestNd', 'fase': 4,
+                    'estado': 'en_curso'}),
+    ])
+    
+    response = client.post('/api/ensayos/importar', data=cuerpo, headers=headers,
+                           content_type='application/x-ndjson')
+    data = json.loads(response.data)
+    assert response.status_code == 201
+    assert data['insertados'] == 2
+    assert [e['linea'] for e in data['errores']] == [2, 3]
+    
+    response = client.get('/api/ensayos/exportar?fase=4', headers=headers)
+    assert response.mimetype == 'application/x-ndjson'
+    codigos = [json.loads(l)['codigo_ensayo'] for l in response.get_data(as_text=True).splitlines()]
+    assert 'PF-TEST-NDJ-003' in codigos
+
+
+def test_busqueda_avanzada_usa_indices(client):
+    """Test: Ninguna forma de consulta de busqueda_avanzada hace COLLSCAN"""
+    from app import get_mongo_db
+    
+    mongo_db = get_mongo_db()
+    asegurar_indices_ensayos(mongo_db)
+    collection = mongo_db.ensayos_clinicos
+    
+    for nombre, criterios in FORMAS_BUSQUEDA_AVANZADA.items():
+        for incluir_archivados in (False, True):
+            consulta = construir_consulta(filtro_busqueda_avanzada(criterios),
+                                          incluir_archivados=incluir_archivados)
+            explain = collection.find(consulta).sort(ORDEN_LISTADO).explain()
+            assert usa_indice(explain), (nombre, incluir_archivados, etapas_plan(explain))
+
+
+def test_busqueda_avanzada_rango_edad(client, auth_token):
+    """Test: edad_maxima filtra y un rango invertido devuelve 400"""
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/ensayos/busqueda/avanzada', headers=headers,
+                           json={'edad_minima': 40, 'edad_maxima': 18})
+    assert response.status_code == 400
+    
+    assert filtro_busqueda_avanzada({'edad_minima': 18, 'edad_maxima': 65}) == {
+        'criterios_inclusion.edad_minima': {'$lte': 18},
+        'criterios_inclusion.edad_maxima': {'$gte': 65}
+    }
+
+
+def test_reclutamiento_filtrado_usa_indices_de_centros(client):
+    """Test: Las agregaciones de reclutamiento filtradas por centro no hacen COLLSCAN"""
+    from app import get_mongo_db
+    from app.services.reclutamiento import pipeline_reclutamiento
+    
+    mongo_db = get_mongo_db()
+    asegurar_indices_ensayos(mongo_db)
+    
+    for dimension in ('ensayo', 'ciudad', 'investigador'):
+        for filtros in ({'ciudad': 'Madrid'}, {'investigador': 'Dr. Investigador 1'}):
+            explain = mongo_db.command(
+                'aggregate', 'ensayos_clinicos',
+                pipeline=pipeline_reclutamiento(dimension, incluir_archivados=True, **filtros),
+                explain=True
+            )
+            assert usa_indice(explain), (dimension, filtros, etapas_plan(explain))
+
+
+def test_registrar_inclusiones_incrementa_centro(client, auth_token):
+    """Test: El $inc de reclutamiento suma sobre el centro indicado y versiona el ensayo"""
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/ensayos/', headers=headers, json={
+        'codigo_ensayo': 'PF-TEST-REC-001',
+        'farmaco': 'TestRecluta',
+        'fase': 2,
+        'estado': 'reclutamiento',
+        'centros_participantes': [
+            {'nombre': 'Hospital A', 'ciudad': 'Madrid', 'pacientes_reclutados': 5, 'meta_pacientes': 50},
+            {'nombre': 'Hospital B', 'ciudad': 'Sevilla', 'pacientes_reclutados': 0, 'meta_pacientes': 20}
+        ]
+    })
+    ensayo_id = json.loads(response.data)['ensayo']['_id']
+    
+    response = client.post(f'/api/ensayos/{ensayo_id}/centros/reclutamiento', headers=headers,
+                           json={'centro': 'Hospital B', 'pacientes': 3})
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data['pacientes_reclutados'] == 3
+    assert data['version_documento'] == 2
+    
+    response = client.post(f'/api/ensayos/{ensayo_id}/centros/reclutamiento', headers=headers,
+                           json={'centro': 'Hospital Z', 'pacientes': 1})
+    assert response.status_code == 404
+    
+    response = client.get('/api/ensayos/reclutamiento/ciudades?ciudad=Sevilla', headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data)['filas'][0]['ciudad'] == 'Sevilla'
+    
+    headers_investigador = {'Authorization': f"Bearer {token_con_rol(client, 'investigador')}"}
+    response = client.post(f'/api/ensayos/{ensayo_id}/centros/reclutamiento', headers=headers_investigador,
+                           json={'centro': 'Hospital B', 'pacientes': 1})
+    assert response.status_code == 403
+
+
+# ============================================
+# TESTS DE INTERACCIONES EN MEMORIA
+# ============================================
+
+def test_instantanea_interacciones_devuelve_filas_como_cypher():
+    """Test: La instantánea CSR devuelve cada interacción en ambos sentidos, graves primero"""
+    instantanea = InstantaneaInteracciones(
+        version=1,
+        medicamentos=[('MED001', 'Paracetamol'), ('MED002', 'Ibuprofeno'), ('MED003', 'Amoxicilina')],
+        interacciones=[
+            ('MED001', 'MED002', 'leve', 'Daño hepático', 'Monitorizar'),
+            ('MED002', 'MED003', 'grave', 'Reduce concentración', 'Separar tomas'),
+            # La misma interacción en sentido contrario no se duplica (DISTINCT)
+            ('MED003', 'MED002', 'grave', 'Reduce concentración', 'Separar tomas'),
+        ]
+    )
+    
+    filas = instantanea.verificar(['MED001', 'MED002', 'MED003', 'MED999'])
+    
+    assert [(f['medicamento_a_id'], f['medicamento_b_id'], f['severidad']) for f in filas] == [
+        ('MED002', 'MED003', 'grave'), ('MED003', 'MED002', 'grave'),
+        ('MED001', 'MED002', 'leve'), ('MED002', 'MED001', 'leve'),
+    ]
+    assert resumir_interacciones(filas)['resumen'] == {'graves': 2, 'moderadas': 0, 'leves': 2}
+    assert instantanea.verificar(['MED001', 'MED003']) == []
+
+
+def instantanea_de_prueba():
+    """Instantánea pequeña para las rutas que verifican en memoria"""
+    return InstantaneaInteracciones(
+        version=1,
+        medicamentos=[('MED001', 'Paracetamol'), ('MED002', 'Ibuprofeno'), ('MED003', 'Amoxicilina')],
+        interacciones=[
+            ('MED001', 'MED002', 'leve', 'Daño hepático', 'Monitorizar'),
+            ('MED002', 'MED003', 'grave', 'Reduce concentración', 'Separar tomas'),
+        ]
+    )
+
+
+def test_verificar_lote_coincide_con_verificar_en_orden(monkeypatch):
+    """Test: verificar_lote devuelve cada lista en su posición con las mismas filas que verificar"""
+    instantanea = instantanea_de_prueba()
+    monkeypatch.setattr(GrafoInteraccionesService, 'instantanea', staticmethod(lambda *a, **k: instantanea))
+    listas = [['MED001', 'MED002'], ['MED002', 'MED003', 'MED001'], ['MED001', 'MED003'],
+              ['MED003', 'MED002'], ['MED999', 'MED001']]
+    
+    resultados = list(GrafoInteraccionesService.verificar_lote(listas, None, None, tamano_lote=2))
+    
+    assert [posicion for posicion, _, _ in resultados] == list(range(len(listas)))
+    for posicion, filas, origen in resultados:
+        assert origen == 'memoria'
+        assert resumir_interacciones(filas) == \
+            resumir_interacciones(GrafoInteraccionesService.verificar(listas[posicion], None, None)[0])
+
+
+def test_verificar_interacciones_lote_responde_ndjson_en_orden(client, auth_token, monkeypatch):
+    """Test: Una línea por lista en el orden recibido, error en las inválidas y el resumen de la ruta simple"""
+    instantanea = instantanea_de_prueba()
+    monkeypatch.setattr(GrafoInteraccionesService, 'instantanea', staticmethod(lambda *a, **k: instantanea))
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/interacciones/verificar-interacciones/lote', headers=headers, json={'listas': [
+        {'id': 'paciente-1', 'medicamentos': ['MED002', 'MED003']},
+        ['MED001'],
+        ['MED001', 'MED002', 'MED003'],
+        {'id': 'paciente-4', 'medicamentos': ['MED001', 7]},
+        ['MED001', 'MED003']
+    ]})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lineas = [json.loads(linea) for linea in response.data.decode().splitlines()]
+    
+    assert [linea['id'] for linea in lineas] == ['paciente-1', 1, 2, 'paciente-4', 4]
+    assert 'error' in lineas[1] and 'error' in lineas[3]
+    for linea, medicamentos in ((lineas[0], ['MED002', 'MED003']), (lineas[2], ['MED001', 'MED002', 'MED003']),
+                                (lineas[4], ['MED001', 'MED003'])):
+        simple = json.loads(client.post('/api/interacciones/verificar-interacciones', headers=headers,
+                                        json={'medicamentos': medicamentos}).data)
+        assert linea['origen'] == 'memoria'
+        assert {k: v for k, v in linea.items() if k not in ('id', 'origen')} == simple
+    
+    for cuerpo in ({'listas': []}, {'listas': 'MED001,MED002'}, {}):
+        response = client.post('/api/interacciones/verificar-interacciones/lote', headers=headers, json=cuerpo)
+        assert response.status_code == 400
+
+
+def test_verificar_interacciones_lote_informa_tramos_que_fallan(client, auth_token, monkeypatch):
+    """Test: Si Cypher falla en un tramo ya enviada la cabecera, sus listas reciben línea de error y se sigue"""
+    import app.routes.interacciones as rutas_interacciones
+    
+    llamadas = []
+    
+    def verificar_cypher_lote(driver, listas):
+        llamadas.append(len(listas))
+        if len(llamadas) == 2:
+            raise RuntimeError('Neo4j no disponible')
+        return [[] for _ in listas]
+    
+    monkeypatch.setattr(rutas_interacciones, 'TAMANO_TRAMO_LOTE', 2)
+    monkeypatch.setattr(GrafoInteraccionesService, 'instantanea', staticmethod(lambda *a, **k: None))
+    monkeypatch.setattr(GrafoInteraccionesService, 'verificar_cypher_lote', staticmethod(verificar_cypher_lote))
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/interacciones/verificar-interacciones/lote', headers=headers, json={'listas': [
+        ['MED001', 'MED002'], ['MED001', 'MED003'], ['MED001'], ['MED002', 'MED003'],
+        ['MED001', 'MED002', 'MED003'], ['MED003', 'MED001']
+    ]})
+    assert response.status_code == 200
+    lineas = [json.loads(linea) for linea in response.data.decode().splitlines()]
+    
+    assert [linea['id'] for linea in lineas] == [0, 1, 2, 3, 4, 5]
+    assert [linea.get('origen') for linea in lineas] == ['neo4j', 'neo4j', None, None, None, 'neo4j']
+    assert 'Neo4j no disponible' in lineas[3]['error'] and 'Neo4j no disponible' in lineas[4]['error']
+    assert llamadas == [2, 2, 1]
+
+
+def test_cribado_de_venta_solo_devuelve_pares_con_el_medicamento_nuevo():
+    """Test: Cada par con un medicamento nuevo aparece una vez y los pares ya dispensados no se repiten"""
+    instantanea = InstantaneaInteracciones(
+        version=1,
+        medicamentos=[('MED001', 'Paracetamol'), ('MED002', 'Ibuprofeno'), ('MED003', 'Amoxicilina')],
+        interacciones=[
+            ('MED001', 'MED002', 'leve', 'Daño hepático', 'Monitorizar'),
+            ('MED002', 'MED003', 'grave', 'Reduce concentración', 'Separar tomas'),
+        ]
+    )
+    
+    filas = interacciones_nuevas(instantanea, ['MED003'], ['MED001', 'MED002'])
+    assert [(f['medicamento_a_id'], f['medicamento_b_id']) for f in filas] == [('MED003', 'MED002')]
+    
+    carrito = interacciones_nuevas(instantanea, ['MED001', 'MED002', 'MED003'], [])
+    assert [(f['medicamento_a_id'], f['medicamento_b_id'], f['severidad']) for f in carrito] == [
+        ('MED002', 'MED003', 'grave'), ('MED001', 'MED002', 'leve'),
+    ]
+    assert interacciones_nuevas(instantanea, ['MED001'], ['MED003', 'MED999']) == []
+
+
+def test_venta_con_interaccion_grave_responde_409_y_sin_cribado_503(client, auth_token, monkeypatch):
+    """Test: La venta no se hace si el cribado bloquea (409) ni si no puede cribar con política cerrada (503)"""
+    import app.services.cribado_ventas as cribado_ventas
+    
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    # El mapeo lote -> medicamento es por proceso y los ids se repiten entre tests
+    monkeypatch.setitem(cribado_ventas._mapeo, 'lotes', {})
+    instantanea = instantanea_de_prueba()
+    monkeypatch.setattr(GrafoInteraccionesService, 'instantanea', staticmethod(lambda *a, **k: instantanea))
+    
+    prod_response = client.post('/api/inventario/productos', headers=headers, json={
+        'codigo_barras': 'CRIB001',
+        'nombre': 'Amoxicilina Test',
+        'tipo_medicamento': 'generico',
+        'precio_base': 8.00,
+        'medicamento_id': 'MED003'
+    })
+    producto_id = json.loads(prod_response.data)['producto']['id']
+    lote_response = client.post('/api/inventario/lotes', headers=headers, json={
+        'producto_id': producto_id,
+        'numero_lote': 'LOTE-CRIB-001',
+        'cantidad_inicial': 10,
+        'fecha_fabricacion': '2024-01-01',
+        'fecha_caducidad': '2027-01-01',
+        'precio_compra': 5.00,
+        'precio_venta': 8.00
+    })
+    lote = json.loads(lote_response.data)['lote']
+    venta = {'lote_id': lote['id'], 'cantidad': 1, 'version': lote['version'],
+             'cribar': True, 'medicamentos_paciente': ['MED002']}
+    
+    response = client.post('/api/inventario/transacciones/venta', headers=headers, json=venta)
+    assert response.status_code == 409
+    data = json.loads(response.data)
+    assert data['tipo'] == 'interaccion_detectada'
+    assert [(f['medicamento_a_id'], f['medicamento_b_id'], f['severidad'])
+            for f in data['cribado']['interacciones']] == [('MED003', 'MED002', 'grave')]
+    
+    monkeypatch.setattr(GrafoInteraccionesService, 'instantanea', staticmethod(lambda *a, **k: None))
+    monkeypatch.setitem(client.application.config, 'CRIBADO_POLITICA', 'cerrada')
+    response = client.post('/api/inventario/transacciones/venta', headers=headers, json=venta)
+    assert response.status_code == 503
+    assert json.loads(response.data)['cribado']['motivo'] == 'instantanea'
+    
+    def mapeo_caido(*args, **kwargs):
+        raise OperationalError('SELECT', {}, Exception('MySQL no disponible'))
+    
+    monkeypatch.setattr(CribadoVentasService, 'medicamentos_de_lotes', staticmethod(mapeo_caido))
+    response = client.post('/api/inventario/transacciones/venta', headers=headers, json=venta)
+    assert response.status_code == 503
+    assert json.loads(response.data)['cribado']['motivo'] == 'mysql'
+    
+    assert db.session.get(Lote, lote['id']).cantidad_actual == 10
+
+
+def test_cribado_comprueba_el_presupuesto_antes_de_cada_paso(monkeypatch):
+    """Test: Sin presupuesto no se consulta la sesión; un timeout de la sesión deja el cribado no_disponible"""
+    from redis.exceptions import TimeoutError as RedisTimeoutError
+    
+    class Sesiones:
+        def __init__(self, error=None):
+            self.error, self.consultas = error, 0
+        
+        def smembers(self, clave):
+            self.consultas += 1
+            if self.error:
+                raise self.error
+            return {'MED002'}
+    
+    def mapeo_lento(lote_ids, ttl=300):
+        time.sleep(0.01)
+        return {l: 'MED003' for l in lote_ids}
+    
+    instantanea = instantanea_de_prueba()
+    monkeypatch.setattr(GrafoInteraccionesService, 'instantanea', staticmethod(lambda *a, **k: instantanea))
+    monkeypatch.setattr(CribadoVentasService, 'medicamentos_de_lotes', staticmethod(mapeo_lento))
+    
+    sesiones = Sesiones()
+    resultado = CribadoVentasService.cribar([1], None, None, sesion='s1', presupuesto_ms=1, redis_sesion=sesiones)
+    assert (resultado['estado'], resultado['motivo']) == ('no_disponible', 'presupuesto')
+    assert sesiones.consultas == 0
+    
+    sesiones = Sesiones(RedisTimeoutError('Timeout reading from socket'))
+    resultado = CribadoVentasService.cribar([1], None, None, sesion='s1', presupuesto_ms=1000, redis_sesion=sesiones)
+    assert (resultado['estado'], resultado['motivo']) == ('no_disponible', 'redis')
+    
+    resultado = CribadoVentasService.cribar([1], None, None, sesion='s1', presupuesto_ms=1000, redis_sesion=Sesiones())
+    assert resultado['estado'] == 'interacciones' and resultado['bloquear'] is True
+
+
+def test_marca_nueva_hereda_interacciones_de_su_principio_activo():
+    """Test: Una marca sin aristas propias recibe la interacción inferida con su procedencia"""
+    tabla = agregar_por_clase('principio_activo', [
+        {'clase_a': 'PA003', 'clase_b': 'PA002', 'fuente_a': 'MED003', 'fuente_b': 'MED002',
+         'severidad': 'grave', 'descripcion': 'Reduce concentración', 'recomendaciones': 'Separar tomas'},
+        {'clase_a': 'PA002', 'clase_b': 'PA003', 'fuente_a': 'MED005', 'fuente_b': 'MED003',
+         'severidad': 'leve', 'descripcion': 'Molestias', 'recomendaciones': None},
+    ])
+    assert [(t['clase_a'], t['clase_b']) for t in tabla] == [('PA002', 'PA003')]
+    assert tabla[0]['propiedades']['severidad'] == 'grave'
+    assert tabla[0]['propiedades']['fuentes'] == 2
+    
+    instantanea = InstantaneaInteracciones(
+        version=1,
+        medicamentos=[('MED002', 'Ibuprofeno'), ('MED003', 'Amoxicilina'), ('MED004', 'Ibuprofeno Genérico')],
+        interacciones=[('MED002', 'MED003', 'grave', 'Reduce concentración', 'Separar tomas')],
+        clases=[('MED002', ['PA002'], []), ('MED003', ['PA003'], []), ('MED004', ['PA002'], [])],
+        inferidas=[('principio_activo', t['clase_a'], t['clase_b'], t['propiedades']['severidad'],
+                    t['propiedades']['descripcion'], t['propiedades']['recomendaciones'],
+                    t['propiedades']['fuente_a'], t['propiedades']['fuente_b'], t['propiedades']['fuentes'])
+                   for t in tabla]
+    )
+    
+    # El par con arista directa no se duplica como inferido
+    assert all('inferida' not in f for f in instantanea.verificar(['MED002', 'MED003']))
+    
+    filas = instantanea.verificar(['MED004', 'MED003'])
+    assert [(f['medicamento_a_id'], f['medicamento_b_id'], f['severidad']) for f in filas] == [
+        ('MED003', 'MED004', 'grave'), ('MED004', 'MED003', 'grave'),
+    ]
+    assert filas[1]['inferida'] is True
+    assert filas[1]['procedencia'] == {
+        'via': 'principio_activo', 'clase_a': 'PA002', 'clase_b': 'PA003',
+        'fuente_a_id': 'MED002', 'fuente_b_id': 'MED003', 'fuentes': 2
+    }
+
+
+def test_sustitutos_se_ordenan_por_jaccard_de_principios_y_categorias():
+    """Test: Solo entran medicamentos con un rasgo común; la misma composición va primero"""
+    rasgos = {
+        'MED001': rasgos_medicamento(['PA001'], ['Analgésicos']),
+        'MED002': rasgos_medicamento(['PA002'], ['Analgésicos', 'Antiinflamatorios']),
+        'MED003': rasgos_medicamento(['PA003'], ['Antibióticos']),
+        'MED004': rasgos_medicamento(['PA001'], ['Analgésicos']),
+    }
+    indice = {}
+    for medicamento_id, propios in rasgos.items():
+        for rasgo in propios:
+            indice.setdefault(rasgo, set()).add(medicamento_id)
+    
+    assert similares('MED001', rasgos, indice) == [['MED004', 1.0], ['MED002', 0.25]]
+    assert similares('MED003', rasgos, indice) == []
+    assert similares('MED001', rasgos, indice, maximo=1) == [['MED004', 1.0]]
+
+
+def test_carga_del_grafo_prepara_filas_csv_con_hash_estable():
+    """Test: Las celdas CSV se interpretan como JSON salvo las claves y el hash no depende del orden"""
+    medicamentos = next(e for e in ENTIDADES if e.nombre == 'medicamentos')
+    interacciones = next(e for e in ENTIDADES if e.nombre == 'interacciones')
+    
+    operacion, fila = preparar_fila(medicamentos, {'id': '007', 'dosis': '500mg', 'peso': '1.5',
+                                                   'usos': '["a", "b"]', 'vacio': ''}, desde_csv=True)
+    assert operacion == 'upsert'
+    assert fila['clave'] == '007'
+    assert fila['propiedades'] == {'dosis': '500mg', 'peso': 1.5, 'usos': ['a', 'b']}
+    
+    _, reordenada = preparar_fila(medicamentos, '{"usos": ["a", "b"], "peso": 1.5, "dosis": "500mg", "id": "007"}')
+    assert reordenada['hash'] == fila['hash']
+    
+    assert preparar_fila(interacciones, {'medicamento_a_id': 'MED001', 'medicamento_b_id': 'MED002',
+                                         '_operacion': 'borrar'}) == \
+        ('borrar', {'origen': 'MED001', 'destino': 'MED002'})
+    with pytest.raises(ValueError, match='medicamento_b_id es requerido'):
+        preparar_fila(interacciones, {'medicamento_a_id': 'MED001'})
+    with pytest.raises(ValueError, match='anidadas'):
+        preparar_fila(medicamentos, {'id': 'MED001', 'meta': {'x': 1}})
+
+
+def test_carga_delta_respeta_el_orden_de_borrados_y_altas(monkeypatch, tmp_path):
+    """Test: Un borrado seguido de un alta de la misma clave se escribe en ese orden"""
+    import app.services.carga_grafo as carga_grafo
+    from app.services.carga_grafo import CargaGrafoService
+    
+    medicamentos = next(e for e in ENTIDADES if e.nombre == 'medicamentos')
+    escrituras = []
+    
+    def ejecutar_consulta(driver, consulta, parametros):
+        filas = parametros['filas']
+        if consulta is medicamentos.upsert:
+            escrituras.append(('upsert', [f['clave'] for f in filas]))
+            return [{'escritas': len(filas), 'encontradas': len(filas)}]
+        escrituras.append(('borrar', [f['clave'] for f in filas]))
+        return [{'borradas': len(filas)}]
+    
+    monkeypatch.setattr(carga_grafo, 'ejecutar_consulta', ejecutar_consulta)
+    ruta = tmp_path / 'medicamentos.ndjson'
+    ruta.write_text('\n'.join(json.dumps(fila) for fila in [
+        {'id': 'MED001', 'nombre': 'Paracetamol'},
+        {'id': 'MED002', '_operacion': 'borrar'},
+        {'id': 'MED002', 'nombre': 'Ibuprofeno'},
+        {'id': 'MED003', 'nombre': 'Amoxicilina'},
+        {'id': 'MED001', '_operacion': 'borrar'},
+    ]), encoding='utf-8')
+    
+    informe = CargaGrafoService.cargar_entidad(None, medicamentos, str(ruta), tamano_lote=100)
+    
+    assert escrituras == [('upsert', ['MED001']), ('borrar', ['MED002']),
+                          ('upsert', ['MED002', 'MED003']), ('borrar', ['MED001'])]
+    assert informe['escritas'] == 3 and informe['borradas'] == 2
+
+
+def test_sincronizacion_no_salta_huecos_de_ids_recientes():
+    """Test: Un id sin confirmar detiene el watermark hasta que aparece o pasa la espera"""
+    from types import SimpleNamespace
+    
+    ahora = datetime.utcnow()
+    limite = ahora - timedelta(seconds=5)
+    
+    def eventos(*ids, antiguedad=0):
+        return [SimpleNamespace(id=i, fecha=ahora - timedelta(seconds=antiguedad)) for i in ids]
+    
+    def contiguos(*args):
+        aplicables, saltados = eventos_contiguos(*args)
+        return [e.id for e in aplicables], saltados
+    
+    # El 13 pertenece a una transacción que aún no ha confirmado
+    assert contiguos(eventos(11, 12, 14, 15), 10, limite) == ([11, 12], [])
+    assert contiguos(eventos(12, 13), 10, limite) == ([], [])
+    # Al confirmar, el siguiente sondeo continúa desde el mismo watermark
+    assert contiguos(eventos(13, 14, 15), 12, limite) == ([13, 14, 15], [])
+    # Un hueco más antiguo que la espera se salta y se devuelve para revisarlo
+    assert contiguos(eventos(11, 12, 15, antiguedad=30), 10, limite) == ([11, 12, 15], [13, 14])
+
+
+def test_sincronizacion_aplica_eventos_que_confirman_tras_saltar_su_hueco(client, monkeypatch):
+    """Test: Un id saltado se guarda con el watermark y su evento se aplica cuando aparece"""
+    import app.services.sincronizacion_interacciones as sincronizacion
+    from app import get_redis_client
+    from app.models.mysql_models import OutboxInteraccion
+    
+    db.session.add_all([
+        Producto(id=1, codigo_barras='SYNC001', nombre='A', tipo_medicamento='generico',
+                 precio_base=1, medicamento_id='MED001'),
+        Producto(id=2, codigo_barras='SYNC002', nombre='B', tipo_medicamento='generico',
+                 precio_base=1, medicamento_id='MED002'),
+    ])
+    db.session.commit()
+    
+    def evento(id_, interaccion_id, severidad):
+        return {'id': id_, 'interaccion_id': interaccion_id, 'operacion': 'upsert', 'producto_a_id': 1,
+                'producto_b_id': 2, 'severidad': severidad, 'fecha': datetime.utcnow() - timedelta(seconds=60)}
+    
+    escrituras = []
+    
+    def ejecutar_consulta(driver, nombre, parametros):
+        escrituras.append(parametros)
+        return [{'borradas': 0, 'escritas': len(parametros['upsert']), 'watermark': parametros['watermark']}]
+    
+    monkeypatch.setattr(sincronizacion, 'ejecutar_consulta', ejecutar_consulta)
+    servicio = sincronizacion.SincronizacionInteraccionesService
+    
+    # El 2 lleva más de espera_huecos sin confirmar: se salta y queda en revisión
+    db.session.execute(insert(OutboxInteraccion.__table__), [evento(1, 10, 'leve'), evento(3, 30, 'leve')])
+    db.session.commit()
+    huecos = {}
+    resultado = servicio.aplicar_lote(None, get_redis_client(), 0, espera_huecos=5, huecos=huecos)
+    assert resultado['watermark'] == 3 and resultado['huecos_saltados'] == 1
+    assert list(huecos) == [2]
+    assert escrituras[-1]['huecos'] == [2]
+    
+    # Su transacción confirma tarde: se aplica aunque el watermark ya lo pasó
+    db.session.execute(insert(OutboxInteraccion.__table__), [evento(2, 20, 'grave')])
+    db.session.commit()
+    resultado = servicio.aplicar_lote(None, get_redis_client(), 3, espera_huecos=5, huecos=huecos)
+    assert resultado['tardios'] == 1 and resultado['watermark'] == 3
+    assert [f['interaccion_id'] for f in escrituras[-1]['upsert']] == [20]
+    assert huecos == {} and escrituras[-1]['huecos'] == []
+    
+    assert servicio.aplicar_lote(None, get_redis_client(), 3, espera_huecos=5, huecos=huecos) is None
+
+
+def test_sincronizacion_compacta_eventos_del_outbox_por_interaccion_y_par():
+    """Test: Queda el último evento de cada interacción y par; un cambio de par borra el anterior"""
+    from types import SimpleNamespace
+    
+    def evento(interaccion_id, operacion, a, b, severidad='moderada'):
+        return SimpleNamespace(interaccion_id=interaccion_id, operacion=operacion, producto_a_id=a,
+                               producto_b_id=b, severidad=severidad, descripcion='d', recomendaciones=None)
+    
+    mapeo = {1: 'MED001', 2: 'MED002', 3: 'MED003'}
+    borrar, upsert, sin_mapeo = compactar_eventos([
+        evento(10, 'upsert', 1, 2, 'leve'),
+        evento(10, 'upsert', 1, 2, 'grave'),
+        evento(10, 'borrar', 1, 2),
+        evento(10, 'upsert', 1, 3),
+        evento(11, 'upsert', 2, 99)
+    ], mapeo)
+    
+    assert borrar == [{'interaccion_id': 10, 'origen': 'MED001', 'destino': 'MED002'}]
+    assert [(f['origen'], f['destino']) for f in upsert] == [('MED001', 'MED003')]
+    assert upsert[0]['propiedades']['interaccion_mysql_id'] == 10
+    assert sin_mapeo == 1
+
+
+def test_registro_de_consultas_cypher_rechaza_parametros_no_declarados():
+    """Test: El registro se valida al arrancar y el filtro de severidad va como parámetro"""
+    validar_consultas()
+    assert '$severidad' in CONSULTAS['interacciones_medicamento'].texto
+    
+    with pytest.raises(ValueError, match='no declarados'):
+        validar_consultas([ConsultaCypher('prueba', 'MATCH (m {id: $id}) RETURN m')])
+    with pytest.raises(ValueError, match='escritura'):
+        validar_consultas([ConsultaCypher('prueba', 'MATCH (m {id: $id}) SET m.x = 1', ['id'])])
+
+
+def test_consulta_cortada_en_max_filas_queda_marcada_y_cuenta_sus_textos():
+    """Test: Las filas cortadas llevan truncada=True y las métricas cuentan los textos enviados por nombre"""
+    class Registro(dict):
+        def data(self):
+            return dict(self)
+    
+    class Resultado(list):
+        def consume(self):
+            return type('Resumen', (), {'result_available_after': 1, 'result_consumed_after': 1})()
+    
+    class Sesion:
+        def execute_read(self, transaccion):
+            tx = type('Tx', (), {'run': lambda self, texto, parametros: Resultado(Registro(n=i) for i in range(5))})()
+            return transaccion(tx)
+    
+    nombre = f'prueba_{uuid.uuid4().hex[:8]}'
+    filas = _ejecutar_en_sesion(Sesion(), ConsultaCypher(nombre, 'UNWIND range(1, 5) AS n RETURN n', max_filas=3), {})
+    assert filas == [{'n': 0}, {'n': 1}, {'n': 2}] and filas.truncada is True
+    
+    filas = _ejecutar_en_sesion(Sesion(), ConsultaCypher(nombre, 'UNWIND range(0, 4) AS n RETURN n', max_filas=0), {})
+    assert len(filas) == 5 and filas.truncada is False
+    
+    metricas = metricas_consultas.snapshot()[nombre]
+    assert metricas['truncadas'] == 1
+    assert metricas['textos_distintos'] == 2
+
+
+def test_sesiones_neo4j_llevan_base_de_datos_modo_timeout_y_bookmarks(monkeypatch):
+    """Test: Cada consulta abre la sesión y la transacción que le corresponden (driver simulado)"""
+    from neo4j import READ_ACCESS, WRITE_ACCESS
+    import app.services.consultas_grafo as consultas_grafo
+
+    class Resultado(list):
+        def consume(self):
+            return type('Resumen', (), {'result_available_after': None, 'result_consumed_after': None})()
+
+    class Sesion:
+        def __init__(self, driver, opciones):
+            self.driver, self.opciones = driver, opciones
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def _ejecutar(self, modo, transaccion):
+            self.driver.transacciones.append((modo, transaccion.timeout, transaccion.metadata))
+            return transaccion(type('Tx', (), {'run': lambda self, texto, parametros: Resultado()})())
+
+        def execute_read(self, transaccion):
+            return self._ejecutar('lectura', transaccion)
+
+        def execute_write(self, transaccion):
+            return self._ejecutar('escritura', transaccion)
+
+    class Driver:
+        def __init__(self):
+            self.sesiones, self.transacciones = [], []
+
+        def session(self, **opciones):
+            self.sesiones.append(opciones)
+            return Sesion(self, opciones)
+
+    gestor = object()
+    monkeypatch.setitem(consultas_grafo._opciones, 'database', 'farmacia')
+    monkeypatch.setitem(consultas_grafo._opciones, 'timeout', 7)
+    monkeypatch.setitem(consultas_grafo._gestor_bookmarks, 'gestor', gestor)
+
+    prefijo = f'prueba_{uuid.uuid4().hex[:8]}'
+    lectura = ConsultaCypher(f'{prefijo}_lectura', 'RETURN 1 AS n', fetch_size=10)
+    otra_lectura = ConsultaCypher(f'{prefijo}_otra', 'RETURN 2 AS n', fetch_size=500)
+    escritura = ConsultaCypher(f'{prefijo}_escritura', 'CREATE (n:Prueba) RETURN n', escritura=True, timeout=60)
+
+    driver = Driver()
+    ejecutar_consulta(driver, lectura)
+    assert driver.sesiones == [{'database': 'farmacia', 'default_access_mode': READ_ACCESS,
+                                'bookmarks': None, 'bookmark_manager': gestor, 'fetch_size': 10}]
+    assert driver.transacciones == [('lectura', 7, {'consulta': lectura.nombre})]
+
+    driver = Driver()
+    ejecutar_consulta(driver, escritura, bookmarks=['FB:kcwQ'])
+    sesion = driver.sesiones[0]
+    assert (sesion['database'], sesion['default_access_mode'], sesion['bookmark_manager']) == \
+        ('farmacia', WRITE_ACCESS, gestor)
+    assert set(sesion['bookmarks'].raw_values) == {'FB:kcwQ'}
+    assert driver.transacciones == [('escritura', 60, {'consulta': escritura.nombre})]
+
+    # En serie: una sola sesión de lectura con el mayor fetch_size
+    driver = Driver()
+    ejecutar_consultas(driver, [(lectura, {}), (otra_lectura, {})])
+    assert [(s['default_access_mode'], s['fetch_size']) for s in driver.sesiones] == [(READ_ACCESS, 500)]
+    assert [modo for modo, _, _ in driver.transacciones] == ['lectura', 'lectura']
+
+    # Concurrente: una sesión por consulta, cada una con su fetch_size
+    driver = Driver()
+    ejecutar_consultas(driver, [(lectura, {}), (otra_lectura, {})], concurrente=True)
+    assert sorted(s['fetch_size'] for s in driver.sesiones) == [10, 500]
+    assert all(s['database'] == 'farmacia' and s['bookmark_manager'] is gestor for s in driver.sesiones)
+
+    with pytest.raises(ValueError, match='solo admite consultas de lectura'):
+        ejecutar_consultas(Driver(), [(lectura, {}), (escritura, {})])
+
+
+def test_conteos_del_grafo_usan_etiquetas_literales():
+    """Test: Los conteos por etiqueta y tipo son MATCH literales (count store) con nombres escapados"""
+    consulta = consulta_conteos(['Medicamento', 'Raro`x'], ['INTERACCIONA_CON'])
+    
+    assert 'MATCH (n:`Medicamento`) RETURN count(n)' in consulta.texto
+    assert 'MATCH (n:`Raro``x`) RETURN count(n)' in consulta.texto
+    assert 'MATCH ()-[r:`INTERACCIONA_CON`]->() RETURN count(r)' in consulta.texto
+    assert 'labels(' not in consulta.texto
+    assert consulta.parametros == {'etiquetas', 'tipos'}
+
+
+# ============================================
+# TESTS DE MÉTRICAS
+# ============================================
+
+def test_metricas_de_pools_solo_para_gerentes(client):
+    """Test: /metrics/pools exige token de gerente y devuelve los cuatro pools"""
+    assert client.get('/metrics/pools').status_code == 401
+    
+    response = client.get('/metrics/pools',
+        headers={'Authorization': f'Bearer {token_con_rol(client, "farmaceutico")}'}
+    )
+    assert response.status_code == 403
+    
+    response = client.get('/metrics/pools',
+        headers={'Authorization': f'Bearer {token_con_rol(client, "gerente")}'}
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert set(data) == {'mysql', 'mongodb', 'redis', 'neo4j'}
+    assert 'primario' in data['mysql']
+    assert data['neo4j']['tamano_max'] == TestingConfig.NEO4J_MAX_POOL_SIZE
+
+
+def test_metricas_publicas_no_exigen_token(monkeypatch):
+    """Test: Con METRICAS_PUBLICAS las rutas /metrics/* no piden autenticación"""
+    monkeypatch.setattr(TestingConfig, 'METRICAS_PUBLICAS', True)
+    app = create_app('testing')
+    
+    response = app.test_client().get('/metrics/proceso')
+    assert response.status_code == 200
+    assert json.loads(response.data)['pid'] == os.getpid()
+
+
+def test_clientes_no_se_crean_al_importar_ni_al_crear_app():
+    """Test: Importar el paquete y crear la app no abre clientes de backend (seguro con preload)"""
+    codigo = (
+        "import app\n"
+        "antes = (app.mongo_client, app.redis_client, app.neo4j_driver)\n"
+        "app.create_app('testing')\n"
+        "despues = (app.mongo_client, app.redis_client, app.neo4j_driver)\n"
+        "print(antes == despues == (None, None, None))"
+    )
+    resultado = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    
+    assert resultado.stdout.strip().splitlines()[-1] == 'True', resultado.stderr
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requiere os.fork')
+def test_worker_tras_fork_descarta_clientes_del_padre(monkeypatch):
+    """Test: El hook after_in_child olvida los clientes heredados y marca el proceso"""
+    import app as modulo_app
+    
+    monkeypatch.setattr(modulo_app, 'redis_client', object())
+    monkeypatch.setattr(modulo_app, 'neo4j_driver', object())
+    
+    pid = os.fork()
+    if pid == 0:
+        correcto = (modulo_app.redis_client is None and modulo_app.neo4j_driver is None
+                    and modulo_app.metricas_proceso['creado_por_fork']
+                    and modulo_app.metricas_proceso['pid'] == os.getpid())
+        os._exit(0 if correcto else 1)
+    
+    _, estado = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(estado) == 0
+    # El padre conserva los suyos
+    assert modulo_app.redis_client is not None
+
+
+def test_metricas_de_proceso_miden_arranque_y_primera_peticion(client):
+    """Test: /metrics/proceso devuelve el pid y los tiempos de arranque del worker"""
+    token = token_con_rol(client, 'gerente')
+    response = client.get('/metrics/proceso', headers={'Authorization': f'Bearer {token}'})
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['pid'] == os.getpid()
+    assert data['creacion_app_ms'] > 0
+    assert data['primera_peticion_ms'] is not None
+
+
+def test_pool_neo4j_sin_estructura_conocida_queda_sin_instrumentar():
+    """Test: Sin driver._pool el driver se devuelve intacto y las métricas lo indican"""
+    class Pool:
+        def acquire(self, *args, **kwargs):
+            return 'conexion'
+        
+        def release(self, *conexiones):
+            pass
+    
+    class Driver:
+        pass
+    
+    sin_pool = MetricasPool()
+    driver = Driver()
+    assert instrumentar_driver_neo4j(driver, sin_pool) is driver
+    assert sin_pool.snapshot()['instrumentado'] is False
+    
+    con_pool = MetricasPool()
+    driver._pool = Pool()
+    instrumentar_driver_neo4j(driver, con_pool)
+    driver._pool.release(driver._pool.acquire())
+    assert con_pool.snapshot()['instrumentado'] is True
+    assert con_pool.snapshot()['adquisiciones'] == 1
+    assert con_pool.snapshot()['en_uso'] == 0
+
+
 # ============================================
 # TESTS DE AUTORIZACIÓN POR ROL
 # ============================================
@@ -0,0 +1,15 @@
+"""
+Punto de entrada WSGI para producción.
+
+Ejecutar con:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Los clientes de MongoDB, Redis y Neo4j se crean de forma perezosa en cada
+worker después del fork; crear la app no abre conexiones, así que se puede
+activar preload_app (GUNICORN_PRELOAD=true) mientras nada use los clientes
+en el master.
+"""
+import os
+from app import create_app
+
+app = create_app(os.getenv('FLASK_ENV', 'production'))